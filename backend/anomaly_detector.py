@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+class AnomalyDetector:
+    """
+    Detector de comportamientos anómalos alimentado en la ingesta de logs.
+
+    Se llama con cada lote ya escrito en navigation_logs y delega en
+    behavior_anomalies_detect (migración 004), que evalúa en una sola consulta:
+    - Cambio de horario: acceso antes de las 8:00 o después de las 19:59 (UTC)
+    - Sitio inusual: primer acceso del usuario a un dominio (user_known_domains)
+    - Patrón irregular: más de 5 accesos en 10 minutos
+
+    El proceso no guarda estado: los dominios conocidos y la ventana de
+    accesos están en la base de datos y la ventana se cuenta por el timestamp
+    de cada evento. Así da igual qué worker de gunicorn reciba los eventos de
+    un usuario, y los lotes reenviados desde el spool cuentan en su ventana
+    real en lugar de como tráfico actual.
+    """
+
+    def __init__(self, client, normalize, window_seconds=600, burst_threshold=5, work_hours=(8, 19)):
+        self._client = client
+        self._normalize = normalize
+        self._window_seconds = window_seconds
+        self._threshold = burst_threshold
+        self._work_start, self._work_end = work_hours
+
+    def observe(self, rows):
+        """
+        Procesa logs recién ingeridos (filas de navigation_logs) y guarda las
+        anomalías encontradas. Devuelve la lista de anomalías nuevas.
+        """
+        events = []
+        for row in rows:
+            ts = _parse_timestamp(row.get('timestamp'))
+            if ts is None:
+                continue
+            events.append({
+                'tenant_id': row.get('tenant_id'),
+                'user_id': row.get('user_id'),
+                'domain': self._normalize(row.get('domain') or row.get('url') or ''),
+                'label': row.get('domain'),
+                'ts': ts.isoformat()
+            })
+        if not events:
+            return []
+
+        return self._client.rpc('behavior_anomalies_detect', {
+            'p_events': events,
+            'p_window_seconds': self._window_seconds,
+            'p_threshold': self._threshold,
+            'p_work_start': self._work_start,
+            'p_work_end': self._work_end
+        }).execute().data or []
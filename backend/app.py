@@ -1,48 +1,45 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 from supabase import create_client, Client
-from uuid import UUID
+from uuid import UUID, uuid4
 from datetime import datetime, timedelta, timezone
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, create_access_token, get_jwt, verify_jwt_in_request
-from supabase.lib.client_options import ClientOptions
 import json # Importar json
 import requests
 from urllib.parse import urlparse
 import hashlib
+import hmac
+import atexit
+import logging
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from policy_engine import PolicyEngine
+from domain_matcher import domain_suffixes
+from supabase_pool import SupabaseClientPool
+from anomaly_detector import AnomalyDetector
+from pagination import paginate, count_mode
+from suggestions import SuggestionService, SUGGESTION_KINDS
+from prohibited_catalog import ProhibitedCatalog
+from policy_snapshots import PolicySnapshots, policy_payload
+from policy_rules import PolicyRuleSets
+from policy_events import PolicyEventBroker
+from ingest_queue import IngestQueue
+from event_spool import EventSpool
+from query_batch import QueryBatchExecutor
+from membership_cache import MembershipCache
+from download_policies import DownloadPolicyResolver
+from tenant_config import TenantConfigCache
+from logging_setup import configure_logging, logging_stats
+from metrics import RequestMetrics, instrument_postgrest
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Cargar sitios prohibidos desde el archivo JSON
-def load_prohibited_sites():
-    try:
-        print("[Backend] Iniciando carga de sitios prohibidos...")
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            json_path = os.path.join(current_dir, 'prohibidos.json')
-            print(f"[Backend] Ruta del archivo de sitios prohibidos: {json_path}")
-            
-            with open(json_path, 'r', encoding='utf-8') as f:
-                categories = json.load(f)
-                print(f"[Backend] Se cargaron {len(categories)} categorías de sitios prohibidos")
-                return categories
-        except FileNotFoundError:
-            print(f"[Backend] Archivo no encontrado: {json_path}")
-            return {}
-        except json.JSONDecodeError as e:
-            print(f"[Backend] Error al decodificar el archivo JSON: {str(e)}")
-            return {}
-    except Exception as e:
-        print(f"[Backend] Error en load_prohibited_sites: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {}
-
-prohibited_sites = load_prohibited_sites()
+# Logging estructurado y asíncrono (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Función para verificar una URL usando Google Web Risk API
 def check_url_with_webrisk(url):
@@ -68,15 +65,15 @@ def check_url_with_webrisk(url):
         # 1. Verificar políticas específicas del tenant y grupos
         if role == 'user':
             # Obtener grupos del usuario
-            user_groups_res = user_supabase.table('group_users').select('group_id').eq('user_id', user_id).execute()
-            user_groups = [g['group_id'] for g in user_groups_res.data] if user_groups_res.data else []
+            user_groups = user_group_ids(user_supabase, user_id)
             
             # Ejecutar consultas separadas y combinar resultados
             # Primero obtenemos las políticas del tenant sin grupo
+            # (el dominio o cualquiera de sus dominios padre)
             tenant_policies = user_supabase.table('policies').select('*')\
                 .eq('tenant_id', tenant_id)\
                 .is_('group_id', 'null')\
-                .eq('domain', domain)\
+                .in_('domain', domain_suffixes(domain))\
                 .eq('type', 'access')\
                 .execute()
             
@@ -85,7 +82,7 @@ def check_url_with_webrisk(url):
                 # Luego obtenemos las políticas de los grupos del usuario
                 group_policies = user_supabase.table('policies').select('*')\
                     .in_('group_id', user_groups)\
-                    .eq('domain', domain)\
+                    .in_('domain', domain_suffixes(domain))\
                     .eq('type', 'access')\
                     .execute()
             
@@ -97,7 +94,7 @@ def check_url_with_webrisk(url):
             # Para otros roles, simplemente filtramos por tenant_id
             policies = user_supabase.table('policies').select('*')\
                 .eq('tenant_id', tenant_id)\
-                .eq('domain', domain)\
+                .in_('domain', domain_suffixes(domain))\
                 .execute()
             policies_data = policies.data
 
@@ -109,32 +106,24 @@ def check_url_with_webrisk(url):
             return False, None
 
         # 2. Verificar configuración del tenant
-        tenant_config = user_supabase.table('tenant_configs').select('*').eq('tenant_id', tenant_id).maybe_single().execute()
-        
-        if tenant_config.data:
-            config = tenant_config.data
-            if domain in config.get('blocked_domains', []):
-                return True, "Dominio bloqueado por configuración del tenant"
-            if domain in config.get('allowed_domains', []):
-                return False, None
+        config = tenant_configs.get(tenant_id)
+        if config.is_blocked(domain):
+            return True, "Dominio bloqueado por configuración del tenant"
+        if config.is_allowed(domain):
+            return False, None
 
         # 3. Verificar lista global de sitios prohibidos
-        prohibited_sites = load_prohibited_sites()
-        if domain in prohibited_sites:
+        if prohibited_catalog.match(domain) is not None:
             return True, "Dominio en lista global de sitios prohibidos"
 
         return False, None
 
     except Exception as e:
-        print(f"Error en check_url_with_webrisk: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en check_url_with_webrisk: %s", e)
         return False, str(e)
 
     except Exception as e:
-        print(f"Error en check_url_with_webrisk: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en check_url_with_webrisk: %s", e)
         return False, str(e)
 
 def normalize_domain(domain):
@@ -163,7 +152,7 @@ def normalize_domain(domain):
         
         return domain.lower().strip()
     except Exception as e:
-        print(f"[Backend] Error al normalizar dominio {domain}: {str(e)}")
+        logger.error("Error al normalizar dominio %s: %s", domain, e)
         return domain.lower().strip()
 
 app = Flask(__name__)
@@ -175,7 +164,15 @@ app.config['JWT_HEADER_NAME'] = 'Authorization'
 app.config['JWT_HEADER_TYPE'] = 'Bearer'
 jwt = JWTManager(app)
 
-print("JWT_SECRET_KEY:", app.config['JWT_SECRET_KEY'])
+# Latencia, consultas a Supabase y tamaños por endpoint (GET /metrics).
+# Con METRICS_DIR los workers de gunicorn comparten los valores por archivos
+request_metrics = RequestMetrics(
+    directory=os.getenv('METRICS_DIR') or None,
+    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+)
+instrument_postgrest(request_metrics)
+atexit.register(request_metrics.flush)
+
 
 # Configuración de Flask-Limiter
 limiter = Limiter(
@@ -184,6 +181,11 @@ limiter = Limiter(
     default_limits=[]  # No hay límite global, solo por endpoint
 )
 
+# Inicio de la medición de la petición (antes de verificar el token)
+@app.before_request
+def start_request_metrics():
+    g.request_stats = request_metrics.begin_request()
+
 # Middleware para verificar token
 @app.before_request
 def verify_token():
@@ -192,7 +194,7 @@ def verify_token():
             if request.headers.get('Authorization'):
                 verify_jwt_in_request()
         except Exception as e:
-            if request.endpoint not in ['login', 'register']:
+            if request.endpoint not in ['login', 'register', 'get_metrics']:
                 return jsonify({"success": False, "error": "Token inválido o expirado"}), 401
 
 # Configuración más permisiva de CORS para desarrollo y producción
@@ -222,20 +224,134 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' 'unsafe-inline' 'unsafe-eval' http://localhost:* http://127.0.0.1:*; style-src 'self' 'unsafe-inline';"
     return response
 
+# Registro de latencia, consultas y tamaños por endpoint (ruta, no URL concreta)
+@app.after_request
+def record_request_metrics(response):
+    stats = g.pop('request_stats', None)
+    if stats is not None:
+        request_metrics.observe_request(
+            stats,
+            request.url_rule.rule if request.url_rule else 'unmatched',
+            request.method,
+            response.status_code,
+            request_bytes=request.content_length or 0,
+            # None en respuestas en streaming (SSE)
+            response_bytes=response.calculate_content_length()
+        )
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Métricas en formato Prometheus; exige Authorization: Bearer <METRICS_TOKEN>.
+    Sin METRICS_TOKEN el endpoint está cerrado salvo con METRICS_PUBLIC=true
+    (p. ej. en desarrollo o tras una red privada).
+    """
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        if os.getenv('METRICS_PUBLIC', 'false').lower() != 'true':
+            return jsonify({"success": False, "error": "Métricas desactivadas: define METRICS_TOKEN"}), 403
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({"success": False, "error": "No autorizado"}), 401
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # Configuración de Supabase
 supabase: Client = create_client(
     os.getenv("SUPABASE_URL"),
     os.getenv("SUPABASE_KEY")
 )
 
+# Clientes por JWT reutilizados entre peticiones (conexiones keep-alive)
+supabase_pool = SupabaseClientPool(
+    os.getenv("SUPABASE_URL"),
+    os.getenv("SUPABASE_KEY"),
+    maxsize=int(os.getenv('SUPABASE_POOL_SIZE', 256)),
+    ttl=int(os.getenv('SUPABASE_POOL_TTL', 300)),
+    max_connections=int(os.getenv('SUPABASE_POOL_CONNECTIONS', 100))
+)
+
 def get_supabase_with_jwt(jwt_token):
-    options = ClientOptions()
-    options.headers["Authorization"] = f"Bearer {jwt_token}"
-    return create_client(
-        os.getenv("SUPABASE_URL"),
-        os.getenv("SUPABASE_KEY"),
-        options=options
-    )
+    return supabase_pool.get(jwt_token)
+
+# Lecturas independientes de una petición en paralelo (y sin repetir las idénticas)
+query_batches = QueryBatchExecutor(max_workers=int(os.getenv('QUERY_BATCH_WORKERS', 16)))
+
+def request_queries():
+    """QueryBatch de la petición actual"""
+    if 'query_batch' not in g:
+        g.query_batch = query_batches.batch()
+    return g.query_batch
+
+# Grupos de cada usuario, compartidos entre peticiones (las escrituras de grupos los invalidan)
+membership_cache = MembershipCache(
+    ttl=int(os.getenv('MEMBERSHIP_CACHE_TTL', 60)),
+    maxsize=int(os.getenv('MEMBERSHIP_CACHE_SIZE', 10000))
+)
+
+def user_group_ids(user_supabase, user_id):
+    """Lista de group_id del usuario, desde la caché o desde group_users"""
+    def load():
+        res = user_supabase.table('group_users').select('group_id').eq('user_id', user_id).execute()
+        return [row['group_id'] for row in res.data or []]
+    return list(membership_cache.get(user_id, load))
+
+# Catálogo de sitios prohibidos (dominio -> categoría) recargado al cambiar el archivo
+prohibited_catalog = ProhibitedCatalog(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prohibidos.json'),
+    normalize_domain,
+    check_interval=float(os.getenv('PROHIBITED_CATALOG_CHECK_INTERVAL', 2))
+)
+
+# Motor de políticas compilado en memoria (usa el cliente de servicio)
+policy_engine = PolicyEngine(
+    supabase,
+    prohibited_catalog,
+    normalize_domain,
+    ttl=int(os.getenv('POLICY_ENGINE_TTL', 60))
+)
+
+# Snapshots versionados de políticas para la sincronización de la extensión
+policy_snapshots = PolicySnapshots(
+    supabase,
+    policy_engine,
+    ttl=int(os.getenv('POLICY_SNAPSHOT_TTL', 15))
+)
+policy_engine.on_invalidate(policy_snapshots.invalidate)
+
+# Reglas de bloqueo compiladas que la extensión evalúa en local (/api/policies/rules)
+policy_rules = PolicyRuleSets(policy_engine, prohibited_catalog, policy_snapshots.tenant_version)
+
+# Notificaciones de cambios de políticas a las extensiones (/api/policies/stream)
+policy_events = PolicyEventBroker(
+    policy_snapshots.tenant_version,
+    poll_interval=float(os.getenv('POLICY_EVENTS_POLL_INTERVAL', 5))
+)
+policy_engine.on_invalidate(policy_events.notify)
+# Segundos tras los que la extensión vuelve a preguntar en el modo WSGI
+POLICY_STREAM_RETRY = int(os.getenv('POLICY_STREAM_RETRY', 30))
+
+# Permisos de descarga precalculados por tenant (/api/check-download)
+download_policies = DownloadPolicyResolver(
+    supabase,
+    ttl=int(os.getenv('DOWNLOAD_POLICY_TTL', 60))
+)
+policy_engine.on_invalidate(download_policies.invalidate)
+
+# Configuración de cada tenant (tenant_configs) con sus listas de dominios precompiladas
+tenant_configs = TenantConfigCache(
+    supabase,
+    normalize_domain,
+    ttl=int(os.getenv('TENANT_CONFIG_TTL', 30))
+)
+
+# Detector incremental de comportamientos anómalos (alimentado en la ingesta)
+anomaly_detector = AnomalyDetector(supabase, normalize_domain)
+
+# Autocompletado de dominios y URLs con caché en memoria
+suggestion_service = SuggestionService(
+    supabase,
+    ttl=int(os.getenv('SUGGESTIONS_CACHE_TTL', 30))
+)
 
 def admin_required(fn):
     from functools import wraps
@@ -272,6 +388,10 @@ def index():
         }
     })
 
+def loggable_claims(claims):
+    """Claims del JWT sin el token de Supabase, para los logs de depuración"""
+    return {key: value for key, value in claims.items() if key != 'supabase_token'}
+
 @app.route('/api/login', methods=['POST'])
 @limiter.limit("5 per minute")  # Limita a 5 intentos por minuto por IP
 def login():
@@ -280,7 +400,7 @@ def login():
         email = data.get('email')
         password = data.get('password')
         
-        print("[Backend] Intentando login para:", email)
+        logger.debug("Intentando login para: %s", email)
         
         # Autenticación con Supabase
         response = supabase.auth.sign_in_with_password({
@@ -294,7 +414,7 @@ def login():
             role = response.user.user_metadata.get('role')
             user_id = response.user.id
 
-            print(f"[Backend] Login exitoso - User ID: {user_id}, Role: {role}, Tenant: {tenant_id}")
+            logger.debug("Login exitoso - User ID: %s, Role: %s, Tenant: %s", user_id, role, tenant_id)
 
             # Si es admin y no tiene tenant_id, usar None o un valor especial
             if role == 'admin' and not tenant_id:
@@ -310,8 +430,8 @@ def login():
             }
             
             # Imprimir para depuración
-            print(f"[Backend] User metadata: {response.user.user_metadata}")
-            print(f"[Backend] Generated JWT claims: {claims}")
+            logger.debug("User metadata: %s", response.user.user_metadata)
+            logger.debug("Generated JWT claims: %s", loggable_claims(claims))
             
             # Crear el token con los claims
             access_token = create_access_token(
@@ -319,7 +439,7 @@ def login():
                 additional_claims=claims
             )
             
-            print("[Backend] Token JWT generado exitosamente")
+            logger.debug("Token JWT generado exitosamente")
             
             return jsonify({
                 "success": True,
@@ -329,13 +449,13 @@ def login():
                 "role": role
             })
         else:
-            print("[Backend] Login fallido - Credenciales inválidas")
+            logger.debug("Login fallido - Credenciales inválidas")
             return jsonify({
                 "success": False,
                 "error": "Credenciales inválidas"
             }), 401
     except Exception as e:
-        print(f"[Backend] Error en login: {str(e)}")
+        logger.error("Error en login: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -359,11 +479,19 @@ def get_config():
         }
     }
     # Intentar obtener la configuración del tenant si existe
+    data = default_config
     if tenant_id:
-        config = supabase.table('tenant_configs').select('*').eq('tenant_id', tenant_id).execute()
-        if config.data:
-            return jsonify({"success": True, "data": {**default_config, **config.data[0]}})
-    return jsonify({"success": True, "data": default_config})
+        config = tenant_configs.get(tenant_id)
+        if config.row:
+            data = {**default_config, **config.row}
+
+    # ETag del contenido: la extensión puede consultar la configuración a
+    # menudo y recibir un 304 sin cuerpo mientras no cambie
+    body = json.dumps({"success": True, "data": data}, sort_keys=True, default=str)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(hashlib.sha256(body.encode('utf-8')).hexdigest()[:32])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/tenants', methods=['GET'])
 def get_tenants():
@@ -430,7 +558,7 @@ def get_users():
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
 
-        print(f"GET /api/users - Claims: {claims}")
+        logger.debug("GET /api/users - Claims: %s", loggable_claims(claims))
 
         if role == 'admin':
             # Admin global ve todos los usuarios (sujeto a RLS "Admin acceso total a users")
@@ -442,12 +570,12 @@ def get_users():
             return jsonify({"error": "Rol no autorizado para ver usuarios"}), 403
         
         users = users_query.execute()
-        print(f"GET /api/users - Usuarios encontrados: {len(users.data)}")
+        logger.debug("GET /api/users - Usuarios encontrados: %s", len(users.data))
         return jsonify({"success": True, "data": users.data})
     except Exception as e:
-        print(f"=== ERROR en admin_get_users ===")
-        print(f"Tipo de error: {type(e).__name__}")
-        print(f"Mensaje de error: {str(e)}")
+        logger.error("=== ERROR en admin_get_users ===")
+        logger.error("Tipo de error: %s", type(e).__name__)
+        logger.error("Mensaje de error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/users/<user_id>', methods=['GET'])
@@ -569,7 +697,7 @@ def create_user():
         }), 201
 
     except Exception as e:
-        print(f"Error en create_user: {str(e)}")
+        logger.error("Error en create_user: %s", e)
         # Si se creó el usuario en Auth pero falló algo más, intentar limpiar
         if 'auth_response' in locals():
             try:
@@ -657,7 +785,7 @@ def update_user(user_id):
                     }
                 })
             except Exception as e:
-                print(f"Error actualizando metadatos en Auth: {str(e)}")
+                logger.error("Error actualizando metadatos en Auth: %s", e)
                 # Continuar aunque falle la actualización de metadatos
 
         return jsonify({
@@ -667,7 +795,7 @@ def update_user(user_id):
         })
 
     except Exception as e:
-        print(f"Error en update_user: {str(e)}")
+        logger.error("Error en update_user: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/users/<user_id>', methods=['DELETE'])
@@ -698,7 +826,7 @@ def delete_user(user_id):
         try:
             user_supabase.auth.admin.delete_user(user_id)
         except Exception as e:
-            print(f"Error eliminando en Supabase Auth: {str(e)}")
+            logger.error("Error eliminando en Supabase Auth: %s", e)
             return jsonify({"success": False, "error": f"Error eliminando en Auth: {str(e)}"}), 400
 
         # Si fue exitoso, eliminar de la tabla users
@@ -712,7 +840,7 @@ def delete_user(user_id):
             "message": "Usuario eliminado correctamente"
         })
     except Exception as e:
-        print(f"Error en delete_user: {str(e)}")
+        logger.error("Error en delete_user: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -725,7 +853,7 @@ def register():
         email = data.get('email')
         password = data.get('password')
         
-        print(f"Intentando registrar usuario: {email}")
+        logger.debug("Intentando registrar usuario: %s", email)
         
         # Registrar usuario en Supabase
         response = supabase.auth.sign_up({
@@ -733,7 +861,7 @@ def register():
             "password": password
         })
         
-        print(f"Respuesta de registro: {response}")
+        logger.debug("Respuesta de registro: %s", response)
         
         if hasattr(response, 'user'):
             return jsonify({
@@ -747,27 +875,44 @@ def register():
                 "error": "Error al registrar usuario"
             }), 400
     except Exception as e:
-        print(f"Error en registro: {str(e)}")
+        logger.error("Error en registro: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
         }), 400
 
 # --- ENDPOINTS DE POLÍTICAS ---
+def tenant_policy_payload(policy):
+    """Política de /api/policies para client/admin (consulta con groups(name) embebido)"""
+    processed_policy = {
+        'id': policy['id'],
+        'domain': policy.get('domain'),
+        'action': policy['action'],
+        'category': policy.get('category'),
+        'block_reason': policy.get('block_reason'),
+        'group_id': policy.get('group_id'),
+        'group': policy.get('groups'),
+        'user_id': policy.get('user_id'),
+        'type': policy.get('type', 'access')
+    }
+    if processed_policy['group'] is None:
+        del processed_policy['group']
+    return processed_policy
+
 @app.route('/api/policies', methods=['GET'])
 @jwt_required()
 def get_policies():
     try:
-        print("[Backend] Iniciando obtención de políticas...")
+        logger.debug("Iniciando obtención de políticas...")
         claims = get_jwt()
-        print("[Backend] Claims del JWT:", claims)
+        logger.debug("Claims del JWT: %s", loggable_claims(claims))
         role = claims.get('role')
         tenant_id = claims.get('tenant_id')
         user_id = claims.get('sub')  # Usar el campo sub como user_id
-        print(f"[Backend] Usuario: {user_id}, Rol: {role}, Tenant: {tenant_id}")
+        logger.debug("Usuario: %s, Rol: %s, Tenant: %s", user_id, role, tenant_id)
 
         if not user_id:
-            print("[Backend] ERROR: sub (user_id) es None en los claims")
+            logger.error("ERROR: sub (user_id) es None en los claims")
             return jsonify({"success": False, "error": "user_id no encontrado en el token"}), 401
 
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
@@ -778,97 +923,143 @@ def get_policies():
 
         # Obtener políticas según el rol
         if role == 'user':
-            print("[Backend] Obteniendo políticas para usuario normal")
+            logger.debug("Obteniendo políticas para usuario normal")
             try:
-                # Obtener grupos del usuario
-                print(f"[Backend] Consultando grupos para user_id: {user_id}")
-                user_groups_res = user_supabase.table('group_users').select('group_id').eq('user_id', user_id).execute()
-                print(f"[Backend] Respuesta de grupos: {user_groups_res}")
-                user_groups = [g['group_id'] for g in user_groups_res.data] if user_groups_res.data else []
-                print(f"[Backend] Grupos del usuario: {user_groups}")
-
-                # Obtener políticas del tenant sin grupo
-                tenant_policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).is_('group_id', 'null').eq('type', policy_type).execute()
-                print(f"[Backend] Políticas del tenant: {len(tenant_policies.data)} encontradas")
-
-                # Obtener políticas de los grupos del usuario
+                # Grupos del usuario y políticas del tenant sin grupo, en paralelo
+                logger.debug("Consultando grupos para user_id: %s", user_id)
+                queries = request_queries()
+                groups_future = queries.call(user_group_ids, user_supabase, user_id)
+                tenant_policies = queries.submit(
+                    user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).is_('group_id', 'null').eq('type', policy_type)
+                ).result()
+                user_groups = groups_future.result()
+                logger.debug("Grupos del usuario: %s", user_groups)
+                logger.debug("Políticas del tenant: %s encontradas", len(tenant_policies.data))
+
+                # Políticas de los grupos del usuario y nombres de esos grupos, en paralelo
                 group_policies = []
+                group_info = {}
                 if user_groups:
-                    group_policies = user_supabase.table('policies').select('*').in_('group_id', user_groups).eq('type', policy_type).execute().data
-                    print(f"[Backend] Políticas de grupos: {len(group_policies)} encontradas")
+                    group_policies_res, groups_res = queries.gather(
+                        user_supabase.table('policies').select('*').in_('group_id', user_groups).eq('type', policy_type),
+                        user_supabase.table('groups').select('id, name').in_('id', user_groups)
+                    )
+                    group_policies = group_policies_res.data
+                    group_info = {g['id']: g for g in groups_res.data}
+                    logger.debug("Políticas de grupos: %s encontradas", len(group_policies))
 
                 # Combinar políticas
                 all_policies = tenant_policies.data + group_policies
-                print(f"[Backend] Total de políticas: {len(all_policies)}")
-
-                # Obtener información de grupos para las políticas
-                group_ids = [p['group_id'] for p in all_policies if p.get('group_id')]
-                group_info = {}
-                if group_ids:
-                    groups_res = user_supabase.table('groups').select('id, name').in_('id', group_ids).execute()
-                    group_info = {g['id']: g for g in groups_res.data}
+                logger.debug("Total de políticas: %s", len(all_policies))
 
                 # Procesar políticas
-                processed_policies = []
-                for policy in all_policies:
-                    processed_policy = {
-                        'id': policy['id'],
-                        'domain': policy.get('domain'),
-                        'action': policy['action'],
-                        'category': policy.get('category'),
-                        'block_reason': policy.get('block_reason'),
-                        'group_id': policy.get('group_id'),
-                        'group': group_info.get(policy.get('group_id')),
-                        'user_id': policy.get('user_id'),
-                        'type': policy.get('type', 'access')
-                    }
-                    processed_policies.append(processed_policy)
+                processed_policies = [policy_payload(policy, group_info) for policy in all_policies]
 
-                print(f"[Backend] Políticas procesadas exitosamente: {len(processed_policies)}")
+                logger.debug("Políticas procesadas exitosamente: %s", len(processed_policies))
                 return jsonify({"success": True, "data": processed_policies})
 
             except Exception as e:
-                print(f"[Backend] Error al obtener políticas para usuario: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Error al obtener políticas para usuario: %s", e)
                 return jsonify({"success": False, "error": str(e)}), 500
 
         else:  # Para client y admin
-            print("[Backend] Obteniendo políticas para rol administrativo")
+            logger.debug("Obteniendo políticas para rol administrativo")
             # Para client y admin, obtener todas las políticas del tenant con información de grupos
             policies = user_supabase.table('policies').select('*, groups(name)').eq('tenant_id', tenant_id).eq('type', policy_type).execute()
-            print(f"[Backend] Políticas encontradas para tenant: {len(policies.data)}")
+            logger.debug("Políticas encontradas para tenant: %s", len(policies.data))
             
             # Debug: imprimir la primera política para ver qué campos vienen
             if policies.data:
-                print(f"[Backend] Ejemplo de política recibida: {policies.data[0]}")
+                logger.debug("Ejemplo de política recibida: %s", policies.data[0])
             
             # Procesar las políticas para incluir la información del grupo
-            processed_policies = []
-            for policy in policies.data:
-                processed_policy = {
-                    'id': policy['id'],
-                    'domain': policy.get('domain'),
-                    'action': policy['action'],
-                    'category': policy.get('category'),
-                    'block_reason': policy.get('block_reason'),
-                    'group_id': policy.get('group_id'),
-                    'group': policy.get('groups'),
-                    'user_id': policy.get('user_id'),
-                    'type': policy.get('type', 'access')
-                }
-                if processed_policy['group'] is None:
-                    del processed_policy['group']
-                processed_policies.append(processed_policy)
+            processed_policies = [tenant_policy_payload(policy) for policy in policies.data]
             
             return jsonify({"success": True, "data": processed_policies})
 
     except Exception as e:
-        print(f"[Backend] Error en get_policies: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en get_policies: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/policies/snapshot', methods=['GET'])
+@jwt_required()
+def get_policies_snapshot():
+    """
+    Políticas de acceso versionadas para la extensión. El cliente envía el
+    ETag de su última sincronización en If-None-Match y recibe 304, solo los
+    cambios (full=false: upserted/removed) o el snapshot completo (full=true: data).
+    """
+    try:
+        claims = get_jwt()
+        role = claims.get('role')
+        tenant_id = claims.get('tenant_id')
+        user_id = claims.get('sub')
+        if not user_id or not tenant_id:
+            return jsonify({"success": False, "error": "Token sin usuario o tenant"}), 401
+
+        client_etag = next(iter(request.if_none_match.as_set()), None)
+        etag, payload = policy_snapshots.sync(tenant_id, role, user_id, client_etag)
+        if payload is None:
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({"success": True, **payload})
+        response.set_etag(etag)
+        # La respuesta depende del ETag del cliente: la caché HTTP no debe reutilizarla
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        logger.error("Error en get_policies_snapshot: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/policies/rules', methods=['GET'])
+@jwt_required()
+def get_policy_rules():
+    """
+    Conjunto de reglas compilado (catálogo de prohibidos y políticas del
+    tenant y de los grupos del usuario) para decidir los bloqueos en la
+    extensión sin consultar al backend en cada navegación.
+    """
+    try:
+        claims = get_jwt()
+        tenant_id = claims.get('tenant_id')
+        user_id = claims.get('sub')
+        if not tenant_id:
+            return jsonify({"success": False, "error": "Token sin tenant"}), 401
+
+        etag, body = policy_rules.get(tenant_id, user_id)
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Depende del usuario: solo la caché del propio cliente, revalidando con el ETag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error("Error en get_policy_rules: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/policies/stream', methods=['GET'])
+@jwt_required()
+def stream_policies():
+    """
+    Versión de las políticas del tenant en formato SSE; la extensión llama a
+    /api/policies/snapshot solo al recibir un cambio. En el servidor WSGI la
+    respuesta lleva un único evento y retry: un stream abierto ocuparía un
+    hilo del worker por cada extensión conectada. El stream continuo lo
+    sirve el modo ASGI (asgi.py), que es el perfil por defecto.
+    """
+    claims = get_jwt()
+    tenant_id = claims.get('tenant_id')
+    if not tenant_id:
+        return jsonify({"success": False, "error": "Token sin tenant"}), 401
+    return app.response_class(
+        policy_events.poll(tenant_id, retry=POLICY_STREAM_RETRY),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-store',
+            # Evita que proxies intermedios acumulen los eventos
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 @app.route('/api/policies', methods=['POST'])
 @jwt_required()
 def create_policy():
@@ -878,12 +1069,12 @@ def create_policy():
         requesting_tenant_id = claims.get('tenant_id')
         data = request.get_json()
         
-        print("[Backend] Iniciando creación de política...")
-        print("[Backend] Datos recibidos:", data)
-        print("[Backend] Claims JWT:", claims)
+        logger.debug("Iniciando creación de política...")
+        logger.debug("Datos recibidos: %s", data)
+        logger.debug("Claims JWT: %s", loggable_claims(claims))
         
         if not data:
-            print("[Backend] Error: No se recibieron datos en el request")
+            logger.error("Error: No se recibieron datos en el request")
             return jsonify({"success": False, "error": "No se recibieron datos en el request"}), 400
         
         policy_tenant_id = None
@@ -891,13 +1082,13 @@ def create_policy():
         policy_type = data.get('type', 'access')
         user_id = data.get('user_id')
 
-        print(f"[Backend] Tipo de política: {policy_type}")
-        print(f"[Backend] User ID: {user_id}")
-        print(f"[Backend] Group ID: {group_id}")
+        logger.debug("Tipo de política: %s", policy_type)
+        logger.debug("User ID: %s", user_id)
+        logger.debug("Group ID: %s", group_id)
 
         if role == 'client':
             if not requesting_tenant_id:
-                print("[Backend] Error: Cliente sin tenant_id")
+                logger.error("Error: Cliente sin tenant_id")
                 return jsonify({"success": False, "error": "Cliente debe tener un tenant_id asociado"}), 403
             policy_tenant_id = requesting_tenant_id
             if group_id:
@@ -905,36 +1096,36 @@ def create_policy():
                 client_supabase = get_supabase_with_jwt(jwt_token_client)
                 group_check = client_supabase.table('groups').select('id, tenant_id').eq('id', group_id).eq('tenant_id', policy_tenant_id).maybe_single().execute()
                 if not group_check.data:
-                    print("[Backend] Error: Grupo no encontrado o no pertenece al tenant del cliente")
+                    logger.error("Error: Grupo no encontrado o no pertenece al tenant del cliente")
                     return jsonify({"success": False, "error": "Grupo no encontrado o no pertenece al tenant del cliente"}), 400
         elif role == 'admin':
             policy_tenant_id = data.get('tenant_id')
             if not policy_tenant_id:
-                print("[Backend] Error: Admin debe especificar tenant_id")
+                logger.error("Error: Admin debe especificar tenant_id")
                 return jsonify({"success": False, "error": "Admin debe especificar tenant_id"}), 400
             if group_id:
                 jwt_token_admin = request.headers.get('Authorization', '').replace('Bearer ', '')
                 admin_supabase = get_supabase_with_jwt(jwt_token_admin)
                 group_check = admin_supabase.table('groups').select('id, tenant_id').eq('id', group_id).eq('tenant_id', policy_tenant_id).maybe_single().execute()
                 if not group_check.data:
-                    print("[Backend] Error: Grupo no encontrado o no pertenece al tenant especificado")
+                    logger.error("Error: Grupo no encontrado o no pertenece al tenant especificado")
                     return jsonify({"success": False, "error": "Grupo no encontrado o no pertenece al tenant_id especificado"}), 400
         else:
-            print("[Backend] Error: Rol no autorizado")
+            logger.error("Error: Rol no autorizado")
             return jsonify({"success": False, "error": "No autorizado para crear políticas"}), 403
             
         if not policy_tenant_id:
-            print("[Backend] Error: Política sin tenant")
+            logger.error("Error: Política sin tenant")
             return jsonify({"success": False, "error": "La política debe estar asociada a un tenant"}), 400
 
         if data.get('action') not in ['allow', 'block']:
-            print("[Backend] Error: Acción inválida")
+            logger.error("Error: Acción inválida")
             return jsonify({"success": False, "error": "Acción inválida"}), 400
         if policy_type not in ['access', 'download']:
-            print("[Backend] Error: Tipo de política inválido")
+            logger.error("Error: Tipo de política inválido")
             return jsonify({"success": False, "error": "Tipo de política inválido"}), 400
         if policy_type == 'access' and not data.get('domain'):
-            print("[Backend] Error: Dominio requerido para políticas de acceso")
+            logger.error("Error: Dominio requerido para políticas de acceso")
             return jsonify({"success": False, "error": "Dominio requerido para políticas de acceso"}), 400
         
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
@@ -956,27 +1147,26 @@ def create_policy():
             if group_id:
                 insert_data['group_id'] = group_id
         
-        print("[Backend] Datos a insertar en policies:", insert_data)
+        logger.debug("Datos a insertar en policies: %s", insert_data)
         
         try:
             new_policy_res = user_supabase.table('policies').insert(insert_data).execute()
-            print("[Backend] Respuesta de Supabase:", new_policy_res)
+            logger.debug("Respuesta de Supabase: %s", new_policy_res)
         except Exception as e:
-            print(f"[Backend] Error al insertar en Supabase: {str(e)}")
+            logger.error("Error al insertar en Supabase: %s", e)
             return jsonify({"success": False, "error": f"Error al crear la política en la base de datos: {str(e)}"}), 500
 
         if not new_policy_res.data or (hasattr(new_policy_res, 'error') and new_policy_res.error):
             error_detail = new_policy_res.error.message if hasattr(new_policy_res, 'error') and new_policy_res.error else "No data returned"
-            print(f"[Backend] Error al crear política en Supabase: {error_detail}")
+            logger.error("Error al crear política en Supabase: %s", error_detail)
             return jsonify({"success": False, "error": f"No se pudo crear la política: {error_detail}"}), 500
         
-        print("[Backend] Política creada exitosamente")
+        policy_engine.invalidate(policy_tenant_id)
+        logger.debug("Política creada exitosamente")
         return jsonify({"success": True, "data": new_policy_res.data[0]}), 201
         
     except Exception as e:
-        print(f"[Backend] Error en create_policy: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en create_policy: %s", e)
         return jsonify({"success": False, "error": f"Error interno del servidor: {str(e)}"}), 500
 
 @app.route('/api/policies/<policy_id_str>', methods=['PUT']) # Usar policy_id_str
@@ -993,7 +1183,7 @@ def update_policy(policy_id_str): # Usar policy_id_str
             return jsonify({"success": False, "error": "Formato de policy_id inválido."}), 400
 
         data = request.get_json()
-        print(f"Intentando actualizar política {policy_id} con datos: {data}")
+        logger.debug("Intentando actualizar política %s con datos: %s", policy_id, data)
         
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
@@ -1063,12 +1253,15 @@ def update_policy(policy_id_str): # Usar policy_id_str
                  return jsonify({"success": True, "data": processed_policy, "message": "No changes detected"}), 200
             else:
                  return jsonify({"error": "Política no encontrada al final del proceso."}), 404
-        print("Payload de actualización para policies:", update_payload)
+        logger.debug("Payload de actualización para policies: %s", update_payload)
         updated_policy_res = user_supabase.table('policies').update(update_payload).eq('id', policy_id).select('*, groups(name)').maybe_single().execute()
         if not updated_policy_res.data or (hasattr(updated_policy_res, 'error') and updated_policy_res.error):
             error_detail = updated_policy_res.error.message if hasattr(updated_policy_res, 'error') and updated_policy_res.error else "No data returned"
-            print(f"Error al actualizar política en Supabase: {error_detail}")
+            logger.error("Error al actualizar política en Supabase: %s", error_detail)
             return jsonify({"success": False, "error": f"No se pudo actualizar la política: {error_detail}"}), 500
+        policy_engine.invalidate(current_policy_tenant_id)
+        if update_payload.get('tenant_id'):
+            policy_engine.invalidate(update_payload['tenant_id'])
         processed_updated_policy = updated_policy_res.data
         if processed_updated_policy.get('groups') is not None:
             processed_updated_policy['group'] = processed_updated_policy.pop('groups')
@@ -1076,9 +1269,7 @@ def update_policy(policy_id_str): # Usar policy_id_str
         elif 'groups' in processed_updated_policy: del processed_updated_policy['groups']
         return jsonify({"success": True, "data": processed_updated_policy})
     except Exception as e:
-        print(f"Error en update_policy: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en update_policy: %s", e)
         return jsonify({"success": False, "error": str(e)}), 400
 
 @app.route('/api/policies/<policy_id_str>', methods=['DELETE']) # Usar policy_id_str
@@ -1094,8 +1285,8 @@ def delete_policy(policy_id_str): # Usar policy_id_str
         except ValueError:
             return jsonify({"success": False, "error": "Formato de policy_id inválido."}), 400
 
-        print(f"DELETE /api/policies/{policy_id} - JWT claims: {claims}")
-        print(f"Role: {role}, Tenant ID: {requesting_tenant_id}")
+        logger.debug("DELETE /api/policies/%s - JWT claims: %s", policy_id, loggable_claims(claims))
+        logger.debug("Role: %s, Tenant ID: %s", role, requesting_tenant_id)
         
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
@@ -1109,14 +1300,14 @@ def delete_policy(policy_id_str): # Usar policy_id_str
         target_policy_tenant_id = target_policy.get('tenant_id')
         
         if role == 'admin':
-            print("Usuario es admin, puede eliminar cualquier política (RLS dependiente)")
+            logger.debug("Usuario es admin, puede eliminar cualquier política (RLS dependiente)")
             pass # RLS se encargará de si puede o no eliminar.
         elif role == 'client':
-            print(f"Usuario es client, verificando tenant_id: {requesting_tenant_id} vs política: {target_policy_tenant_id}")
+            logger.debug("Usuario es client, verificando tenant_id: %s vs política: %s", requesting_tenant_id, target_policy_tenant_id)
             if not requesting_tenant_id or str(target_policy_tenant_id) != str(requesting_tenant_id):
                 return jsonify({"error": "No autorizado para eliminar esta política"}), 403
         else: # Otros roles
-            print(f"Rol no autorizado: {role}")
+            logger.debug("Rol no autorizado: %s", role)
             return jsonify({"error": "No autorizado para eliminar políticas"}), 403
             
         deleted_res = user_supabase.table('policies').delete().eq('id', policy_id).execute()
@@ -1124,20 +1315,19 @@ def delete_policy(policy_id_str): # Usar policy_id_str
         # Supabase delete no devuelve error si no se borra nada por RLS, pero `deleted_res.data` estará vacío.
         # O si la RLS lo impide, puede lanzar un error que es capturado por el try-except general.
         if hasattr(deleted_res, 'error') and deleted_res.error:
-            print(f"Error al eliminar política en Supabase: {deleted_res.error.message}")
+            logger.error("Error al eliminar política en Supabase: %s", deleted_res.error.message)
             return jsonify({"success": False, "error": f"Error al eliminar política: {deleted_res.error.message}"}), 500
         
         # Podríamos chequear deleted_res.data para ver si algo fue realmente borrado,
         # pero si la RLS previene, el error debería ser capturado.
         # Si el ID no existe, el `policy_res` anterior ya lo hubiera detectado.
 
-        print(f"Política eliminada o intento de eliminación para: {policy_id}")
+        policy_engine.invalidate(target_policy_tenant_id)
+        logger.debug("Política eliminada o intento de eliminación para: %s", policy_id)
         return jsonify({"success": True, "message": "Política eliminada correctamente"})
     except Exception as e:
         error_msg = str(e)
-        print(f"Error en delete_policy: {error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en delete_policy: %s", error_msg)
         return jsonify({"success": False, "error": error_msg}), 400
 
 # --- ENDPOINTS DE HISTORIAL DE NAVEGACIÓN ---
@@ -1159,10 +1349,13 @@ def get_navigation_logs():
         action = request.args.get('action')
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 20))
+        # Paginación por cursor (timestamp, id); 'page' se mantiene por compatibilidad
+        cursor = request.args.get('cursor')
+        count = count_mode(request.args.get('count'), default='none' if cursor else 'exact')
         autocomplete = request.args.get('autocomplete')  # 'domain' o 'url'
         autocomplete_query = request.args.get('q', '')
 
-        base_query = user_supabase.table('navigation_logs').select('*')
+        base_query = user_supabase.table('navigation_logs').select('*', count=count)
         if role == 'admin':
             pass
         elif role == 'client':
@@ -1182,128 +1375,96 @@ def get_navigation_logs():
         if action and action != 'all':
             base_query = base_query.eq('action', action)
 
-        # Autocompletado
-        if autocomplete == 'domain':
-            ac_query = user_supabase.table('navigation_logs').select('domain').distinct('domain')
-            if role == 'client':
-                ac_query = ac_query.eq('tenant_id', tenant_id)
-            if autocomplete_query:
-                ac_query = ac_query.ilike('domain', f'%{autocomplete_query}%')
-            ac_domains = ac_query.limit(10).execute()
-            domains = [row['domain'] for row in ac_domains.data]
-            return jsonify({"success": True, "suggestions": domains})
-        if autocomplete == 'url':
-            ac_query = user_supabase.table('navigation_logs').select('url').distinct('url')
-            if role == 'client':
-                ac_query = ac_query.eq('tenant_id', tenant_id)
-            if autocomplete_query:
-                ac_query = ac_query.ilike('url', f'%{autocomplete_query}%')
-            ac_urls = ac_query.limit(10).execute()
-            urls = [row['url'] for row in ac_urls.data]
-            return jsonify({"success": True, "suggestions": urls})
-
-        # Total de registros filtrados
-        count_query = user_supabase.table('navigation_logs').select('id', count='exact')
-        if role == 'client':
-            count_query = count_query.eq('tenant_id', tenant_id)
-        if user_id:
-            count_query = count_query.eq('user_id', user_id)
-        if domain:
-            count_query = count_query.ilike('domain', f'%{domain}%')
-        if url:
-            count_query = count_query.ilike('url', f'%{url}%')
-        if date_from:
-            count_query = count_query.gte('timestamp', date_from)
-        if date_to:
-            count_query = count_query.lte('timestamp', date_to)
-        if action and action != 'all':
-            count_query = count_query.eq('action', action)
-        count_result = count_query.execute()
-        total = count_result.count if hasattr(count_result, 'count') else len(count_result.data)
-
-        # Paginación y datos
-        from_idx = (page - 1) * page_size
-        to_idx = from_idx + page_size - 1
-        data_query = base_query.order('timestamp', desc=True).range(from_idx, to_idx)
-        logs = data_query.execute()
-        return jsonify({"success": True, "data": logs.data, "total": total, "page": page, "page_size": page_size})
+        # Autocompletado desde el diccionario de sugerencias (navigation_suggestions)
+        if autocomplete in SUGGESTION_KINDS:
+            suggestions = suggestion_service.suggest(
+                autocomplete,
+                autocomplete_query,
+                tenant_id if role == 'client' else None
+            )
+            return jsonify({"success": True, "suggestions": suggestions})
+
+        # Datos y total en la misma consulta
+        logs, next_cursor, total = paginate(base_query, ['timestamp', 'id'], cursor, page, page_size)
+        return jsonify({
+            "success": True,
+            "data": logs,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "next_cursor": next_cursor
+        })
     except Exception as e:
-        print(f"Error en get_navigation_logs: {str(e)}")
+        logger.error("Error en get_navigation_logs: %s", e)
         return jsonify({"success": False, "error": str(e)}), 400
 
 def verify_policies(domain, tenant_id, role, user_id=None):
     try:
-        print(f"[Backend] Verificando políticas para tenant_id: {tenant_id}, role: {role}, user_id: {user_id}")
-        jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        user_supabase = get_supabase_with_jwt(jwt_token)
-        # Cargar sitios prohibidos
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        prohibidos_path = os.path.join(current_dir, 'prohibidos.json')
-        with open(prohibidos_path, 'r', encoding='utf-8') as f:
-            prohibited_sites = json.load(f)
-        # Verificar si el dominio está en la lista de prohibidos
-        domain = domain.lower()
-        for category, sites in prohibited_sites.items():
-            for site in sites:
-                if site in domain:
-                    return {
-                        'action': 'bloqueado',
-                        'info': {
-                            'category': category,
-                            'block_reason': f'Sitio bloqueado por {category}'
-                        }
-                    }
-        # Si no hay user_id, solo verificar políticas globales
-        if not user_id:
-            policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).is_('group_id', 'null').eq('type', 'access').execute()
-            for policy in policies.data:
-                if policy['domain'] in domain:
-                    return {
-                        'action': policy['action'],
-                        'info': {
-                            'category': policy.get('category', 'sin categoría'),
-                            'block_reason': policy.get('block_reason', 'Bloqueado por política personalizada')
-                        }
-                    }
-            return {'action': 'permitido', 'info': None}
-        # Si hay user_id, verificar políticas específicas del usuario
-        user_groups_res = user_supabase.table('group_users').select('group_id').eq('user_id', user_id).execute()
-        user_groups = [group['group_id'] for group in user_groups_res.data]
-        # Verificar políticas globales primero
-        global_policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).is_('group_id', 'null').eq('type', 'access').execute()
-        for policy in global_policies.data:
-            if policy['domain'] in domain:
-                return {
-                    'action': policy['action'],
-                    'info': {
-                        'category': policy.get('category', 'sin categoría'),
-                        'block_reason': policy.get('block_reason', 'Bloqueado por política personalizada')
-                    }
-                }
-        # Luego verificar políticas de grupos
-        if user_groups:
-            group_policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).in_('group_id', user_groups).eq('type', 'access').execute()
-            for policy in group_policies.data:
-                if policy['domain'] in domain:
-                    return {
-                        'action': policy['action'],
-                        'info': {
-                            'category': policy.get('category', 'sin categoría'),
-                            'block_reason': policy.get('block_reason', 'Bloqueado por política personalizada')
-                        }
-                    }
-        return {'action': 'permitido', 'info': None}
+        logger.debug("Verificando políticas para tenant_id: %s, role: %s, user_id: %s", tenant_id, role, user_id)
+        return policy_engine.verify_policies(domain, tenant_id, role, user_id)
     except Exception as e:
-        print(f"[Backend] Error al verificar políticas: {str(e)}")
+        logger.error("Error al verificar políticas: %s", e)
         return {'action': 'bloqueado', 'info': {'category': 'error', 'block_reason': 'Error al verificar políticas'}}
 
+# Mapear acciones a los valores aceptados por la base de datos
+ACTION_MAP = {
+    'block': 'bloqueado',
+    'bloqueo': 'bloqueado',
+    'allow': 'permitido',
+    'permitir': 'permitido',
+    'visit': 'visitado',
+    'visitado': 'visitado',
+    'interact': 'interaccion',
+    'interaccion': 'interaccion'
+}
+
+# Máximo de eventos aceptados por /api/navigation_logs/batch
+NAVIGATION_BATCH_MAX = int(os.getenv('NAVIGATION_BATCH_MAX', 500))
+
+def build_navigation_log(data, user_id, tenant_id, policy_result, timestamp=None, ip_address=None, user_agent=None):
+    """
+    Construye la fila de navigation_logs para un evento y su decisión de políticas.
+    ip_address y user_agent se toman de la petición Flask si no se indican (asgi.py).
+    """
+    action = policy_result.get('action', 'visitado')
+    action = ACTION_MAP.get(action, action)
+    policy_info = policy_result.get('info', {})
+    if isinstance(policy_info, dict):
+        policy_info = json.dumps(policy_info)
+    else:
+        policy_info = json.dumps({'block_reason': policy_info})
+
+    url = data.get('url', '')
+    return {
+        # id generado aquí: los reintentos de la cola de ingesta son idempotentes
+        'id': str(uuid4()),
+        'user_id': user_id,
+        'tenant_id': tenant_id,
+        'domain': url,
+        'url': url,
+        'timestamp': timestamp or datetime.now(timezone.utc).isoformat(),
+        'action': action,
+        'policy_info': policy_info,
+        'ip_address': ip_address if ip_address is not None else request.remote_addr,
+        'user_agent': user_agent if user_agent is not None else request.headers.get('User-Agent'),
+        'tab_title': data.get('tab_title'),
+        'time_on_page': data.get('time_on_page'),
+        'open_tabs_count': data.get('open_tabs_count'),
+        'tab_focused': data.get('tab_focused'),
+        'event_type': data.get('event_type', 'navegacion'),
+        'event_details': data.get('event_details', {}),
+        'risk_score': calculate_risk_score(data.get('event_type', 'navegacion'), data.get('event_details', {})),
+        'city': data.get('city'),
+        'country': data.get('country')
+    }
+
 @app.route('/api/navigation_logs', methods=['POST'])
 @jwt_required()
 def create_navigation_log():
     try:
-        print("[Backend] Iniciando registro de navegación...")
+        logger.debug("Iniciando registro de navegación...")
         data = request.get_json()
-        print(f"[Backend] Datos recibidos: {data}")
+        logger.debug("Datos recibidos: %s", data)
         
         # Obtener claims del token JWT
         claims = get_jwt()
@@ -1319,63 +1480,189 @@ def create_navigation_log():
         domain = normalize_domain(url)
         
         # Verificar políticas
-        print(f"[Backend] Verificando políticas para dominio: {url}")
+        logger.debug("Verificando políticas para dominio: %s", url)
         policy_result = verify_policies(domain, tenant_id, role, user_id)
-        print(f"[Backend] Resultado de verify_policies: {policy_result}")
-        action = policy_result.get('action', 'visitado')
-        # Mapear acciones a los valores aceptados por la base de datos
-        action_map = {
-            'block': 'bloqueado',
-            'bloqueo': 'bloqueado',
-            'allow': 'permitido',
-            'permitir': 'permitido',
-            'visit': 'visitado',
-            'visitado': 'visitado',
-            'interact': 'interaccion',
-            'interaccion': 'interaccion'
-        }
-        action = action_map.get(action, action)
-        policy_info = policy_result.get('info', {})
-        if isinstance(policy_info, dict):
-            policy_info = json.dumps(policy_info)
-        else:
-            policy_info = json.dumps({'block_reason': policy_info})
+        logger.debug("Resultado de verify_policies: %s", policy_result)
         
         # Preparar datos del log
-        log_data = {
-            'user_id': user_id,
-            'tenant_id': tenant_id,
-            'domain': url,
-            'url': url,
-            'timestamp': datetime.now(timezone.utc).isoformat(),
-            'action': action,
-            'policy_info': policy_info,
-            'ip_address': request.remote_addr,
-            'user_agent': request.headers.get('User-Agent'),
-            'tab_title': data.get('tab_title'),
-            'time_on_page': data.get('time_on_page'),
-            'open_tabs_count': data.get('open_tabs_count'),
-            'tab_focused': data.get('tab_focused'),
-            'event_type': data.get('event_type', 'navegacion'),
-            'event_details': data.get('event_details', {}),
-            'risk_score': calculate_risk_score(data.get('event_type', 'navegacion'), data.get('event_details', {})),
-            'city': data.get('city'),
-            'country': data.get('country')
-        }
-        
-        print(f"[Backend] Registrando log con datos: {log_data}")
-        
-        # Registrar el log
-        user_supabase = get_supabase_with_jwt(request.headers.get('Authorization', '').replace('Bearer ', ''))
-        result = user_supabase.table('navigation_logs').insert(log_data).execute()
+        log_data = build_navigation_log(data, user_id, tenant_id, policy_result)
         
-        print("[Backend] Log registrado exitosamente")
-        return jsonify({"success": True, "data": result.data})
+        # La escritura la hace la cola de ingesta; con spool el evento ya está
+        # en disco al responder, sin spool solo en memoria
+        if not ingest_queue.submit([log_data]):
+            return ingest_queue_full()
+
+        logger.debug("Log encolado exitosamente")
+        return jsonify({"success": True, "data": [log_data], "queued": True}), 202
         
     except Exception as e:
-        print(f"[Backend] Error al registrar log: {str(e)}")
+        logger.error("Error al registrar log: %s", e)
         return jsonify({"success": False, "error": str(e)}), 400
 
+def write_navigation_logs(rows):
+    """
+    Escritor de la cola de ingesta. upsert sin sobrescribir por (id, timestamp):
+    un lote reintentado no duplica las filas que ya se hubieran escrito.
+    Las filas ya llevan tenant_id y user_id tomados del JWT verificado.
+    """
+    supabase.table('navigation_logs').upsert(
+        rows,
+        returning='minimal',
+        ignore_duplicates=True,
+        on_conflict='id,timestamp'
+    ).execute()
+    detect_anomalies(rows)
+
+def ingest_queue_full():
+    response = jsonify({"success": False, "error": "Cola de ingesta llena, reintentar más tarde"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+# Cola de ingesta de navigation_logs: las peticiones no esperan a la base de datos
+# (sí al fsync del spool, ver start_event_spool)
+ingest_queue = IngestQueue(
+    write_navigation_logs,
+    maxsize=int(os.getenv('INGEST_QUEUE_SIZE', 10000)),
+    workers=int(os.getenv('INGEST_WORKERS', 2)),
+    batch_size=int(os.getenv('INGEST_BATCH_SIZE', 500))
+)
+
+# Spool en disco de los logs aceptados (write-ahead) y de los que no se pueden
+# escribir; INGEST_SPOOL_DIR vacío lo desactiva y la ingesta queda solo en memoria
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool'))
+event_spool = None
+
+def start_event_spool():
+    """
+    Abre el spool del proceso y lo conecta a la cola de ingesta. Reclama un
+    directorio con flock e inicia hilos, así que no puede heredarse por fork:
+    con gunicorn y preload_app se llama en cada worker (post_fork) en lugar
+    de al importar.
+    """
+    global event_spool
+    if event_spool is not None or not INGEST_SPOOL_DIR:
+        return
+    event_spool = EventSpool(
+        INGEST_SPOOL_DIR,
+        max_bytes=int(os.getenv('INGEST_SPOOL_MAX_MB', 1024)) * 1024 * 1024
+    )
+    ingest_queue.attach_spool(event_spool)
+    event_spool.start_replayer(write_navigation_logs, batch_size=int(os.getenv('INGEST_BATCH_SIZE', 500)))
+
+def shutdown_ingest():
+    """Vacía la cola (quizá hacia el spool) y después cierra el spool."""
+    ingest_queue.close()
+    if event_spool is not None:
+        event_spool.close()
+
+if os.getenv('ATHOS_WORKER_INIT') != 'post_fork':
+    start_event_spool()
+atexit.register(shutdown_ingest)
+
+def detect_anomalies(rows):
+    """Alimenta el detector de anomalías; un fallo no debe impedir el registro de logs"""
+    try:
+        anomalies = anomaly_detector.observe(rows)
+        if anomalies:
+            logger.debug("%s comportamientos anómalos detectados", len(anomalies))
+    except Exception as e:
+        logger.error("Error en el detector de anomalías: %s", e)
+
+# Ventana aceptada para el timestamp del cliente: el buffer de la extensión
+# conserva eventos mientras no hay conexión, pero nada del futuro ni muy antiguo
+EVENT_TIMESTAMP_MAX_AGE = timedelta(seconds=int(os.getenv('EVENT_TIMESTAMP_MAX_AGE', 24 * 3600)))
+EVENT_TIMESTAMP_MAX_SKEW = timedelta(seconds=int(os.getenv('EVENT_TIMESTAMP_MAX_SKEW', 300)))
+
+def event_timestamp(value):
+    """
+    Timestamp ISO enviado por el cliente (eventos diferidos), normalizado a UTC,
+    o None (se usa la hora del servidor) si no es válido o cae fuera de la
+    ventana [ahora - EVENT_TIMESTAMP_MAX_AGE, ahora + EVENT_TIMESTAMP_MAX_SKEW]
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    if not now - EVENT_TIMESTAMP_MAX_AGE <= parsed <= now + EVENT_TIMESTAMP_MAX_SKEW:
+        return None
+    return parsed.astimezone(timezone.utc).isoformat()
+
+@app.route('/api/navigation_logs/batch', methods=['POST'])
+@jwt_required()
+def create_navigation_logs_batch():
+    """
+    Registra varios eventos de navegación en una sola petición.
+    Recibe: { events: [{ url, event_type, event_details, timestamp, ... }] }
+    Las políticas se evalúan una vez por dominio y las filas se encolan para
+    escribirse en bloque en segundo plano (503 si la cola está llena). Con
+    el spool activo el 202 se envía tras guardarlas en disco; sin él
+    (INGEST_SPOOL_DIR vacío) la entrega es best-effort: un lote encolado se
+    pierde si el proceso cae antes de escribirlo.
+    """
+    try:
+        data = request.get_json()
+        events = data.get('events') if isinstance(data, dict) else data
+        if not isinstance(events, list) or not events:
+            return jsonify({"success": False, "error": "Se requiere una lista de eventos"}), 400
+        if len(events) > NAVIGATION_BATCH_MAX:
+            return jsonify({"success": False, "error": f"Máximo {NAVIGATION_BATCH_MAX} eventos por petición"}), 413
+        if not all(isinstance(event, dict) for event in events):
+            return jsonify({"success": False, "error": "Formato de evento inválido"}), 400
+
+        claims = get_jwt()
+        tenant_id = claims.get('tenant_id')
+        role = claims.get('role')
+        user_id = claims.get('sub')
+
+        if not tenant_id:
+            return jsonify({"success": False, "error": "No se encontró tenant_id en el token"}), 400
+
+        logger.debug("Registrando lote de %s eventos de navegación", len(events))
+
+        # Una verificación de políticas por dominio distinto del lote
+        decisions = {}
+        rows = []
+        for event in events:
+            domain = normalize_domain(event.get('url', ''))
+            if domain not in decisions:
+                decisions[domain] = verify_policies(domain, tenant_id, role, user_id)
+            rows.append(build_navigation_log(
+                event, user_id, tenant_id, decisions[domain],
+                timestamp=event_timestamp(event.get('timestamp'))
+            ))
+
+        if not ingest_queue.submit(rows):
+            return ingest_queue_full()
+
+        logger.debug("Lote encolado: %s eventos, %s dominios verificados", len(rows), len(decisions))
+        return jsonify({
+            "success": True,
+            "queued": len(rows),
+            "actions": [row['action'] for row in rows]
+        }), 202
+
+    except Exception as e:
+        logger.error("Error al registrar lote de logs: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@app.route('/api/ingest/stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_ingest_stats():
+    """Estado de la cola de ingesta, del spool y de la cola de logs de este worker (ocupación, rechazos, reintentos)"""
+    return jsonify({
+        "success": True,
+        "data": ingest_queue.stats(),
+        "spool": event_spool.stats() if event_spool is not None else None,
+        "logging": logging_stats()
+    })
+
 def calculate_risk_score(event_type: str, event_details: dict) -> int:
     """Calcula el puntaje de riesgo basado en el tipo de evento y sus detalles"""
     base_scores = {
@@ -1441,6 +1728,7 @@ def block_domain():
             'action': 'block',
             'created_at': datetime.utcnow().isoformat()
         }).execute()
+        policy_engine.invalidate(tenant_id)
         
         return jsonify({
             'success': True,
@@ -1448,7 +1736,7 @@ def block_domain():
         })
         
     except Exception as e:
-        print(f"Error en block_domain: {str(e)}")
+        logger.error("Error en block_domain: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/check-download', methods=['POST'])
@@ -1470,83 +1758,55 @@ def check_download():
         role = claims.get('role')
         user_id = claims.get('sub')
         
-        print(f"[Backend] Verificando descarga - Usuario: {user_id}, Archivo: {filename}, URL: {url}")
-        
-        # Obtener conexión a Supabase
-        jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        user_supabase = get_supabase_with_jwt(jwt_token)
-        
-        # Por defecto, permitir descargas
-        allowed = True
-        reason = "Descarga permitida"
-        
-        # 1. Verificar políticas globales del tenant (sin user_id ni group_id)
-        global_policies = user_supabase.table('policies').select('*')\
-            .eq('tenant_id', tenant_id)\
-            .is_('user_id', 'null')\
-            .is_('group_id', 'null')\
-            .eq('type', 'download')\
-            .execute()
-        
-        print(f"[Backend] Políticas globales encontradas: {len(global_policies.data)}")
-        if global_policies.data:
-            print(f"[Backend] Políticas globales: {global_policies.data}")
-            for policy in global_policies.data:
-                if policy['action'] == 'block':
-                    allowed = False
-                    reason = "Descargas bloqueadas por política global del tenant"
-                    print(f"[Backend] Descarga bloqueada por política global")
-                    return jsonify({"allowed": False, "reason": reason})
-        
-        # 2. Verificar políticas de grupos del usuario
-        if role == 'user':
-            # Obtener grupos del usuario
-            user_groups_res = user_supabase.table('group_users').select('group_id').eq('user_id', user_id).execute()
-            user_groups = [g['group_id'] for g in user_groups_res.data] if user_groups_res.data else []
-            
-            if user_groups:
-                group_policies = user_supabase.table('policies').select('*')\
-                    .in_('group_id', user_groups)\
-                    .eq('type', 'download')\
-                    .execute()
-                
-                print(f"[Backend] Políticas de grupos encontradas: {len(group_policies.data)}")
-                if group_policies.data:
-                    print(f"[Backend] Políticas de grupos: {group_policies.data}")
-                    for policy in group_policies.data:
-                        if policy['action'] == 'block':
-                            allowed = False
-                            reason = "Descargas bloqueadas por política de grupo"
-                            print(f"[Backend] Descarga bloqueada por política de grupo")
-                            return jsonify({"allowed": False, "reason": reason})
-        
-        # 3. Verificar políticas específicas del usuario
-        user_policies = user_supabase.table('policies').select('*')\
-            .eq('tenant_id', tenant_id)\
-            .eq('user_id', user_id)\
-            .eq('type', 'download')\
-            .execute()
-        
-        print(f"[Backend] Políticas de usuario encontradas: {len(user_policies.data)}")
-        if user_policies.data:
-            print(f"[Backend] Políticas de usuario: {user_policies.data}")
-            for policy in user_policies.data:
-                if policy['action'] == 'block':
-                    allowed = False
-                    reason = "Descargas bloqueadas por política de usuario"
-                    print(f"[Backend] Descarga bloqueada por política de usuario")
-                    return jsonify({"allowed": False, "reason": reason})
-        
-        print(f"[Backend] Resultado final - Permitido: {allowed}, Razón: {reason}")
-        return jsonify({"allowed": allowed, "reason": reason})
+        logger.debug("Verificando descarga - Usuario: %s, Archivo: %s, URL: %s", user_id, filename, url)
+        result = download_policies.check(tenant_id, role, user_id)
+        logger.debug("Resultado final - Permitido: %s, Razón: %s", result['allowed'], result['reason'])
+        return jsonify(result)
         
     except Exception as e:
-        print(f"[Backend] Error en check_download: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en check_download: %s", e)
         # En caso de error, permitir la descarga para no interrumpir al usuario
         return jsonify({"allowed": True, "reason": "Error al verificar políticas"})
 
+# Máximo de archivos por petición en /api/check-download/batch
+CHECK_DOWNLOAD_BATCH_MAX = int(os.getenv('CHECK_DOWNLOAD_BATCH_MAX', 50))
+
+def download_batch_results(files, decision):
+    """Resultado por archivo de /api/check-download/batch (en el mismo orden)"""
+    return [
+        {
+            "url": f.get('url', '') if isinstance(f, dict) else '',
+            "filename": f.get('filename', '') if isinstance(f, dict) else '',
+            "allowed": decision['allowed'],
+            "reason": decision['reason']
+        }
+        for f in files
+    ]
+
+@app.route('/api/check-download/batch', methods=['POST'])
+@jwt_required()
+def check_download_batch():
+    """
+    Verifica varios archivos candidatos en una sola llamada.
+    Recibe: { files: [{ url, filename, filesize, mimetype }, ...] }
+    Retorna: { success, results: [{ url, filename, allowed, reason }, ...] }
+    """
+    data = request.get_json(silent=True) or {}
+    files = data.get('files')
+    if not isinstance(files, list):
+        return jsonify({"success": False, "error": "Se esperaba una lista 'files'"}), 400
+    if len(files) > CHECK_DOWNLOAD_BATCH_MAX:
+        return jsonify({"success": False, "error": f"Máximo {CHECK_DOWNLOAD_BATCH_MAX} archivos por petición"}), 413
+
+    claims = get_jwt()
+    try:
+        decision = download_policies.check(claims.get('tenant_id'), claims.get('role'), claims.get('sub'))
+    except Exception as e:
+        logger.error("Error en check_download_batch: %s", e)
+        # En caso de error, permitir la descarga para no interrumpir al usuario
+        decision = {"allowed": True, "reason": "Error al verificar políticas"}
+    return jsonify({"success": True, "results": download_batch_results(files, decision)})
+
 # --- ENDPOINT: DASHBOARD ---
 @app.route('/api/admin/dashboard', methods=['GET'])
 @jwt_required()
@@ -1555,7 +1815,7 @@ def admin_dashboard():
     try:
         claims = get_jwt()
         admin_id = claims.get('sub')  # Obtener el ID del admin actual
-        print(f"ADMIN_DASHBOARD - Claims: {claims}")
+        logger.debug("ADMIN_DASHBOARD - Claims: %s", loggable_claims(claims))
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
 
@@ -1591,7 +1851,7 @@ def admin_dashboard():
         # 6. Últimos 5 clientes
         recent_clients = sorted(tenants, key=lambda x: x['created_at'], reverse=True)[:5]
         
-        print(f"ADMIN_DASHBOARD - total_clients: {total_clients}, total_users: {total_users}")
+        logger.debug("ADMIN_DASHBOARD - total_clients: %s, total_users: %s", total_clients, total_users)
         return jsonify({
             "success": True,
             "data": {
@@ -1603,7 +1863,7 @@ def admin_dashboard():
             }
         })
     except Exception as e:
-        print(f"ADMIN_DASHBOARD - Error: {str(e)}")
+        logger.error("ADMIN_DASHBOARD - Error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 # --- ENDPOINTS: CLIENTES (TENANTS) ---
@@ -1612,24 +1872,24 @@ def admin_dashboard():
 @admin_required
 def admin_get_clients():
     try:
-        print("=== Iniciando admin_get_clients ===")
+        logger.debug("=== Iniciando admin_get_clients ===")
         claims = get_jwt()
         admin_id = claims.get('sub')  # Obtener el ID del admin actual
-        print(f"Claims del token: {claims}")
+        logger.debug("Claims del token: %s", loggable_claims(claims))
 
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
 
-        print("Intentando obtener clientes de Supabase...")
+        logger.debug("Intentando obtener clientes de Supabase...")
         # Filtrar por admin_id para obtener solo los clientes de este admin
         tenants = user_supabase.table('tenants').select('*').eq('admin_id', admin_id).execute().data
-        print(f"Clientes obtenidos exitosamente: {len(tenants)}")
+        logger.debug("Clientes obtenidos exitosamente: %s", len(tenants))
 
         return jsonify({"success": True, "data": tenants})
     except Exception as e:
-        print(f"=== ERROR en admin_get_clients ===")
-        print(f"Tipo de error: {type(e).__name__}")
-        print(f"Mensaje de error: {str(e)}")
+        logger.error("=== ERROR en admin_get_clients ===")
+        logger.error("Tipo de error: %s", type(e).__name__)
+        logger.error("Mensaje de error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/admin/clients', methods=['POST'])
@@ -1646,8 +1906,8 @@ def admin_create_client():
         user_supabase = get_supabase_with_jwt(jwt_token)
 
         # Prints de depuración
-        print(f"admin_id a insertar: {admin_id} (type: {type(admin_id)})")
-        print(f"sub del JWT: {claims.get('sub')} (type: {type(claims.get('sub'))})")
+        logger.debug("admin_id a insertar: %s (type: %s)", admin_id, type(admin_id))
+        logger.debug("sub del JWT: %s (type: %s)", claims.get('sub'), type(claims.get('sub')))
 
         tenant = user_supabase.table('tenants').insert({
             'name': data.get('name'),
@@ -1682,6 +1942,8 @@ def admin_update_client(client_id):
 def admin_delete_client(client_id):
     try:
         supabase.table('tenants').delete().eq('id', client_id).execute()
+        # tenant_configs se borra en cascada
+        tenant_configs.invalidate(client_id)
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
@@ -1692,9 +1954,9 @@ def admin_delete_client(client_id):
 @admin_required
 def admin_get_users():
     try:
-        print("=== Iniciando admin_get_users ===")
+        logger.debug("=== Iniciando admin_get_users ===")
         claims = get_jwt()
-        print(f"Claims del token: {claims}")
+        logger.debug("Claims del token: %s", loggable_claims(claims))
         admin_id = claims.get('sub')
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
@@ -1713,12 +1975,12 @@ def admin_get_users():
         for u in users:
             u['tenant_name'] = tenants_dict.get(u.get('tenant_id'), '')
 
-        print(f"Usuarios encontrados: {len(users)}")
+        logger.debug("Usuarios encontrados: %s", len(users))
         return jsonify({"success": True, "data": users})
     except Exception as e:
-        print(f"=== ERROR en admin_get_users ===")
-        print(f"Tipo de error: {type(e).__name__}")
-        print(f"Mensaje de error: {str(e)}")
+        logger.error("=== ERROR en admin_get_users ===")
+        logger.error("Tipo de error: %s", type(e).__name__)
+        logger.error("Mensaje de error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/admin/users', methods=['POST'])
@@ -1775,7 +2037,7 @@ def admin_create_user():
         
         return jsonify({"success": True, "data": user})
     except Exception as e:
-        print(f"Error en admin_create_user: {str(e)}")
+        logger.error("Error en admin_create_user: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/admin/users/<user_id>', methods=['PUT'])
@@ -1814,7 +2076,7 @@ def admin_delete_user(user_id):
         try:
             supabase.auth.admin.delete_user(user_id)
         except Exception as e:
-            print(f"Error eliminando en Supabase Auth: {str(e)}")
+            logger.error("Error eliminando en Supabase Auth: %s", e)
             return jsonify({"success": False, "error": f"Error eliminando en Auth: {str(e)}"}), 400
 
         # Si fue exitoso, eliminar de la tabla users
@@ -1828,7 +2090,7 @@ def admin_delete_user(user_id):
             "message": "Usuario eliminado correctamente"
         })
     except Exception as e:
-        print(f"Error en delete_user: {str(e)}")
+        logger.error("Error en delete_user: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -1841,15 +2103,15 @@ def admin_delete_user(user_id):
 def athos_get_admins():
     try:
         claims = get_jwt()
-        print(f"ATHOS_GET_ADMINS - Claims: {claims}")
+        logger.debug("ATHOS_GET_ADMINS - Claims: %s", loggable_claims(claims))
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
         
         admins = user_supabase.table('users').select('*').eq('role', 'admin').execute().data
-        print(f"ATHOS_GET_ADMINS - Admins encontrados: {len(admins)}")
+        logger.debug("ATHOS_GET_ADMINS - Admins encontrados: %s", len(admins))
         return jsonify({"success": True, "data": admins})
     except Exception as e:
-        print(f"ATHOS_GET_ADMINS - Error: {str(e)}")
+        logger.error("ATHOS_GET_ADMINS - Error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/athos/admins', methods=['POST'])
@@ -2005,7 +2267,7 @@ def athos_delete_admin(admin_id):
 def athos_get_clientes():
     try:
         claims = get_jwt()
-        print(f"ATHOS_GET_CLIENTES - Claims: {claims}")
+        logger.debug("ATHOS_GET_CLIENTES - Claims: %s", loggable_claims(claims))
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
 
@@ -2017,10 +2279,10 @@ def athos_get_clientes():
         if admin_id:
             query = query.eq('admin_id', admin_id)
         clientes = query.execute().data
-        print(f"ATHOS_GET_CLIENTES - Clientes encontrados: {len(clientes)}")
+        logger.debug("ATHOS_GET_CLIENTES - Clientes encontrados: %s", len(clientes))
         return jsonify({"success": True, "data": clientes})
     except Exception as e:
-        print(f"ATHOS_GET_CLIENTES - Error: {str(e)}")
+        logger.error("ATHOS_GET_CLIENTES - Error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/athos/clientes', methods=['POST'])
@@ -2057,6 +2319,8 @@ def athos_update_cliente(cliente_id):
 def athos_delete_cliente(cliente_id):
     try:
         supabase.table('tenants').delete().eq('id', cliente_id).execute()
+        # tenant_configs se borra en cascada
+        tenant_configs.invalidate(cliente_id)
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
@@ -2067,15 +2331,15 @@ def athos_delete_cliente(cliente_id):
 @athos_owner_required
 def athos_get_usuarios():
     try:
-        print("=== Iniciando athos_get_usuarios ===")
+        logger.debug("=== Iniciando athos_get_usuarios ===")
         claims = get_jwt()
-        print(f"Claims del token: {claims}")
+        logger.debug("Claims del token: %s", loggable_claims(claims))
         
         # Obtener el token JWT para pasar a Supabase
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         user_supabase = get_supabase_with_jwt(jwt_token)
         
-        print("Iniciando consulta a Supabase...")
+        logger.debug("Iniciando consulta a Supabase...")
         query = user_supabase.table('users').select('*')
         
         # Aplicar filtros si existen
@@ -2084,24 +2348,24 @@ def athos_get_usuarios():
         tenant_id = request.args.get('tenant_id')
         
         if email:
-            print(f"Aplicando filtro de email: {email}")
+            logger.debug("Aplicando filtro de email: %s", email)
             query = query.ilike('email', f'%{email}%')
         if role:
-            print(f"Aplicando filtro de role: {role}")
+            logger.debug("Aplicando filtro de role: %s", role)
             query = query.eq('role', role)
         if tenant_id:
-            print(f"Aplicando filtro de tenant_id: {tenant_id}")
+            logger.debug("Aplicando filtro de tenant_id: %s", tenant_id)
             query = query.eq('tenant_id', tenant_id)
             
-        print("Ejecutando consulta final...")
+        logger.debug("Ejecutando consulta final...")
         usuarios = query.execute()
-        print(f"Usuarios encontrados: {len(usuarios.data)}")
+        logger.debug("Usuarios encontrados: %s", len(usuarios.data))
         
         return jsonify({"success": True, "data": usuarios.data})
     except Exception as e:
-        print(f"=== ERROR en athos_get_usuarios ===")
-        print(f"Tipo de error: {type(e).__name__}")
-        print(f"Mensaje de error: {str(e)}")
+        logger.error("=== ERROR en athos_get_usuarios ===")
+        logger.error("Tipo de error: %s", type(e).__name__)
+        logger.error("Mensaje de error: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/athos/usuarios', methods=['POST'])
@@ -2169,37 +2433,26 @@ def get_alerts():
 
         alert_stats_res = query.order('last_updated', desc=True).execute()
 
-        print(f"Estadísticas obtenidas para tenant {tenant_id} (rol {role}): {len(alert_stats_res.data)}")
+        logger.debug("Estadísticas obtenidas para tenant %s (rol %s): %s", tenant_id, role, len(alert_stats_res.data))
 
         # Devolvemos las estadísticas directamente.
         return jsonify({"success": True, "data": alert_stats_res.data})
 
     except Exception as e:
-        import traceback
-        print(f"Error en get_alerts: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error en get_alerts: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/prohibited_sites', methods=['GET'])
 def get_prohibited_sites():
     try:
-        print("[Backend] Iniciando carga de sitios prohibidos...")
-        # Cargar el archivo prohibidos.json
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        file_path = os.path.join(script_dir, 'prohibidos.json')
-        print(f"[Backend] Ruta del archivo: {file_path}")
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            print(f"[Backend] Se cargaron {len(data)} categorías de sitios prohibidos")
-        
-        # Excluir la categoría 'recomendaciones' si existe
-        data = {k: v for k, v in data.items() if k != 'recomendaciones'}
-        return jsonify({"success": True, "data": data})
+        # Respuesta ya serializada de la versión vigente; 304 si el cliente tiene la misma
+        catalog = prohibited_catalog.current()
+        response = app.response_class(catalog.body, mimetype='application/json')
+        response.set_etag(catalog.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
-        print(f"[Backend] Error al leer prohibidos.json: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error al obtener sitios prohibidos: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/navigation_logs/riesgo', methods=['GET'])
@@ -2219,9 +2472,12 @@ def get_risk_logs():
         date_to = request.args.get('date_to')
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 20))
+        # Paginación por cursor (risk_score, timestamp, id); 'page' se mantiene por compatibilidad
+        cursor = request.args.get('cursor')
+        count = count_mode(request.args.get('count'), default='none' if cursor else 'exact')
 
         # Construir la consulta base
-        base_query = user_supabase.table('navigation_logs').select('*')
+        base_query = user_supabase.table('navigation_logs').select('*', count=count)
         
         # Aplicar filtros de permisos
         if role == 'admin':
@@ -2241,29 +2497,11 @@ def get_risk_logs():
         if date_to:
             base_query = base_query.lte('timestamp', date_to)
 
-        # Total de registros filtrados
-        count_query = user_supabase.table('navigation_logs').select('id', count='exact')
-        if role == 'client':
-            count_query = count_query.eq('tenant_id', tenant_id)
-        if user_id:
-            count_query = count_query.eq('user_id', user_id)
-        if category:
-            count_query = count_query.eq('policy_info->category', category)
-        if date_from:
-            count_query = count_query.gte('timestamp', date_from)
-        if date_to:
-            count_query = count_query.lte('timestamp', date_to)
-        count_result = count_query.execute()
-        total = count_result.count if hasattr(count_result, 'count') else len(count_result.data)
-
-        # Paginación y datos
-        from_idx = (page - 1) * page_size
-        to_idx = from_idx + page_size - 1
-        data_query = base_query.order('risk_score', desc=True).order('timestamp', desc=True).range(from_idx, to_idx)
-        logs = data_query.execute()
+        # Datos y total en la misma consulta
+        logs, next_cursor, total = paginate(base_query, ['risk_score', 'timestamp', 'id'], cursor, page, page_size)
 
         # Calcular riesgo para registros que no lo tengan
-        for log in logs.data:
+        for log in logs:
             if log.get('risk_score') is None:
                 score = 0
                 event_details = log.get('event_details', {})  # Inicializar siempre
@@ -2313,14 +2551,15 @@ def get_risk_logs():
 
         return jsonify({
             "success": True,
-            "data": logs.data,
+            "data": logs,
             "total": total,
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": next_cursor
         })
 
     except Exception as e:
-        print(f"Error en get_risk_logs: {str(e)}")
+        logger.error("Error en get_risk_logs: %s", e)
         return jsonify({"success": False, "error": str(e)}), 400
 
 @app.route('/api/navigation_logs/comport', methods=['GET'])
@@ -2341,114 +2580,47 @@ def get_comport_navigation_logs():
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 20))
 
-        # Obtener logs de navegación filtrados
-        base_query = user_supabase.table('navigation_logs').select('*')
+        # Las anomalías se detectan al ingerir los logs (ver anomaly_detector.py)
+        query = user_supabase.table('behavior_anomalies')\
+            .select('user_id, tipo, detalle, hora', count='exact')
         if role == 'admin':
             pass
         elif role == 'client':
-            base_query = base_query.eq('tenant_id', tenant_id)
+            query = query.eq('tenant_id', tenant_id)
         else:
             return jsonify({"error": "No autorizado"}), 403
         if user_id:
-            base_query = base_query.eq('user_id', user_id)
-        if date_from:
-            base_query = base_query.gte('timestamp', date_from)
-        if date_to:
-            base_query = base_query.lte('timestamp', date_to)
-        logs = base_query.order('timestamp', desc=True).limit(1000).execute().data
-
-        # --- Lógica base de comportamientos anómalos ---
-        eventos = []
-        # 1. Cambio de horario
-        for log in logs:
-            hora = log.get('timestamp')
-            if hora:
-                hora_dt = None
-                try:
-                    from dateutil import parser
-                    hora_dt = parser.parse(hora)
-                except Exception:
-                    continue
-                if hora_dt.hour < 8 or hora_dt.hour > 19:
-                    eventos.append({
-                        'usuario': log.get('user_id'),
-                        'tipo': 'Cambio de horario',
-                        'detalle': f"Acceso fuera de horario laboral a {log.get('domain')}",
-                        'hora': hora,
-                        'sospechoso': True
-                    })
-        # 2. Sitio inusual (primer acceso a un dominio para ese usuario)
-        user_domains = {}
-        for log in reversed(logs):  # Procesar en orden cronológico
-            uid = log.get('user_id')
-            # Normalizar dominio base
-            dom = normalize_domain(log.get('domain') or log.get('url') or '')
-            hora = log.get('timestamp')
-            if not uid or not dom:
-                continue
-            if uid not in user_domains:
-                user_domains[uid] = set()
-            if dom not in user_domains[uid]:
-                eventos.append({
-                    'usuario': uid,
-                    'tipo': 'Sitio inusual',
-                    'detalle': f"Primer acceso a dominio desconocido: {dom}",
-                    'hora': hora,
-                    'sospechoso': True
-                })
-                user_domains[uid].add(dom)
-        # 3. Patrón irregular (más de 5 accesos en 10 minutos)
-        from collections import defaultdict
-        import datetime
-        user_times = defaultdict(list)
-        for log in logs:
-            uid = log.get('user_id')
-            hora = log.get('timestamp')
-            if not uid or not hora:
-                continue
-            try:
-                from dateutil import parser
-                hora_dt = parser.parse(hora)
-            except Exception:
-                continue
-            user_times[uid].append(hora_dt)
-        for uid, times in user_times.items():
-            times = sorted(times)
-            for i in range(len(times)):
-                window = [t for t in times if 0 <= (t - times[i]).total_seconds() <= 600]
-                if len(window) > 5:
-                    eventos.append({
-                        'usuario': uid,
-                        'tipo': 'Patrón irregular',
-                        'detalle': f"{len(window)} accesos en menos de 10 minutos",
-                        'hora': times[i].isoformat(),
-                        'sospechoso': True
-                    })
-                    break  # Solo un evento por usuario
-        # Filtros adicionales
+            query = query.eq('user_id', user_id)
         if tipo:
-            eventos = [e for e in eventos if e['tipo'] == tipo]
-        if user_id:
-            eventos = [e for e in eventos if e['usuario'] == user_id]
+            query = query.eq('tipo', tipo)
         if date_from:
-            eventos = [e for e in eventos if e['hora'] >= date_from]
+            query = query.gte('hora', date_from)
         if date_to:
-            eventos = [e for e in eventos if e['hora'] <= date_to]
-        eventos = sorted(eventos, key=lambda x: x['hora'], reverse=True)
-        total = len(eventos)
+            query = query.lte('hora', date_to)
+
         start = (page - 1) * page_size
-        end = start + page_size
-        data = eventos[start:end]
+        end = start + page_size - 1
+        result = query.order('hora', desc=True).range(start, end).execute()
+
+        data = [
+            {
+                'usuario': row.get('user_id'),
+                'tipo': row.get('tipo'),
+                'detalle': row.get('detalle'),
+                'hora': row.get('hora'),
+                'sospechoso': True
+            }
+            for row in result.data or []
+        ]
         return jsonify({
             'success': True,
             'data': data,
-            'total': total,
+            'total': result.count or 0,
             'page': page,
             'page_size': page_size
         })
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Error en get_comport_navigation_logs: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/navigation_logs/geo', methods=['GET'])
@@ -2470,9 +2642,12 @@ def get_geo_navigation_logs():
         estado = request.args.get('estado')  # 'habitual' o 'no_habitual'
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 20))
+        # Paginación por cursor (timestamp, id); 'page' se mantiene por compatibilidad
+        cursor = request.args.get('cursor')
+        count = count_mode(request.args.get('count'), default='none' if cursor else 'exact')
 
         # Construir query base
-        base_query = user_supabase.table('navigation_logs').select('*')
+        base_query = user_supabase.table('navigation_logs').select('*', count=count)
         
         # Aplicar filtros de tenant y usuario
         if role == 'client':
@@ -2493,29 +2668,8 @@ def get_geo_navigation_logs():
         if ciudad:
             base_query = base_query.ilike('city', f'%{ciudad}%')
 
-        # Obtener total de registros
-        count_query = user_supabase.table('navigation_logs').select('*', count='exact')
-        if role == 'client':
-            count_query = count_query.eq('tenant_id', tenant_id)
-        if user_id:
-            count_query = count_query.eq('user_id', user_id)
-        if date_from:
-            count_query = count_query.gte('timestamp', date_from)
-        if date_to:
-            count_query = count_query.lte('timestamp', date_to)
-        if pais:
-            count_query = count_query.ilike('country', f'%{pais}%')
-        if ciudad:
-            count_query = count_query.ilike('city', f'%{ciudad}%')
-            
-        count_result = count_query.execute()
-        total = count_result.count if hasattr(count_result, 'count') else 0
-
-        # Obtener datos paginados
-        logs = base_query.order('timestamp', desc=True).range(
-            (page - 1) * page_size,
-            page * page_size - 1
-        ).execute().data
+        # Obtener datos paginados y total en la misma consulta
+        logs, next_cursor, total = paginate(base_query, ['timestamp', 'id'], cursor, page, page_size)
 
         # Procesar logs para determinar IPs habituales
         eventos = []
@@ -2573,13 +2727,74 @@ def get_geo_navigation_logs():
             'data': eventos,
             'total': total,
             'page': page,
-            'page_size': page_size
+            'page_size': page_size,
+            'next_cursor': next_cursor
         })
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Error en get_geo_navigation_logs: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 400
 
+def format_session_duration(seconds):
+    """Formatea una duración en segundos como '45m', '2h 5m' o '1d 3h 5m'."""
+    if not seconds:
+        return "0m"
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours = minutes // 60
+    remaining_minutes = minutes % 60
+    if hours < 24:
+        return f"{hours}h {remaining_minutes}m"
+    days = hours // 24
+    remaining_hours = hours % 24
+    if remaining_hours > 0:
+        return f"{days}d {remaining_hours}h {remaining_minutes}m"
+    return f"{days}d {remaining_minutes}m"
+
+def navigation_stats_data(stats):
+    """Respuesta de /api/navigation_logs/stats a partir de la fila de navigation_stats()"""
+    if not stats or not stats.get('total_sites'):
+        return {
+            "total_sites": 0,
+            "most_frequent_category": None,
+            "active_users": 0,
+            "avg_session_time": "0m",
+            "category_distribution": [],
+            "user_distribution": [],
+            "hourly_distribution": []
+        }
+    return {
+        "total_sites": stats['total_sites'],
+        "most_frequent_category": stats.get('most_frequent_category'),
+        "active_users": stats.get('active_users', 0),
+        "avg_session_time": format_session_duration(stats.get('avg_session_seconds')),
+        "category_distribution": stats.get('category_distribution') or [],
+        "user_distribution": stats.get('user_distribution') or [],
+        "hourly_distribution": stats.get('hourly_distribution') or []
+    }
+
+def alerts_stats_data(stats):
+    """Respuesta de /api/alerts/stats a partir de la fila de alerts_stats()"""
+    empty_hours = {str(hour).zfill(2): 0 for hour in range(24)}
+    empty_severity = {"high": 0, "medium": 0, "low": 0}
+    if not stats or not stats.get('total_alerts'):
+        return {
+            "total_alerts": 0,
+            "alerts_by_category": {},
+            "alerts_by_user": {},
+            "alerts_by_hour": empty_hours,
+            "alerts_by_severity": empty_severity,
+            "alerts_trend": []
+        }
+    return {
+        "total_alerts": stats['total_alerts'],
+        "alerts_by_category": stats.get('alerts_by_category') or {},
+        "alerts_by_user": stats.get('alerts_by_user') or {},
+        "alerts_by_hour": stats.get('alerts_by_hour') or empty_hours,
+        "alerts_by_severity": stats.get('alerts_by_severity') or empty_severity,
+        "alerts_trend": stats.get('alerts_trend') or []
+    }
+
 @app.route('/api/navigation_logs/stats', methods=['GET'])
 @jwt_required()
 def get_navigation_stats():
@@ -2594,187 +2809,35 @@ def get_navigation_stats():
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
 
-        # Construir la consulta base
-        query = user_supabase.table('navigation_logs').select('*')
-
         # Aplicar filtros de tenant_id según el rol
         if role == 'admin':
-            pass  # Los admins pueden ver todo
+            stats_tenant_id = None  # Los admins pueden ver todo
         elif role == 'client':
-            query = query.eq('tenant_id', tenant_id)
+            stats_tenant_id = tenant_id
         else:
             return jsonify({"success": False, "error": "No autorizado"}), 403
 
-        # Aplicar filtros de fecha si se proporcionan
-        if date_from:
-            try:
-                datetime.fromisoformat(date_from.replace('Z', '+00:00'))
-                query = query.gte('timestamp', date_from)
-            except ValueError:
-                return jsonify({"success": False, "error": "Formato de fecha inválido"}), 400
-
-        if date_to:
-            try:
-                datetime.fromisoformat(date_to.replace('Z', '+00:00'))
-                query = query.lte('timestamp', date_to)
-            except ValueError:
-                return jsonify({"success": False, "error": "Formato de fecha inválido"}), 400
-
-        # Ejecutar la consulta
-        logs = query.execute()
-        print(f"Total de logs obtenidos: {len(logs.data)}")
-
-        if not logs.data:
-            return jsonify({
-                "success": True,
-                "data": {
-                    "total_sites": 0,
-                    "most_frequent_category": None,
-                    "active_users": 0,
-                    "avg_session_time": "0m",
-                    "category_distribution": [],
-                    "user_distribution": [],
-                    "hourly_distribution": []
-                }
-            })
-
-        # Procesar los datos
-        logs_data = logs.data
-
-        # Calcular estadísticas básicas
-        total_sites = len(logs_data)
-        active_users = len(set(log.get('user_id') for log in logs_data if log.get('user_id')))
-        print(f"Usuarios activos: {active_users}")
-
-        # Distribución por categorías
-        category_counts = {}
-        for log in logs_data:
-            policy_info = log.get('policy_info')
-            if isinstance(policy_info, dict):
-                category = policy_info.get('category', 'sin categoría')
-            else:
-                category = 'sin categoría'
-            category_counts[category] = category_counts.get(category, 0) + 1
-
-        most_frequent_category = max(category_counts.items(), key=lambda x: x[1])[0] if category_counts else None
-        category_distribution = [{"category": k, "count": v} for k, v in category_counts.items()]
-
-        # Distribución por usuario
-        user_counts = {}
-        for log in logs_data:
-            user_id = log.get('user_id')
-            if user_id:
-                user_counts[user_id] = user_counts.get(user_id, 0) + 1
-
-        user_distribution = [{"user_id": k, "count": v} for k, v in user_counts.items()]
-
-        # Distribución por hora
-        hourly_counts = {str(hour).zfill(2): 0 for hour in range(24)}
-        for log in logs_data:
-            timestamp = log.get('timestamp')
-            if timestamp:
+        # Validar filtros de fecha si se proporcionan
+        for value in (date_from, date_to):
+            if value:
                 try:
-                    hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-                    hourly_counts[str(hour).zfill(2)] = hourly_counts.get(str(hour).zfill(2), 0) + 1
-                except (ValueError, AttributeError):
-                    continue
-
-        hourly_distribution = [{"hour": k, "count": v} for k, v in sorted(hourly_counts.items())]
-
-        # Calcular tiempo promedio de sesión
-        user_sessions = {}
-        for log in logs_data:
-            user_id = log.get('user_id')
-            timestamp = log.get('timestamp')
-            if not user_id or not timestamp:
-                continue
-            try:
-                timestamp_dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                if user_id not in user_sessions:
-                    user_sessions[user_id] = []
-                user_sessions[user_id].append(timestamp_dt)
-            except (ValueError, AttributeError) as e:
-                print(f"Error procesando timestamp: {e}")
-                continue
-
-        print(f"Usuarios con logs: {len(user_sessions)}")
-
-        # Calcular duración promedio de sesión
-        session_durations = []
-        SESSION_TIMEOUT = 1800  # 30 minutos en segundos
-
-        for user_id, timestamps in user_sessions.items():
-            if len(timestamps) < 2:
-                continue
-
-            # Ordenar timestamps
-            timestamps.sort()
-            
-            current_session_start = timestamps[0]
-            last_timestamp = timestamps[0]
-            
-            for timestamp in timestamps[1:]:
-                time_diff = (timestamp - last_timestamp).total_seconds()
-                
-                if time_diff > SESSION_TIMEOUT:
-                    # Finalizar sesión actual
-                    session_duration = (last_timestamp - current_session_start).total_seconds()
-                    if session_duration > 0:
-                        session_durations.append(session_duration)
-                        print(f"Sesión para usuario {user_id}: {session_duration/60:.2f} minutos")
-                    # Iniciar nueva sesión
-                    current_session_start = timestamp
-                
-                last_timestamp = timestamp
-            
-            # Procesar última sesión
-            session_duration = (last_timestamp - current_session_start).total_seconds()
-            if session_duration > 0:
-                session_durations.append(session_duration)
-                print(f"Última sesión para usuario {user_id}: {session_duration/60:.2f} minutos")
-
-        print(f"Duración total de sesiones: {sum(session_durations)/60:.2f} minutos")
-        print(f"Número de sesiones válidas: {len(session_durations)}")
-
-        # Calcular tiempo promedio en formato amigable
-        if session_durations:
-            avg_seconds = sum(session_durations) / len(session_durations)
-            print(f"Promedio en segundos: {avg_seconds}")
-            minutes = int(avg_seconds // 60)
-            if minutes < 60:
-                avg_session_time = f"{minutes}m"
-            else:
-                hours = minutes // 60
-                remaining_minutes = minutes % 60
-                if hours < 24:
-                    avg_session_time = f"{hours}h {remaining_minutes}m"
-                else:
-                    days = hours // 24
-                    remaining_hours = hours % 24
-                    if remaining_hours > 0:
-                        avg_session_time = f"{days}d {remaining_hours}h {remaining_minutes}m"
-                    else:
-                        avg_session_time = f"{days}d {remaining_minutes}m"
-        else:
-            avg_session_time = "0m"
-
-        return jsonify({
-            "success": True,
-            "data": {
-                "total_sites": total_sites,
-                "most_frequent_category": most_frequent_category,
-                "active_users": active_users,
-                "avg_session_time": avg_session_time,
-                "category_distribution": category_distribution,
-                "user_distribution": user_distribution,
-                "hourly_distribution": hourly_distribution
-            }
-        })
+                    datetime.fromisoformat(value.replace('Z', '+00:00'))
+                except ValueError:
+                    return jsonify({"success": False, "error": "Formato de fecha inválido"}), 400
+
+        # Los agregados (categorías, usuarios, horas y sesiones) se calculan en
+        # la base de datos a partir de los rollups; ver migrations/003_navigation_rollups.sql
+        result = user_supabase.rpc('navigation_stats', {
+            'p_tenant_id': stats_tenant_id,
+            'p_date_from': date_from or None,
+            'p_date_to': date_to or None
+        }).execute()
+        stats = result.data[0] if result.data else None
+        logger.debug("Total de logs en estadísticas: %s", stats['total_sites'] if stats else 0)
+        return jsonify({"success": True, "data": navigation_stats_data(stats)})
 
     except Exception as e:
-        import traceback
-        print(f"Error en get_navigation_stats: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error en get_navigation_stats: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/alerts/stats', methods=['GET'])
@@ -2793,130 +2856,36 @@ def get_alerts_stats():
         user_id = request.args.get('user_id')
         category = request.args.get('category')
 
-        # Construir la consulta base
-        query = user_supabase.table('navigation_logs').select('*')
-
         # Aplicar filtros de tenant_id según el rol
         if role == 'admin':
-            pass  # Los admins pueden ver todo
+            stats_tenant_id = None  # Los admins pueden ver todo
         elif role == 'client':
-            query = query.eq('tenant_id', tenant_id)
+            stats_tenant_id = tenant_id
         else:
             return jsonify({"success": False, "error": "No autorizado"}), 403
 
-        # Aplicar filtros adicionales
-        if date_from:
-            try:
-                datetime.fromisoformat(date_from.replace('Z', '+00:00'))
-                query = query.gte('timestamp', date_from)
-            except ValueError:
-                return jsonify({"success": False, "error": "Formato de fecha inválido"}), 400
-
-        if date_to:
-            try:
-                datetime.fromisoformat(date_to.replace('Z', '+00:00'))
-                query = query.lte('timestamp', date_to)
-            except ValueError:
-                return jsonify({"success": False, "error": "Formato de fecha inválido"}), 400
-
-        if user_id:
-            query = query.eq('user_id', user_id)
-
-        if category:
-            query = query.eq('policy_info->category', category)
-
-        # Ejecutar la consulta
-        logs = query.execute()
-        logs_data = logs.data
-
-        if not logs_data:
-            return jsonify({
-                "success": True,
-                "data": {
-                    "total_alerts": 0,
-                    "alerts_by_category": {},
-                    "alerts_by_user": {},
-                    "alerts_by_hour": {str(hour).zfill(2): 0 for hour in range(24)},
-                    "alerts_by_severity": {
-                        "high": 0,
-                        "medium": 0,
-                        "low": 0
-                    },
-                    "alerts_trend": []
-                }
-            })
-
-        # Procesar los datos
-        alerts_by_category = {}
-        alerts_by_user = {}
-        alerts_by_hour = {str(hour).zfill(2): 0 for hour in range(24)}
-        alerts_by_severity = {"high": 0, "medium": 0, "low": 0}
-        alerts_trend = []
-
-        for log in logs_data:
-            # Contar por categoría
-            policy_info = log.get('policy_info')
-            if isinstance(policy_info, dict):
-                category = policy_info.get('category', 'sin categoría')
-            else:
-                category = 'sin categoría'
-            alerts_by_category[category] = alerts_by_category.get(category, 0) + 1
-
-            # Contar por usuario
-            user_id = log.get('user_id')
-            if user_id:
-                alerts_by_user[user_id] = alerts_by_user.get(user_id, 0) + 1
-
-            # Contar por hora
-            timestamp = log.get('timestamp')
-            if timestamp:
-                try:
-                    hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-                    alerts_by_hour[str(hour).zfill(2)] = alerts_by_hour.get(str(hour).zfill(2), 0) + 1
-                except (ValueError, AttributeError):
-                    continue
-
-            # Contar por severidad
-            risk_score = log.get('risk_score')
-            if risk_score is None:
-                risk_score = 0
-            if risk_score > 80:
-                alerts_by_severity["high"] += 1
-            elif risk_score > 50:
-                alerts_by_severity["medium"] += 1
-            else:
-                alerts_by_severity["low"] += 1
-
-            # Preparar tendencia
-            if timestamp:
+        # Validar filtros de fecha si se proporcionan
+        for value in (date_from, date_to):
+            if value:
                 try:
-                    date = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).date()
-                    alerts_trend.append(date.isoformat())
-                except (ValueError, AttributeError):
-                    continue
-
-        # Procesar tendencia
-        trend_data = {}
-        for date in alerts_trend:
-            trend_data[date] = trend_data.get(date, 0) + 1
-        alerts_trend = [{"date": date, "count": count} for date, count in sorted(trend_data.items())]
-
-        return jsonify({
-            "success": True,
-            "data": {
-                "total_alerts": len(logs_data),
-                "alerts_by_category": alerts_by_category,
-                "alerts_by_user": alerts_by_user,
-                "alerts_by_hour": alerts_by_hour,
-                "alerts_by_severity": alerts_by_severity,
-                "alerts_trend": alerts_trend
-            }
-        })
+                    datetime.fromisoformat(value.replace('Z', '+00:00'))
+                except ValueError:
+                    return jsonify({"success": False, "error": "Formato de fecha inválido"}), 400
+
+        # Los histogramas se leen de los rollups por hora mantenidos al insertar
+        # logs; ver migrations/003_navigation_rollups.sql
+        result = user_supabase.rpc('alerts_stats', {
+            'p_tenant_id': stats_tenant_id,
+            'p_date_from': date_from or None,
+            'p_date_to': date_to or None,
+            'p_user_id': user_id or None,
+            'p_category': category or None
+        }).execute()
+        stats = result.data[0] if result.data else None
+        return jsonify({"success": True, "data": alerts_stats_data(stats)})
 
     except Exception as e:
-        import traceback
-        print(f"Error en get_alerts_stats: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error en get_alerts_stats: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 # --- ENDPOINTS DE GRUPOS DE USUARIOS ---
@@ -2954,7 +2923,7 @@ def create_group():
                 # Identificar usuarios faltantes o no pertenecientes
                 existing_user_ids_in_tenant = {str(u['id']) for u in users_check.data}
                 missing_or_invalid_ids = [uid for uid in user_ids if str(uid) not in existing_user_ids_in_tenant]
-                print(f"Usuarios inválidos o no encontrados en el tenant {target_tenant_id}: {missing_or_invalid_ids}")
+                logger.debug("Usuarios inválidos o no encontrados en el tenant %s: %s", target_tenant_id, missing_or_invalid_ids)
                 return jsonify({"success": False, "error": f"Algunos usuarios no existen o no pertenecen al tenant especificado: {missing_or_invalid_ids}"}), 400
         
         # Insertar el nuevo grupo
@@ -2973,7 +2942,7 @@ def create_group():
             error_message = "No se pudo crear el grupo"
             if hasattr(new_group_res, 'error') and new_group_res.error:
                 error_message += f": {new_group_res.error.message}"
-            print(f"Error al crear grupo en Supabase: {error_message}, data: {group_data}")
+            logger.error("Error al crear grupo en Supabase: %s, data: %s", error_message, group_data)
             return jsonify({"success": False, "error": error_message}), 500
         
         created_group = new_group_res.data[0]
@@ -2995,17 +2964,18 @@ def create_group():
                 assoc_res = user_supabase.table('group_users').insert(group_user_associations).execute()
                 if hasattr(assoc_res, 'error') and assoc_res.error:
                     # Si falla la asociación, el grupo ya fue creado. Se podría revertir o loggear.
-                    print(f"Error al asociar usuarios al grupo {group_id}: {assoc_res.error.message}")
+                    logger.error("Error al asociar usuarios al grupo %s: %s", group_id, assoc_res.error.message)
                     # Devolver el grupo creado pero con una advertencia o un error parcial.
                     # Por ahora, devolvemos el grupo pero loggeamos el error.
                     # Considerar una transacción si es crítico que ambas operaciones (crear grupo, añadir miembros) sean atómicas.
+            membership_cache.invalidate_users(unique_user_ids)
 
+        if target_tenant_id:
+            policy_engine.invalidate(target_tenant_id)
         return jsonify({"success": True, "data": created_group}), 201
 
     except Exception as e:
-        print(f"Error en create_group: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en create_group: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/groups', methods=['GET'])
@@ -3037,7 +3007,7 @@ def get_groups():
         groups_res = base_query.order('name', desc=False).execute()
         
         if hasattr(groups_res, 'error') and groups_res.error:
-            print(f"Error al obtener grupos: {groups_res.error.message}")
+            logger.error("Error al obtener grupos: %s", groups_res.error.message)
             return jsonify({"success": False, "error": f"Error al obtener grupos: {groups_res.error.message}"}), 500
 
         processed_groups = []
@@ -3046,7 +3016,10 @@ def get_groups():
             
             # Obtener conteo de usuarios por grupo
             # La columna group_id en group_users es la FK a groups.id
-            counts_res = user_supabase.table('group_users').select('group_id, user_id').in_('group_id', group_ids).execute() # Contamos user_id para obtener el número de usuarios
+            # Contamos user_id para obtener el número de usuarios; la misma lectura
+            # se usa abajo para los miembros y el lote de la petición no la repite
+            queries = request_queries()
+            counts_res = queries.submit(user_supabase.table('group_users').select('group_id, user_id').in_('group_id', group_ids)).result()
             
             user_counts = {}
             if counts_res.data:
@@ -3061,7 +3034,7 @@ def get_groups():
             # Necesitas que 'users' sea una relación en 'group_users' o usar una función RPC.
             # Alternativa: Obtener todos los (group_id, user_id) y luego info de users.
             
-            group_user_pairs_res = user_supabase.table('group_users').select('group_id, user_id').in_('group_id', group_ids).execute()
+            group_user_pairs_res = queries.submit(user_supabase.table('group_users').select('group_id, user_id').in_('group_id', group_ids)).result()
             
             all_user_ids_in_groups = list(set([pair['user_id'] for pair in group_user_pairs_res.data if pair.get('user_id')]))
             users_info = {}
@@ -3099,9 +3072,7 @@ def get_groups():
         return jsonify({"success": True, "data": processed_groups})
 
     except Exception as e:
-        print(f"Error en get_groups: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en get_groups: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/groups/<group_id_str>', methods=['PUT']) # Cambiado a group_id_str para claridad
@@ -3162,7 +3133,7 @@ def update_group(group_id_str): # Cambiado a group_id_str
             update_payload['updated_at'] = datetime.utcnow().isoformat()
             updated_group_res = user_supabase.table('groups').update(update_payload).eq('id', group_id).execute()
             if hasattr(updated_group_res, 'error') and updated_group_res.error:
-                 print(f"Error al actualizar tabla groups: {updated_group_res.error.message}")
+                 logger.error("Error al actualizar tabla groups: %s", updated_group_res.error.message)
                  return jsonify({"success": False, "error": f"Error al actualizar el grupo: {updated_group_res.error.message}"}), 500
             if not updated_group_res.data: # Debería haber datos si la actualización fue exitosa
                  return jsonify({"success": False, "error": "No se pudo actualizar el grupo (no se devolvieron datos)"}), 500
@@ -3175,13 +3146,13 @@ def update_group(group_id_str): # Cambiado a group_id_str
                 if len(users_check.data) != len(user_ids_uuid):
                     existing_user_ids_in_tenant = {str(u['id']) for u in users_check.data}
                     missing_or_invalid_ids = [str(uid) for uid in user_ids_uuid if str(uid) not in existing_user_ids_in_tenant]
-                    print(f"Usuarios inválidos en PUT /api/groups/{group_id}: {missing_or_invalid_ids}")
+                    logger.debug("Usuarios inválidos en PUT /api/groups/%s: %s", group_id, missing_or_invalid_ids)
                     return jsonify({"success": False, "error": f"Algunos usuarios no existen o no pertenecen al tenant del grupo: {missing_or_invalid_ids}"}), 400
             
             # Eliminar asociaciones existentes para este grupo
             delete_assoc_res = user_supabase.table('group_users').delete().eq('group_id', group_id).execute()
             if hasattr(delete_assoc_res, 'error') and delete_assoc_res.error:
-                print(f"Error al eliminar asociaciones de usuarios para grupo {group_id}: {delete_assoc_res.error.message}")
+                logger.error("Error al eliminar asociaciones de usuarios para grupo %s: %s", group_id, delete_assoc_res.error.message)
                 # Continuar de todos modos, ya que el grupo podría haber sido actualizado.
                 # O devolver un error si esto es crítico.
 
@@ -3197,8 +3168,15 @@ def update_group(group_id_str): # Cambiado a group_id_str
                 if group_user_associations:
                     assoc_res = user_supabase.table('group_users').insert(group_user_associations).execute()
                     if hasattr(assoc_res, 'error') and assoc_res.error:
-                        print(f"Error al crear nuevas asociaciones de usuarios para grupo {group_id}: {assoc_res.error.message}")
+                        logger.error("Error al crear nuevas asociaciones de usuarios para grupo %s: %s", group_id, assoc_res.error.message)
                         # Considerar el manejo de este error.
+
+            # Miembros anteriores (los que estén en caché) y nuevos
+            membership_cache.invalidate_group(group_id)
+            membership_cache.invalidate_users(user_ids_uuid)
+
+            if current_group_tenant_id:
+                policy_engine.invalidate(current_group_tenant_id)
         
         # Obtener el grupo completamente actualizado para la respuesta (similar a get_groups)
         # Esto asegura que devolvemos el estado más reciente con conteo y usuarios.
@@ -3237,9 +3215,7 @@ def update_group(group_id_str): # Cambiado a group_id_str
         return jsonify({"success": True, "data": processed_group_final})
 
     except Exception as e:
-        print(f"Error en update_group (group_id: {group_id_str}): {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en update_group (group_id: %s): %s", group_id_str, e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/groups/<group_id_str>', methods=['DELETE']) # Cambiado a group_id_str
@@ -3271,161 +3247,158 @@ def delete_group(group_id_str): # Cambiado a group_id_str
         # Esto es importante si hay FK con ON DELETE CASCADE, pero hacerlo explícitamente es más seguro.
         delete_assoc_res = user_supabase.table('group_users').delete().eq('group_id', group_id).execute()
         if hasattr(delete_assoc_res, 'error') and delete_assoc_res.error:
-             print(f"Error al eliminar asociaciones de usuarios para grupo {group_id} durante DELETE: {delete_assoc_res.error.message}")
+             logger.error("Error al eliminar asociaciones de usuarios para grupo %s durante DELETE: %s", group_id, delete_assoc_res.error.message)
              # Considerar si se debe detener la eliminación del grupo aquí. Por ahora, continuamos.
+        membership_cache.invalidate_group(group_id)
 
         # Eliminar el grupo
         deleted_group_res = user_supabase.table('groups').delete().eq('id', group_id).execute()
 
         if hasattr(deleted_group_res, 'error') and deleted_group_res.error:
-            print(f"Error al eliminar grupo {group_id} de la tabla groups: {deleted_group_res.error.message}")
+            logger.error("Error al eliminar grupo %s de la tabla groups: %s", group_id, deleted_group_res.error.message)
             return jsonify({"success": False, "error": f"Error al eliminar el grupo: {deleted_group_res.error.message}"}), 500
         
         if not deleted_group_res.data and not (hasattr(deleted_group_res, 'error') and deleted_group_res.error):
             # Si no hay datos Y no hay error, podría significar que la RLS lo previno silenciosamente o ya no existía
             # (aunque la comprobación inicial debería haberlo detectado).
             # Supabase delete() devuelve los registros eliminados. Si está vacío, es posible que no se haya eliminado nada.
-             print(f"Advertencia: La eliminación del grupo {group_id} no devolvió datos y no reportó error explícito.")
+             logger.error("Advertencia: La eliminación del grupo %s no devolvió datos y no reportó error explícito.", group_id)
              # Podríamos tratar esto como un error o no, dependiendo de la expectativa.
              # Por seguridad, si no hay datos, asumimos que algo no fue como se esperaba, a menos que la RLS sea la causa.
              # return jsonify({"success": False, "error": "El grupo no pudo ser eliminado o ya no existía."}), 404
 
+        if group_check_res.data.get('tenant_id'):
+            policy_engine.invalidate(group_check_res.data['tenant_id'])
 
         return jsonify({"success": True, "message": "Grupo eliminado correctamente"})
 
     except Exception as e:
-        print(f"Error en delete_group (group_id: {group_id_str}): {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en delete_group (group_id: %s): %s", group_id_str, e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 # --- FIN ENDPOINTS DE GRUPOS DE USUARIOS ---
 
 def check_url_with_policies(url):
     try:
-        print(f"[Backend] Iniciando verificación de políticas para URL: {url}")
+        logger.debug("Iniciando verificación de políticas para URL: %s", url)
         # Normalizar el dominio
         domain = normalize_domain(url)
         if not domain:
-            print("[Backend] Error: URL inválida después de normalización")
+            logger.error("Error: URL inválida después de normalización")
             return False, "URL inválida"
 
         # Obtener el token JWT y claims
         jwt_token = request.headers.get('Authorization', '').replace('Bearer ', '')
         if not jwt_token:
-            print("[Backend] Error: No se encontró token JWT")
+            logger.error("Error: No se encontró token JWT")
             return False, "No autorizado"
 
         claims = get_jwt()
         role = claims.get('role')
         tenant_id = claims.get('tenant_id')
         user_id = claims.get('sub')  # Usar sub en lugar de user_id
-        print(f"[Backend] Verificando para usuario: {user_id}, rol: {role}, tenant: {tenant_id}")
+        logger.debug("Verificando para usuario: %s, rol: %s, tenant: %s", user_id, role, tenant_id)
 
         # Obtener conexión a Supabase
         user_supabase = get_supabase_with_jwt(jwt_token)
 
         # 1. Verificar políticas específicas del tenant y grupos
         if role == 'user':
-            print("[Backend] Verificando políticas para usuario normal")
+            logger.debug("Verificando políticas para usuario normal")
             try:
                 # Obtener políticas del tenant sin grupo
                 tenant_policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).is_('group_id', 'null').execute()
-                print(f"[Backend] Políticas del tenant: {len(tenant_policies.data)} encontradas")
+                logger.debug("Políticas del tenant: %s encontradas", len(tenant_policies.data))
                 
                 # Intentar obtener grupos del usuario, pero no fallar si la tabla no existe
                 user_groups = []
                 try:
-                    user_groups_res = user_supabase.table('group_users').select('group_id').eq('user_id', user_id).execute()
-                    user_groups = [g['group_id'] for g in user_groups_res.data] if user_groups_res.data else []
-                    print(f"[Backend] Grupos del usuario: {user_groups}")
+                    user_groups = user_group_ids(user_supabase, user_id)
+                    logger.debug("Grupos del usuario: %s", user_groups)
                 except Exception as e:
-                    print(f"[Backend] No se pudo obtener grupos del usuario (puede que la tabla no exista): {str(e)}")
+                    logger.warning("No se pudo obtener grupos del usuario (puede que la tabla no exista): %s", e)
                 
                 # Obtener políticas de los grupos del usuario si hay grupos
                 group_policies = []
                 if user_groups:
                     try:
                         group_policies = user_supabase.table('policies').select('*').in_('group_id', user_groups).execute().data
-                        print(f"[Backend] Políticas de grupos: {len(group_policies)} encontradas")
+                        logger.debug("Políticas de grupos: %s encontradas", len(group_policies))
                     except Exception as e:
-                        print(f"[Backend] Error al obtener políticas de grupos: {str(e)}")
+                        logger.error("Error al obtener políticas de grupos: %s", e)
                 
-                # Combinar y filtrar políticas para el dominio
+                # Combinar y filtrar políticas para el dominio (o sus dominios padre)
                 all_policies = tenant_policies.data + group_policies
-                domain_policies = [p for p in all_policies if p['domain'] == domain]
-                print(f"[Backend] Políticas específicas para el dominio: {len(domain_policies)} encontradas")
+                suffixes = set(domain_suffixes(domain))
+                domain_policies = [p for p in all_policies if p.get('domain') and normalize_domain(p['domain']) in suffixes]
+                logger.debug("Políticas específicas para el dominio: %s encontradas", len(domain_policies))
             except Exception as e:
-                print(f"[Backend] Error al obtener políticas: {str(e)}")
+                logger.error("Error al obtener políticas: %s", e)
                 raise Exception(f"Error al obtener políticas: {str(e)}")
         else:
-            print("[Backend] Verificando políticas para rol administrativo")
+            logger.debug("Verificando políticas para rol administrativo")
             try:
                 # Para client y admin, solo verificar políticas del tenant
-                domain_policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).eq('domain', domain).execute().data
-                print(f"[Backend] Políticas del tenant para el dominio: {len(domain_policies)} encontradas")
+                domain_policies = user_supabase.table('policies').select('*').eq('tenant_id', tenant_id).in_('domain', domain_suffixes(domain)).execute().data
+                logger.debug("Políticas del tenant para el dominio: %s encontradas", len(domain_policies))
             except Exception as e:
-                print(f"[Backend] Error al obtener políticas: {str(e)}")
+                logger.error("Error al obtener políticas: %s", e)
                 raise Exception(f"Error al obtener políticas: {str(e)}")
 
         if domain_policies:
-            print("[Backend] Analizando políticas encontradas")
+            logger.debug("Analizando políticas encontradas")
             # Si hay políticas específicas, usar la más restrictiva
             for policy in domain_policies:
                 if policy['action'] == 'block':
-                    print(f"[Backend] Dominio bloqueado por política: {policy}")
+                    logger.debug("Dominio bloqueado por política: %s", policy)
                     return True, {
                         "reason": "policy_violation",
                         "policy_details": policy
                     }
-            print("[Backend] Dominio permitido por políticas")
+            logger.debug("Dominio permitido por políticas")
             return False, None
 
         # 2. Verificar configuración del tenant
-        print("[Backend] Verificando configuración del tenant")
+        logger.debug("Verificando configuración del tenant")
         try:
-            tenant_config = user_supabase.table('tenant_configs').select('*').eq('tenant_id', tenant_id).maybe_single().execute()
+            config = tenant_configs.get(tenant_id)
             
-            if tenant_config and tenant_config.data:
-                config = tenant_config.data
-                if domain in config.get('blocked_domains', []):
-                    print(f"[Backend] Dominio bloqueado por configuración del tenant: {domain}")
+            if config.row:
+                if config.is_blocked(domain):
+                    logger.debug("Dominio bloqueado por configuración del tenant: %s", domain)
                     return True, {
                         "reason": "tenant_config",
                         "config_details": {"type": "blocked_domains"}
                     }
-                if domain in config.get('allowed_domains', []):
-                    print(f"[Backend] Dominio permitido por configuración del tenant: {domain}")
+                if config.is_allowed(domain):
+                    logger.debug("Dominio permitido por configuración del tenant: %s", domain)
                     return False, None
             else:
-                print("[Backend] No se encontró configuración del tenant, continuando con verificación global")
+                logger.debug("No se encontró configuración del tenant, continuando con verificación global")
         except Exception as e:
-            print(f"[Backend] Error al verificar configuración del tenant: {str(e)}")
-            print("[Backend] Continuando con verificación global")
+            logger.error("Error al verificar configuración del tenant: %s", e)
+            logger.warning("Continuando con verificación global")
 
         # 3. Verificar lista global de sitios prohibidos
-        print("[Backend] Verificando lista global de sitios prohibidos")
+        logger.debug("Verificando lista global de sitios prohibidos")
         try:
-            prohibited_categories = load_prohibited_sites()
-            # Verificar si el dominio está en alguna categoría prohibida
-            for category, sites in prohibited_categories.items():
-                if domain in sites:
-                    print(f"[Backend] Dominio encontrado en categoría prohibida: {category}")
-                    return True, {
-                        "reason": "prohibited_site",
-                        "site_details": {"category": category}
-                    }
+            # Categoría del sufijo más específico que coincida
+            category = prohibited_catalog.match(domain)
+            if category is not None:
+                logger.debug("Dominio encontrado en categoría prohibida: %s", category)
+                return True, {
+                    "reason": "prohibited_site",
+                    "site_details": {"category": category}
+                }
         except Exception as e:
-            print(f"[Backend] Error al verificar lista de sitios prohibidos: {str(e)}")
+            logger.error("Error al verificar lista de sitios prohibidos: %s", e)
             raise Exception(f"Error al verificar lista de sitios prohibidos: {str(e)}")
 
-        print(f"[Backend] Dominio permitido: {domain}")
+        logger.debug("Dominio permitido: %s", domain)
         return False, None
 
     except Exception as e:
-        print(f"[Backend] Error en check_url_with_policies: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en check_url_with_policies: %s", e)
         raise Exception(f"Error en verificación de políticas: {str(e)}")
 
 if __name__ == '__main__':
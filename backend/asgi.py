@@ -0,0 +1,449 @@
+"""
+Modo de servicio asíncrono (ASGI) de la API.
+
+Los endpoints calientes se sirven con FastAPI y PostgREST asíncrono: una
+petición que espera a Supabase no ocupa un hilo, y las consultas
+independientes de un mismo endpoint se lanzan a la vez con asyncio.gather.
+El resto de rutas las sigue atendiendo la app Flask (app.py), montada debajo
+con WSGIMiddleware, y ambas comparten el motor de políticas, la cola de
+ingesta y demás servicios del proceso.
+
+    uvicorn asgi:api --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import jwt
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from postgrest import AsyncPostgrestClient
+from starlette.concurrency import run_in_threadpool
+
+from app import (
+    app as flask_app,
+    CHECK_DOWNLOAD_BATCH_MAX,
+    NAVIGATION_BATCH_MAX,
+    alerts_stats_data,
+    build_navigation_log,
+    download_batch_results,
+    download_policies,
+    event_timestamp,
+    ingest_queue,
+    membership_cache,
+    navigation_stats_data,
+    normalize_domain,
+    policy_events,
+    policy_payload,
+    request_metrics,
+    tenant_policy_payload,
+    verify_policies,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AuthError(Exception):
+    def __init__(self, message, status_code=401):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class AsyncSupabase:
+    """
+    Cliente PostgREST asíncrono compartido por todas las peticiones.
+
+    Una sola sesión httpx (y su pool de conexiones keep-alive) sirve a todos
+    los usuarios: el JWT de cada petición se añade como cabecera de la
+    consulta, no de la sesión, así que no hace falta un cliente por token.
+    """
+
+    def __init__(self, url, key, timeout=10):
+        self._client = AsyncPostgrestClient(
+            f"{url}/rest/v1",
+            headers={
+                'apikey': key,
+                'Authorization': f'Bearer {key}',
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'
+            },
+            timeout=timeout
+        )
+
+    def table(self, name):
+        return self._client.table(name)
+
+    async def rpc(self, name, params):
+        return await self._client.rpc(name, params)
+
+    @staticmethod
+    async def execute(query, jwt_token):
+        query.headers['Authorization'] = f'Bearer {jwt_token}'
+        return await query.execute()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+supabase_async = AsyncSupabase(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await supabase_async.aclose()
+
+
+api = FastAPI(title='Athos API', docs_url=None, redoc_url=None, openapi_url=None, lifespan=lifespan)
+api.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "http://localhost:5173",
+        "http://localhost:4173",
+        "https://athos-frontend.onrender.com",
+        "https://getathos.com",
+        "https://www.getathos.com"
+    ],
+    # Permitir todas las extensiones de Chrome
+    allow_origin_regex=r"chrome-extension://.*",
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization", "Access-Control-Allow-Credentials"],
+    expose_headers=["Content-Type", "Authorization"]
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    Latencia, consultas y tamaños de las rutas FastAPI. Las peticiones que
+    pasan a la app Flask montada las registran sus propios hooks (app.py).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = request_metrics.begin_request()
+        status = 500
+        response_bytes = 0
+
+        async def measured_send(message):
+            nonlocal status, response_bytes
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                response_bytes += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            route = scope.get('route')
+            if isinstance(route, APIRoute):
+                headers = dict(scope['headers'])
+                request_metrics.observe_request(
+                    stats, route.path, scope['method'], status,
+                    request_bytes=int(headers.get(b'content-length') or 0),
+                    response_bytes=response_bytes
+                )
+
+
+api.add_middleware(RequestMetricsMiddleware)
+
+
+@api.exception_handler(AuthError)
+async def auth_error_handler(request, exc):
+    # Mismo formato que flask_jwt_extended
+    return JSONResponse({"msg": exc.message}, status_code=exc.status_code)
+
+
+def get_claims(request):
+    """Valida el JWT de la petición igual que @jwt_required() y devuelve (claims, token)."""
+    header = request.headers.get('Authorization')
+    if not header:
+        raise AuthError("Missing Authorization Header")
+    parts = header.split()
+    if len(parts) != 2 or parts[0] != 'Bearer':
+        raise AuthError("Bad Authorization header. Expected 'Authorization: Bearer <JWT>'")
+    token = parts[1]
+    try:
+        claims = jwt.decode(token, flask_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        raise AuthError("Token has expired")
+    except jwt.InvalidTokenError as e:
+        raise AuthError(str(e), status_code=422)
+    if claims.get('type', 'access') != 'access':
+        raise AuthError("Only non-refresh tokens are allowed", status_code=422)
+    return claims, token
+
+
+def _client_info(request):
+    return request.client.host if request.client else '', request.headers.get('User-Agent', '')
+
+
+async def user_group_ids(user_id, token):
+    """Lista de group_id del usuario (misma caché que app.user_group_ids)"""
+    group_ids, generation = membership_cache.lookup(user_id)
+    if group_ids is None:
+        db = supabase_async
+        res = await db.execute(db.table('group_users').select('group_id').eq('user_id', user_id), token)
+        group_ids = membership_cache.put(user_id, [g['group_id'] for g in res.data or []], generation)
+    return list(group_ids)
+
+
+@api.post('/api/navigation_logs')
+async def create_navigation_log(request: Request):
+    claims, _ = get_claims(request)
+    try:
+        data = await request.json()
+        tenant_id = claims.get('tenant_id')
+        role = claims.get('role')
+        user_id = claims.get('sub')
+        if not tenant_id:
+            return JSONResponse({"success": False, "error": "No se encontró tenant_id en el token"}, status_code=400)
+
+        domain = normalize_domain(data.get('url', ''))
+        # El snapshot de políticas puede recompilarse (E/S síncrona): fuera del bucle de eventos
+        policy_result = await run_in_threadpool(verify_policies, domain, tenant_id, role, user_id)
+        ip_address, user_agent = _client_info(request)
+        log_data = build_navigation_log(
+            data, user_id, tenant_id, policy_result,
+            ip_address=ip_address, user_agent=user_agent
+        )
+        # submit espera al fsync del spool: fuera del bucle de eventos
+        if not await run_in_threadpool(ingest_queue.submit, [log_data]):
+            return JSONResponse(
+                {"success": False, "error": "Cola de ingesta llena, reintentar más tarde"},
+                status_code=503, headers={'Retry-After': '5'}
+            )
+        return JSONResponse({"success": True, "data": [log_data], "queued": True}, status_code=202)
+    except Exception as e:
+        logger.error("Error al registrar log: %s", e)
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+
+@api.post('/api/navigation_logs/batch')
+async def create_navigation_logs_batch(request: Request):
+    claims, _ = get_claims(request)
+    try:
+        data = await request.json()
+        events = data.get('events') if isinstance(data, dict) else data
+        if not isinstance(events, list) or not events:
+            return JSONResponse({"success": False, "error": "Se requiere una lista de eventos"}, status_code=400)
+        if len(events) > NAVIGATION_BATCH_MAX:
+            return JSONResponse({"success": False, "error": f"Máximo {NAVIGATION_BATCH_MAX} eventos por petición"}, status_code=413)
+        if not all(isinstance(event, dict) for event in events):
+            return JSONResponse({"success": False, "error": "Formato de evento inválido"}, status_code=400)
+
+        tenant_id = claims.get('tenant_id')
+        role = claims.get('role')
+        user_id = claims.get('sub')
+        if not tenant_id:
+            return JSONResponse({"success": False, "error": "No se encontró tenant_id en el token"}, status_code=400)
+
+        ip_address, user_agent = _client_info(request)
+
+        def build_rows():
+            decisions = {}
+            rows = []
+            for event in events:
+                domain = normalize_domain(event.get('url', ''))
+                if domain not in decisions:
+                    decisions[domain] = verify_policies(domain, tenant_id, role, user_id)
+                rows.append(build_navigation_log(
+                    event, user_id, tenant_id, decisions[domain],
+                    timestamp=event_timestamp(event.get('timestamp')),
+                    ip_address=ip_address, user_agent=user_agent
+                ))
+            return rows
+
+        rows = await run_in_threadpool(build_rows)
+        if not await run_in_threadpool(ingest_queue.submit, rows):
+            return JSONResponse(
+                {"success": False, "error": "Cola de ingesta llena, reintentar más tarde"},
+                status_code=503, headers={'Retry-After': '5'}
+            )
+        return JSONResponse({
+            "success": True,
+            "queued": len(rows),
+            "actions": [row['action'] for row in rows]
+        }, status_code=202)
+    except Exception as e:
+        logger.error("Error al registrar lote de logs: %s", e)
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+
+@api.get('/api/policies')
+async def get_policies(request: Request):
+    claims, token = get_claims(request)
+    try:
+        role = claims.get('role')
+        tenant_id = claims.get('tenant_id')
+        user_id = claims.get('sub')
+        if not user_id:
+            return JSONResponse({"success": False, "error": "user_id no encontrado en el token"}, status_code=401)
+
+        db = supabase_async
+        policy_type = request.query_params.get('type', 'access')
+
+        if role != 'user':
+            policies = await db.execute(
+                db.table('policies').select('*, groups(name)').eq('tenant_id', tenant_id).eq('type', policy_type),
+                token
+            )
+            return {"success": True, "data": [tenant_policy_payload(p) for p in policies.data]}
+
+        # Grupos del usuario y políticas del tenant sin grupo, a la vez
+        user_groups, tenant_policies = await asyncio.gather(
+            user_group_ids(user_id, token),
+            db.execute(
+                db.table('policies').select('*').eq('tenant_id', tenant_id).is_('group_id', 'null').eq('type', policy_type),
+                token
+            )
+        )
+
+        # Las políticas de grupo y los nombres de esos grupos solo dependen de user_groups
+        group_policies, group_info = [], {}
+        if user_groups:
+            group_policies_res, groups_res = await asyncio.gather(
+                db.execute(db.table('policies').select('*').in_('group_id', user_groups).eq('type', policy_type), token),
+                db.execute(db.table('groups').select('id, name').in_('id', user_groups), token)
+            )
+            group_policies = group_policies_res.data or []
+            group_info = {g['id']: g for g in groups_res.data or []}
+
+        all_policies = (tenant_policies.data or []) + group_policies
+        return {"success": True, "data": [policy_payload(p, group_info) for p in all_policies]}
+    except Exception as e:
+        logger.error("Error en get_policies: %s", e)
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@api.post('/api/check-download')
+async def check_download(request: Request):
+    claims, _ = get_claims(request)
+    try:
+        return await run_in_threadpool(
+            download_policies.check, claims.get('tenant_id'), claims.get('role'), claims.get('sub')
+        )
+    except Exception as e:
+        logger.error("Error en check_download: %s", e)
+        # En caso de error, permitir la descarga para no interrumpir al usuario
+        return {"allowed": True, "reason": "Error al verificar políticas"}
+
+
+@api.post('/api/check-download/batch')
+async def check_download_batch(request: Request):
+    claims, _ = get_claims(request)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    files = data.get('files') if isinstance(data, dict) else None
+    if not isinstance(files, list):
+        return JSONResponse({"success": False, "error": "Se esperaba una lista 'files'"}, status_code=400)
+    if len(files) > CHECK_DOWNLOAD_BATCH_MAX:
+        return JSONResponse(
+            {"success": False, "error": f"Máximo {CHECK_DOWNLOAD_BATCH_MAX} archivos por petición"},
+            status_code=413
+        )
+    try:
+        decision = await run_in_threadpool(
+            download_policies.check, claims.get('tenant_id'), claims.get('role'), claims.get('sub')
+        )
+    except Exception as e:
+        logger.error("Error en check_download_batch: %s", e)
+        decision = {"allowed": True, "reason": "Error al verificar políticas"}
+    return {"success": True, "results": download_batch_results(files, decision)}
+
+
+def _stats_scope(claims, date_from, date_to):
+    """tenant de las estadísticas (None para admin) o una JSONResponse de error."""
+    role = claims.get('role')
+    if role == 'admin':
+        scope = None
+    elif role == 'client':
+        scope = claims.get('tenant_id')
+    else:
+        return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+    for value in (date_from, date_to):
+        if value:
+            try:
+                datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                return JSONResponse({"success": False, "error": "Formato de fecha inválido"}, status_code=400)
+    return scope
+
+
+@api.get('/api/navigation_logs/stats')
+async def get_navigation_stats(request: Request):
+    claims, token = get_claims(request)
+    try:
+        date_from = request.query_params.get('date_from')
+        date_to = request.query_params.get('date_to')
+        scope = _stats_scope(claims, date_from, date_to)
+        if isinstance(scope, JSONResponse):
+            return scope
+        query = await supabase_async.rpc('navigation_stats', {
+            'p_tenant_id': scope,
+            'p_date_from': date_from or None,
+            'p_date_to': date_to or None
+        })
+        result = await supabase_async.execute(query, token)
+        stats = result.data[0] if result.data else None
+        return {"success": True, "data": navigation_stats_data(stats)}
+    except Exception as e:
+        logger.error("Error en get_navigation_stats: %s", e)
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@api.get('/api/alerts/stats')
+async def get_alerts_stats(request: Request):
+    claims, token = get_claims(request)
+    try:
+        params = request.query_params
+        date_from = params.get('date_from')
+        date_to = params.get('date_to')
+        scope = _stats_scope(claims, date_from, date_to)
+        if isinstance(scope, JSONResponse):
+            return scope
+        query = await supabase_async.rpc('alerts_stats', {
+            'p_tenant_id': scope,
+            'p_date_from': date_from or None,
+            'p_date_to': date_to or None,
+            'p_user_id': params.get('user_id') or None,
+            'p_category': params.get('category') or None
+        })
+        result = await supabase_async.execute(query, token)
+        stats = result.data[0] if result.data else None
+        return {"success": True, "data": alerts_stats_data(stats)}
+    except Exception as e:
+        logger.error("Error en get_alerts_stats: %s", e)
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@api.get('/api/policies/stream')
+async def stream_policies(request: Request):
+    # Cada conexión abierta es una corrutina en espera, no un hilo del servidor
+    claims, _ = get_claims(request)
+    tenant_id = claims.get('tenant_id')
+    if not tenant_id:
+        return JSONResponse({"success": False, "error": "Token sin tenant"}, status_code=401)
+    return StreamingResponse(
+        policy_events.astream(tenant_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# El resto de la API sigue en Flask
+api.mount('/', WSGIMiddleware(flask_app))
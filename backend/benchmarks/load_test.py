@@ -0,0 +1,192 @@
+"""
+Prueba de carga HTTP del backend: peticiones por segundo y latencias.
+
+Contra un servidor ya arrancado:
+    python benchmarks/load_test.py --url http://localhost:5001/api/policies/rules \
+        --token "$TOKEN" -c 32 -d 20
+
+Comparando el servidor de desarrollo de Flask (python app.py) con el perfil
+de producción (gunicorn -c gunicorn.conf.py); el script arranca cada uno en
+un puerto libre, lo mide y lo detiene:
+    python benchmarks/load_test.py --compare --path /api/policies/rules \
+        --sign role=user,tenant_id=<tenant>,sub=<user> -c 64 -d 30
+
+--sign firma el token con JWT_SECRET_KEY (el mismo que usa el backend).
+Se ejecuta desde backend/ y con las variables de entorno del backend.
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'dev': [sys.executable, 'app.py'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+}
+
+
+def sign_token(claims):
+    import jwt
+    payload = dict(item.split('=', 1) for item in claims.split(','))
+    payload.setdefault('iat', int(time.time()))
+    payload.setdefault('type', 'access')
+    return jwt.encode(payload, os.getenv('JWT_SECRET_KEY', 'dev-secret-key'), algorithm='HS256')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def worker(url, method, body, headers, deadline, latencies, statuses, lock):
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    conn = None
+    local_latencies, local_statuses = [], {}
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        # Una conexión keep-alive puede cerrarla el servidor entre peticiones
+        # (p. ej. al reciclar un worker): se reintenta una vez con otra nueva
+        for reused in (conn is not None, False):
+            if conn is None:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    conn = None
+                break
+            except (OSError, http.client.HTTPException):
+                status = 'error'
+                conn.close()
+                conn = None
+                if not reused:
+                    break
+        local_latencies.append(time.perf_counter() - start)
+        local_statuses[status] = local_statuses.get(status, 0) + 1
+    if conn is not None:
+        conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        for status, count in local_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+
+def run(url, method='GET', data=None, token=None, concurrency=32, duration=20):
+    headers = {'Accept': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    body = None
+    if data is not None:
+        body = data.encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+
+    latencies, statuses, lock = [], {}, threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=worker, args=(url, method, body, headers, deadline, latencies, statuses, lock))
+        for _ in range(concurrency)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'statuses': {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.3)
+    raise RuntimeError(f'El servidor no respondió en el puerto {port}')
+
+
+def measure_server(name, path, args):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    process = subprocess.Popen(
+        SERVERS[name], cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    try:
+        wait_until_up(port)
+        url = f'http://127.0.0.1:{port}{path}'
+        run(url, args.method, args.data, args.token, args.concurrency, min(3, args.duration))  # calentamiento
+        return run(url, args.method, args.data, args.token, args.concurrency, args.duration)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=40)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga del backend de Athos')
+    parser.add_argument('--url', help='URL completa (servidor ya arrancado)')
+    parser.add_argument('--compare', action='store_true', help='Arranca y compara el servidor de desarrollo y gunicorn')
+    parser.add_argument('--path', default='/api/policies/rules', help='Ruta a medir con --compare')
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--data', help='Cuerpo JSON de la petición')
+    parser.add_argument('--token', default=os.getenv('ATHOS_TOKEN'), help='JWT (por defecto $ATHOS_TOKEN)')
+    parser.add_argument('--sign', help='Firma un JWT con estos claims: role=user,tenant_id=...,sub=...')
+    parser.add_argument('-c', '--concurrency', type=int, default=32)
+    parser.add_argument('-d', '--duration', type=float, default=20, help='Segundos de medición')
+    args = parser.parse_args()
+
+    if args.sign:
+        args.token = sign_token(args.sign)
+    if args.data is not None:
+        json.loads(args.data)  # error claro si el JSON no es válido
+
+    if args.compare:
+        results = {}
+        for name in SERVERS:
+            print(f'Midiendo {name} ({args.concurrency} conexiones, {args.duration:g}s)...', file=sys.stderr)
+            results[name] = measure_server(name, args.path, args)
+        if results['dev']['rps']:
+            results['speedup'] = round(results['gunicorn']['rps'] / results['dev']['rps'], 2)
+        print(json.dumps(results, indent=2))
+    elif args.url:
+        print(json.dumps(run(args.url, args.method, args.data, args.token, args.concurrency, args.duration), indent=2))
+    else:
+        parser.error('indica --url o --compare')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+-- Benchmark de navigation_logs: planes de consulta antes y después de la
+-- migración 005 (particionado mensual con índices compuestos y de trigramas).
+--
+-- Genera un conjunto sintético en el esquema "bench" (no toca las tablas reales):
+--   bench.logs_before  tabla sin particionar y sin índices (schema.sql original)
+--   bench.logs_after   tabla particionada por mes con los índices de 005
+-- y ejecuta EXPLAIN (ANALYZE, BUFFERS) de las consultas de app.py sobre ambas.
+--
+-- Uso (50M filas por defecto; ~25 GB de disco entre las dos tablas):
+--   psql "$DATABASE_URL" -f backend/benchmarks/navigation_logs_bench.sql > bench.txt
+--   psql "$DATABASE_URL" -v rows=1000000 -f backend/benchmarks/navigation_logs_bench.sql
+-- Para repetir solo las consultas sin regenerar datos: -v skip_load=1
+
+\set ON_ERROR_STOP on
+\timing on
+
+\if :{?rows}
+\else
+\set rows 50000000
+\endif
+\if :{?skip_load}
+\else
+\set skip_load 0
+\endif
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE SCHEMA IF NOT EXISTS bench;
+
+SELECT :skip_load::INT = 1 AS skip_load \gset
+\if :skip_load
+\else
+
+DROP TABLE IF EXISTS bench.logs_before, bench.logs_after, bench.tenants, bench.users, bench.domains;
+
+-- 50 tenants, 5.000 usuarios y 20.000 dominios con distribución sesgada
+CREATE TABLE bench.tenants AS
+    SELECT gen_random_uuid() AS id, n FROM generate_series(1, 50) AS n;
+CREATE TABLE bench.users AS
+    SELECT gen_random_uuid() AS id, (SELECT id FROM bench.tenants t WHERE t.n = 1 + (u % 50)) AS tenant_id, u AS n
+    FROM generate_series(1, 5000) AS u;
+CREATE TABLE bench.domains AS
+    SELECT n, 'site' || n || '.' || (ARRAY['com', 'net', 'org', 'io', 'cl'])[1 + n % 5] AS domain
+    FROM generate_series(1, 20000) AS n;
+
+CREATE TABLE bench.logs_before (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID,
+    tenant_id UUID,
+    domain TEXT NOT NULL,
+    url TEXT NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    action TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    event_details JSONB,
+    policy_info JSONB,
+    risk_score INTEGER DEFAULT 0,
+    ip_address TEXT,
+    city TEXT,
+    country TEXT
+);
+
+-- Eventos repartidos en los últimos 12 meses
+INSERT INTO bench.logs_before (user_id, tenant_id, domain, url, timestamp, action, event_type, risk_score, ip_address, city, country)
+SELECT
+    u.id,
+    u.tenant_id,
+    'https://' || d.domain,
+    'https://' || d.domain || '/page/' || (g % 500),
+    NOW() - (random() * INTERVAL '365 days'),
+    (ARRAY['visitado', 'visitado', 'visitado', 'bloqueado', 'permitido'])[1 + g % 5],
+    (ARRAY['navegacion', 'navegacion', 'click', 'copy', 'download'])[1 + (g / 7) % 5],
+    CASE WHEN g % 11 = 0 THEN NULL ELSE (g % 101 * 37) % 101 END,
+    '10.0.' || (g % 256) || '.' || (g / 256 % 256),
+    (ARRAY['Santiago', 'Lima', 'Bogotá', 'Madrid'])[1 + g % 4],
+    (ARRAY['CL', 'PE', 'CO', 'ES'])[1 + g % 4]
+FROM (
+    -- random() en la lista de columnas se evalúa una vez por fila generada
+    SELECT g, 1 + floor(20000 * power(random(), 3))::INT AS domain_n
+    FROM generate_series(1, :rows) AS g
+) AS s
+JOIN bench.users u ON u.n = 1 + (s.g % 5000 * 7919) % 5000
+JOIN bench.domains d ON d.n = s.domain_n;
+
+-- Tabla particionada con los índices de la migración 005
+CREATE TABLE bench.logs_after (LIKE bench.logs_before INCLUDING DEFAULTS, PRIMARY KEY (id, timestamp))
+    PARTITION BY RANGE (timestamp);
+
+DO $$
+DECLARE
+    v_month DATE := date_trunc('month', NOW() - INTERVAL '365 days')::DATE;
+BEGIN
+    WHILE v_month <= NOW()::DATE LOOP
+        EXECUTE format(
+            'CREATE TABLE bench.%I PARTITION OF bench.logs_after FOR VALUES FROM (%L) TO (%L)',
+            'logs_after_' || to_char(v_month, '"y"YYYY"m"MM'),
+            v_month::TIMESTAMP AT TIME ZONE 'UTC',
+            (v_month + INTERVAL '1 month')::TIMESTAMP AT TIME ZONE 'UTC'
+        );
+        v_month := (v_month + INTERVAL '1 month')::DATE;
+    END LOOP;
+END;
+$$;
+CREATE TABLE bench.logs_after_default PARTITION OF bench.logs_after DEFAULT;
+
+INSERT INTO bench.logs_after SELECT * FROM bench.logs_before;
+
+CREATE INDEX ON bench.logs_after (tenant_id, timestamp DESC, id DESC);
+CREATE INDEX ON bench.logs_after (user_id, timestamp DESC, id DESC);
+CREATE INDEX ON bench.logs_after (timestamp DESC, id DESC);
+CREATE INDEX ON bench.logs_after (tenant_id, action, timestamp DESC, id DESC);
+CREATE INDEX ON bench.logs_after (tenant_id, risk_score DESC NULLS FIRST, timestamp DESC, id DESC);
+CREATE INDEX ON bench.logs_after (user_id, risk_score DESC NULLS FIRST, timestamp DESC, id DESC);
+CREATE INDEX ON bench.logs_after USING gin (domain gin_trgm_ops);
+CREATE INDEX ON bench.logs_after USING gin (url gin_trgm_ops);
+
+VACUUM ANALYZE bench.logs_before;
+VACUUM ANALYZE bench.logs_after;
+
+\endif
+
+-- Parámetros: el tenant con más eventos y un usuario suyo
+SELECT tenant_id AS tenant FROM bench.logs_before GROUP BY tenant_id ORDER BY COUNT(*) DESC LIMIT 1 \gset
+SELECT id AS user_id FROM bench.users WHERE tenant_id = :'tenant' LIMIT 1 \gset
+-- Página profunda (la 10.000 con 20 filas por página, o la mitad del tenant
+-- en ejecuciones pequeñas) y su cursor equivalente para comparar con OFFSET
+SELECT LEAST(199980, COUNT(*) / 2) AS page_offset FROM bench.logs_before WHERE tenant_id = :'tenant' \gset
+SELECT timestamp AS cursor_ts, id AS cursor_id
+FROM bench.logs_after WHERE tenant_id = :'tenant'
+ORDER BY timestamp DESC, id DESC OFFSET :page_offset - 1 LIMIT 1 \gset
+
+\echo '=== Tamaño de las tablas ==='
+SELECT 'before' AS tabla, pg_size_pretty(pg_total_relation_size('bench.logs_before')) AS tamaño
+UNION ALL
+SELECT 'after', pg_size_pretty(SUM(pg_total_relation_size(inhrelid)))
+FROM pg_inherits WHERE inhparent = 'bench.logs_after'::REGCLASS;
+
+\set target bench.logs_before
+\echo '########## ANTES: bench.logs_before ##########'
+\ir navigation_logs_bench_queries.sql
+
+\set target bench.logs_after
+\echo '########## DESPUÉS: bench.logs_after ##########'
+\ir navigation_logs_bench_queries.sql
@@ -0,0 +1,65 @@
+-- Consultas de app.py usadas por navigation_logs_bench.sql sobre :target
+
+\echo '--- get_navigation_logs: primera página del tenant'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant'
+ORDER BY timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- get_navigation_logs: últimos 7 días de un usuario'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant' AND user_id = :'user_id'
+  AND timestamp >= NOW() - INTERVAL '7 days'
+ORDER BY timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- get_navigation_logs: página profunda con OFFSET'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant'
+ORDER BY timestamp DESC, id DESC
+OFFSET :page_offset LIMIT 20;
+
+\echo '--- get_navigation_logs: la misma página con cursor (timestamp, id)'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant'
+  AND (timestamp < :'cursor_ts' OR (timestamp = :'cursor_ts' AND id < :'cursor_id'))
+ORDER BY timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- get_navigation_logs: acción bloqueada en los últimos 30 días'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant' AND action = 'bloqueado'
+  AND timestamp >= NOW() - INTERVAL '30 days'
+ORDER BY timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- get_navigation_logs: búsqueda ilike en domain'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant' AND domain ILIKE '%site1234%'
+ORDER BY timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- get_navigation_logs: búsqueda ilike en url'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE url ILIKE '%site777.org/page/12%'
+ORDER BY timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- get_risk_logs: primera página por riesgo'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM :target
+WHERE tenant_id = :'tenant'
+ORDER BY risk_score DESC NULLS FIRST, timestamp DESC, id DESC
+LIMIT 20;
+
+\echo '--- Conteo exacto del tenant en los últimos 30 días'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT COUNT(*) FROM :target
+WHERE tenant_id = :'tenant' AND timestamp >= NOW() - INTERVAL '30 days';
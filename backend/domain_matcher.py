@@ -0,0 +1,87 @@
+class _Node:
+    __slots__ = ('children', 'value')
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+
+
+class DomainMatcher:
+    """
+    Trie de sufijos por etiquetas invertidas (com -> google -> mail).
+    Una búsqueda cuesta O(número de etiquetas del hostname), sin importar
+    cuántos dominios contenga el índice:
+    - add('google.com', x) coincide con google.com y *.google.com
+    - match('mail.google.com') devuelve el valor del sufijo más específico
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._size = 0
+
+    @staticmethod
+    def _labels(domain):
+        return domain.strip().lower().strip('.').split('.')
+
+    def add(self, domain, value):
+        """Registra un dominio; si ya existía se conserva el primer valor."""
+        if not domain or value is None:
+            return
+        node = self._root
+        for label in reversed(self._labels(domain)):
+            if not label:
+                return
+            node = node.children.setdefault(label, _Node())
+        if node.value is None:
+            node.value = value
+            self._size += 1
+
+    def matches(self, hostname):
+        """Valores que coinciden con el hostname, del más específico al más general."""
+        if not hostname:
+            return []
+        found = []
+        node = self._root
+        for label in reversed(self._labels(hostname)):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.value is not None:
+                found.append(node.value)
+        found.reverse()
+        return found
+
+    def match(self, hostname):
+        found = self.matches(hostname)
+        return found[0] if found else None
+
+    def items(self):
+        """Pares (dominio, valor) registrados, en orden de etiquetas invertidas."""
+        stack = [((), self._root)]
+        while stack:
+            labels, node = stack.pop()
+            if node.value is not None:
+                yield '.'.join(reversed(labels)), node.value
+            for label, child in sorted(node.children.items(), reverse=True):
+                stack.append((labels + (label,), child))
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def from_categories(cls, categories, normalize=None):
+        """Construye un índice dominio -> categoría a partir de {categoria: [dominios]}."""
+        matcher = cls()
+        for category, sites in (categories or {}).items():
+            for site in sites:
+                matcher.add(normalize(site) if normalize else site, category)
+        return matcher
+
+
+def domain_suffixes(hostname):
+    """
+    Sufijos de un hostname del más específico al más general:
+    - mail.google.com -> ['mail.google.com', 'google.com', 'com']
+    """
+    labels = DomainMatcher._labels(hostname or '')
+    return ['.'.join(labels[i:]) for i in range(len(labels)) if labels[i]]
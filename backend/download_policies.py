@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ALLOWED = {"allowed": True, "reason": "Descarga permitida"}
+BLOCKED_GLOBAL = {"allowed": False, "reason": "Descargas bloqueadas por política global del tenant"}
+BLOCKED_GROUP = {"allowed": False, "reason": "Descargas bloqueadas por política de grupo"}
+BLOCKED_USER = {"allowed": False, "reason": "Descargas bloqueadas por política de usuario"}
+
+
+class _DownloadSnapshot:
+    """Permiso de descarga efectivo de un tenant, resuelto por usuario."""
+
+    def __init__(self, blocked_global, group_blocked_users, user_blocked_users):
+        self.blocked_global = blocked_global
+        self.group_blocked_users = group_blocked_users
+        self.user_blocked_users = user_blocked_users
+        self.loaded_at = time.monotonic()
+
+    def decision(self, role, user_id):
+        # Mismo orden que check_download: global, grupos (solo rol user) y usuario
+        if self.blocked_global:
+            return BLOCKED_GLOBAL
+        user_id = str(user_id)
+        if role == 'user' and user_id in self.group_blocked_users:
+            return BLOCKED_GROUP
+        if user_id in self.user_blocked_users:
+            return BLOCKED_USER
+        return ALLOWED
+
+
+class DownloadPolicyResolver:
+    """
+    Permisos de descarga precalculados por tenant.
+
+    Las políticas de tipo download no dependen del archivo, solo de quién
+    descarga: bloqueo global del tenant, de algún grupo del usuario o del
+    propio usuario. El snapshot de cada tenant carga sus políticas de
+    descarga y las membresías de los grupos con bloqueo (dos consultas) y
+    responde check_download con una búsqueda en memoria. Se recarga al
+    expirar el TTL o al invalidarse tras una escritura de políticas o grupos
+    (se registra en PolicyEngine.on_invalidate).
+
+    Como en MembershipCache, una carga que empezó antes de una invalidación
+    no guarda su resultado: cada invalidación incrementa la generación y el
+    snapshot solo se guarda si la generación no cambió durante la carga.
+    """
+
+    def __init__(self, client, ttl=60):
+        self._client = client
+        self._ttl = ttl
+        self._snapshots = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def invalidate(self, tenant_id=None):
+        with self._lock:
+            self._generation += 1
+            if tenant_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(str(tenant_id), None)
+
+    def _lookup(self, key):
+        """(snapshot vigente o None, snapshot guardado, generación para guardar una carga)"""
+        with self._lock:
+            current = self._snapshots.get(key)
+            generation = self._generation
+        if current is not None and time.monotonic() - current.loaded_at < self._ttl:
+            return current, current, generation
+        return None, current, generation
+
+    def _tenant_lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _load_snapshot(self, tenant_id):
+        policies = self._client.table('policies').select('group_id, user_id, action')\
+            .eq('tenant_id', tenant_id)\
+            .eq('type', 'download')\
+            .eq('action', 'block')\
+            .execute().data or []
+
+        blocked_global = False
+        blocked_groups = set()
+        user_blocked_users = set()
+        for policy in policies:
+            if policy.get('group_id'):
+                blocked_groups.add(str(policy['group_id']))
+            elif policy.get('user_id'):
+                user_blocked_users.add(str(policy['user_id']))
+            else:
+                blocked_global = True
+
+        group_blocked_users = set()
+        if blocked_groups and not blocked_global:
+            rows = self._client.table('group_users').select('user_id')\
+                .in_('group_id', sorted(blocked_groups))\
+                .execute().data or []
+            group_blocked_users = {str(row['user_id']) for row in rows}
+
+        return _DownloadSnapshot(blocked_global, frozenset(group_blocked_users), frozenset(user_blocked_users))
+
+    def snapshot(self, tenant_id):
+        key = str(tenant_id)
+        valid, _, _ = self._lookup(key)
+        if valid is not None:
+            return valid
+        with self._tenant_lock(key):
+            valid, current, generation = self._lookup(key)
+            if valid is not None:
+                return valid
+            try:
+                fresh = self._load_snapshot(tenant_id)
+            except Exception as e:
+                if current is None:
+                    raise
+                logger.error("Error al recargar permisos de descarga del tenant %s, se usan los anteriores: %s", tenant_id, e)
+                return current
+            with self._lock:
+                if generation == self._generation:
+                    self._snapshots[key] = fresh
+            return fresh
+
+    def check(self, tenant_id, role, user_id):
+        """{'allowed': bool, 'reason': str} para el usuario (igual para cualquier archivo)."""
+        return dict(self.snapshot(tenant_id).decision(role, user_id))
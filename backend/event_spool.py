@@ -0,0 +1,324 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Cabecera de cada registro: longitud del contenido y crc32 (big-endian)
+_HEADER = struct.Struct('>II')
+_SUFFIX = '.spool'
+
+
+def _encode(row):
+    payload = json.dumps(row, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_segment(path):
+    """
+    Filas de un segmento. La lectura se detiene en el primer registro
+    incompleto o con crc incorrecto (escritura cortada por una caída).
+    Devuelve (filas, bytes descartados).
+    """
+    rows = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return rows, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + _HEADER.size <= size:
+                length, crc = _HEADER.unpack_from(data, offset)
+                start = offset + _HEADER.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                rows.append(json.loads(payload.decode('utf-8')))
+                offset = start + length
+    return rows, size - offset
+
+
+class EventSpool:
+    """
+    Spool en disco (write-ahead, solo anexar) de los logs aceptados por la
+    ingesta.
+
+    Cada proceso reclama con flock un subdirectorio de directory (0, 1, ...),
+    así varios workers no comparten archivos y, tras un reinicio, los nuevos
+    procesos recuperan los segmentos pendientes de los anteriores. Los
+    registros (longitud, crc32, JSON) se anexan al segmento activo y un hilo
+    aparte hace el fsync.
+
+    Hay dos formas de anexar:
+    - journal(rows): las filas que la cola de ingesta tiene aún en memoria.
+      Espera al fsync (uno para todas las peticiones que esperan a la vez),
+      así el endpoint solo responde 202 con el evento ya en disco. La cola
+      llama a release() al escribirlas; un segmento sellado sin filas en
+      memoria ni pendientes de replay se borra sin releerlo.
+    - append(rows): filas que la cola no pudo escribir o que no le caben. No
+      espera al disco (fsync como mucho cada fsync_interval segundos).
+
+    El replayer relee (con mmap) los segmentos sellados que necesitan replay
+    y ya no tienen filas en memoria, y los escribe en lotes con writer(rows);
+    un segmento se borra solo cuando todas sus filas se escribieron. Tras un
+    reinicio se repiten todos los segmentos que queden. Las filas llevan su
+    id, así que repetir un segmento a medias no duplica logs.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 fsync_interval=0.2, sync_timeout=5):
+        self._segment_bytes = segment_bytes
+        self._max_bytes = max_bytes
+        self._fsync_interval = fsync_interval
+        self._sync_timeout = sync_timeout
+        self._lock = threading.Lock()
+        # Registros escritos y registros cubiertos por un fsync (journal espera a este)
+        self._written = 0
+        self._synced = 0
+        self._synced_cond = threading.Condition(self._lock)
+        self._sync_requested = threading.Event()
+        self._fd = None
+        self._active = None
+        self._active_bytes = 0
+        self._dirty = False
+        self._directory, self._dir_lock = self._claim_directory(directory)
+        self._sealed = sorted(
+            os.path.join(self._directory, name)
+            for name in os.listdir(self._directory) if name.endswith(_SUFFIX)
+        )
+        self._next_seq = self._seq(self._sealed[-1]) + 1 if self._sealed else 0
+        self._bytes = sum(os.path.getsize(p) for p in self._sealed)
+        # Filas de cada segmento que la cola tiene aún en memoria
+        self._held = {}
+        # Segmentos con filas que solo el replayer puede escribir (los de un proceso anterior, todos)
+        self._replay_needed = set(self._sealed)
+        self._stats = {'journaled': 0, 'spooled': 0, 'replayed': 0, 'rejected': 0, 'discarded_bytes': 0,
+                       'last_error': None}
+        self._flusher = threading.Thread(target=self._flush_loop, name='spool-fsync', daemon=True)
+        self._flusher.start()
+        self._replayer = None
+        if self._sealed:
+            logger.info("Spool de eventos con %s segmentos pendientes en %s", len(self._sealed), self._directory)
+
+    @staticmethod
+    def _claim_directory(base):
+        os.makedirs(base, exist_ok=True)
+        slot = 0
+        while True:
+            directory = os.path.join(base, str(slot))
+            os.makedirs(directory, exist_ok=True)
+            lock = open(os.path.join(directory, '.lock'), 'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return directory, lock
+            except BlockingIOError:
+                lock.close()
+                slot += 1
+
+    @staticmethod
+    def _seq(path):
+        return int(os.path.basename(path)[:-len(_SUFFIX)])
+
+    def _open_segment(self):
+        self._active = os.path.join(self._directory, f'{self._next_seq:012d}{_SUFFIX}')
+        self._next_seq += 1
+        self._fd = os.open(self._active, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._active_bytes = 0
+
+    def _seal(self):
+        """Cierra el segmento activo (con el lock tomado) y lo deja listo para replay."""
+        if self._fd is None:
+            return
+        path = self._active
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._sealed.append(path)
+        self._fd = None
+        self._active = None
+        self._active_bytes = 0
+        self._dirty = False
+        self._synced = self._written
+        self._synced_cond.notify_all()
+        self._discard_if_done(path)
+
+    def _discard_if_done(self, path):
+        """Borra (con el lock tomado) un segmento sellado cuyas filas ya están todas escritas."""
+        if path not in self._sealed or path in self._held or path in self._replay_needed:
+            return
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError as e:
+            logger.error("Error al borrar el segmento %s del spool: %s", path, e)
+            return
+        self._sealed.remove(path)
+        self._bytes -= size
+
+    def _write(self, rows):
+        """Anexa las filas al segmento activo (con el lock tomado); devuelve el segmento o None."""
+        data = b''.join(_encode(row) for row in rows)
+        if self._bytes + len(data) > self._max_bytes:
+            self._stats['rejected'] += len(rows)
+            return None
+        try:
+            if self._fd is not None and self._active_bytes + len(data) > self._segment_bytes:
+                self._seal()
+            if self._fd is None:
+                self._open_segment()
+            os.write(self._fd, data)
+        except OSError as e:
+            self._stats['last_error'] = str(e)
+            logger.error("Error al escribir en el spool de eventos: %s", e)
+            return None
+        self._active_bytes += len(data)
+        self._bytes += len(data)
+        self._dirty = True
+        self._written += 1
+        return self._active
+
+    def append(self, rows):
+        """Anexa filas para el replayer; False si se alcanzó max_bytes o falla el disco."""
+        with self._lock:
+            path = self._write(rows)
+            if path is None:
+                return False
+            self._replay_needed.add(path)
+            self._stats['spooled'] += len(rows)
+        return True
+
+    def journal(self, rows):
+        """
+        Anexa filas que la cola de ingesta conserva en memoria y espera a que
+        estén en disco. Devuelve el segmento (para release()) o None si no se
+        pudieron guardar: max_bytes alcanzado, error de disco o fsync que no
+        llega en sync_timeout segundos.
+        """
+        with self._lock:
+            path = self._write(rows)
+            if path is None:
+                return None
+            self._held[path] = self._held.get(path, 0) + len(rows)
+            target = self._written
+            self._sync_requested.set()
+            if not self._synced_cond.wait_for(lambda: self._synced >= target, self._sync_timeout):
+                self._stats['last_error'] = 'fsync sin completar'
+                # El endpoint responde 503 y el cliente reenvía el evento: no se repite
+                self._release(path, len(rows), written=True)
+                return None
+            self._stats['journaled'] += len(rows)
+        return path
+
+    def _release(self, path, count, written):
+        held = self._held.get(path, 0) - count
+        if held > 0:
+            self._held[path] = held
+        else:
+            self._held.pop(path, None)
+        if not written:
+            self._replay_needed.add(path)
+        self._discard_if_done(path)
+
+    def release(self, path, count, written=True):
+        """
+        La cola de ingesta ya no tiene en memoria count filas de journal() en
+        path: escritas (written) o entregadas al replayer.
+        """
+        with self._lock:
+            self._release(path, count, written)
+
+    def _flush_loop(self):
+        while True:
+            # journal() despierta al hilo enseguida; append() espera al siguiente intervalo
+            self._sync_requested.wait(self._fsync_interval)
+            self._sync_requested.clear()
+            with self._lock:
+                if self._dirty and self._fd is not None:
+                    try:
+                        os.fsync(self._fd)
+                        self._dirty = False
+                    except OSError as e:
+                        logger.error("Error en fsync del spool de eventos: %s", e)
+                        continue
+                self._synced = self._written
+                self._synced_cond.notify_all()
+
+    def replay(self, writer, batch_size=500):
+        """Escribe los segmentos pendientes en orden; devuelve las filas escritas."""
+        with self._lock:
+            if self._active in self._replay_needed:
+                self._seal()
+            pending = self._replayable()
+
+        replayed = 0
+        for path in pending:
+            rows, discarded = read_segment(path)
+            if discarded:
+                logger.info("Spool: %s bytes incompletos al final de %s", discarded, path)
+            for start in range(0, len(rows), batch_size):
+                writer(rows[start:start + batch_size])
+            size = os.path.getsize(path)
+            os.remove(path)
+            replayed += len(rows)
+            with self._lock:
+                self._sealed.remove(path)
+                self._replay_needed.discard(path)
+                self._bytes -= size
+                self._stats['replayed'] += len(rows)
+                self._stats['discarded_bytes'] += discarded
+            logger.info("Spool: %s eventos recuperados de %s", len(rows), os.path.basename(path))
+        return replayed
+
+    def _replay_loop(self, writer, batch_size, interval, max_interval):
+        delay = interval
+        while True:
+            time.sleep(delay)
+            if not self.has_pending():
+                delay = interval
+                continue
+            try:
+                self.replay(writer, batch_size)
+                delay = interval
+            except Exception as e:
+                # Base de datos aún no disponible: se reintenta más tarde
+                with self._lock:
+                    self._stats['last_error'] = str(e)
+                delay = min(max_interval, delay * 2)
+
+    def start_replayer(self, writer, batch_size=500, interval=5, max_interval=60):
+        if self._replayer is None:
+            self._replayer = threading.Thread(
+                target=self._replay_loop,
+                args=(writer, batch_size, interval, max_interval),
+                name='spool-replay',
+                daemon=True
+            )
+            self._replayer.start()
+
+    def _replayable(self):
+        # Los segmentos con filas en memoria esperan: la cola aún puede escribirlas
+        return [p for p in self._sealed if p in self._replay_needed and p not in self._held]
+
+    def has_pending(self):
+        with self._lock:
+            return bool(self._replayable()) or self._active in self._replay_needed
+
+    def close(self):
+        with self._lock:
+            self._seal()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'segments': len(self._sealed) + (1 if self._fd is not None else 0),
+                'held': sum(self._held.values()),
+                'bytes': self._bytes,
+                'directory': self._directory
+            })
+        return stats
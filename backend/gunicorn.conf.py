@@ -0,0 +1,86 @@
+# Perfil de producción del backend.
+#
+#   gunicorn -c gunicorn.conf.py                    FastAPI + Flask montado (workers uvicorn)
+#   GUNICORN_APP=app:app gunicorn -c gunicorn.conf.py
+#                                                   Flask (WSGI, workers gthread)
+#
+# El perfil por defecto es el ASGI: cada extensión mantiene abierto
+# /api/policies/stream y con uvicorn una conexión en espera es una corrutina;
+# con gthread ocuparía uno de los hilos del worker. En modo WSGI la ruta
+# responde con un solo evento y la extensión vuelve a preguntar (app.py).
+#
+# La app se precarga en el master (preload_app): el catálogo de sitios
+# prohibidos ya compilado y el resto del código importado se comparten con
+# los workers por copy-on-write en lugar de cargarse una vez por worker. Lo
+# que no sobrevive a un fork (el spool de eventos, con su flock y sus hilos)
+# se abre en cada worker en post_fork. Las políticas compiladas por tenant no
+# se precargan: se leen de la base de datos, caducan en POLICY_ENGINE_TTL
+# segundos y abrir conexiones en el master las compartiría entre procesos.
+#
+# Recarga sin cortes: kill -HUP <pid del master> arranca workers nuevos con
+# la configuración releída y cierra los viejos tras terminar sus peticiones
+# (graceful_timeout). Con preload_app el código de la app no se relee en un
+# HUP; para desplegar código nuevo sin cortes: kill -USR2 (nuevo master) y
+# después kill -WINCH / -QUIT al master anterior.
+import multiprocessing
+import os
+import tempfile
+
+# La app la importa el master antes del fork; el spool se abre en post_fork
+os.environ.setdefault('ATHOS_WORKER_INIT', 'post_fork')
+# /metrics suma los valores de todos los workers a través de este directorio
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'athos-metrics'))
+
+wsgi_app = os.getenv('GUNICORN_APP', 'asgi:api')
+_asgi = wsgi_app.startswith('asgi:')
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5001)}"
+
+_cpus = multiprocessing.cpu_count()
+if _asgi:
+    # Un event loop por núcleo: la concurrencia la da asyncio
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    workers = int(os.getenv('GUNICORN_WORKERS', _cpus))
+else:
+    # Las peticiones esperan sobre todo a Supabase (E/S), así que hilos por
+    # worker
+    worker_class = 'gthread'
+    workers = int(os.getenv('GUNICORN_WORKERS', _cpus * 2 + 1))
+    threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+preload_app = True
+
+# Reciclar workers cada cierto número de peticiones (con jitter para que no
+# se reinicien todos a la vez) acota la memoria que acumulan las cachés
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    import app
+    # Los contadores empiezan de cero con cada master
+    app.request_metrics.clear()
+    server.log.info(
+        "[Backend] %s con %s workers %s%s",
+        wsgi_app, workers, worker_class,
+        '' if _asgi else f' x {threads} hilos'
+    )
+
+
+def post_fork(server, worker):
+    import app
+    app.start_event_spool()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown_ingest()
+    app.request_metrics.flush()
@@ -0,0 +1,213 @@
+import logging
+import queue
+from collections import Counter
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """
+    Cola de ingesta de navigation_logs desacoplada de las peticiones.
+
+    Los endpoints evalúan las políticas, encolan las filas y responden sin
+    esperar a la base de datos. Un pool de hilos vacía la cola en lotes de
+    hasta batch_size filas (o lo acumulado en flush_interval segundos) y
+    llama a writer(rows).
+
+    Entrega al menos una vez: un lote que falla se reintenta con backoff
+    exponencial hasta escribirse; cada fila lleva un id propio y writer hace
+    upsert idempotente, así un reintento tras un fallo parcial no duplica
+    filas. Mientras la base de datos no responde la cola se llena y submit()
+    devuelve False (backpressure: el endpoint responde 503 y el cliente
+    reintenta más tarde).
+
+    Con un spool (EventSpool), submit() escribe las filas en su journal y
+    espera al fsync antes de devolver True: un evento respondido con 202
+    sobrevive a la caída del proceso (el siguiente proceso que abra el
+    directorio lo repite). Los lotes que fallan y los eventos que no caben en
+    la cola se entregan al replayer del spool, que los escribe cuando la base
+    de datos vuelve a responder; si el spool no puede guardarlos, submit()
+    devuelve False. Sin spool la cola es solo memoria: lo pendiente se pierde
+    si el proceso cae.
+    """
+
+    def __init__(self, writer, maxsize=10000, workers=2, batch_size=500,
+                 flush_interval=0.5, max_backoff=30, spool=None):
+        self._writer = writer
+        self._spool = spool
+        self._queue = queue.Queue()
+        self._maxsize = maxsize
+        self._workers = workers
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_backoff = max_backoff
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # Filas aceptadas y aún no escritas (en cola o en un lote en curso)
+        self._pending = 0
+        self._stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'written': 0,
+            'spooled': 0,
+            'batches': 0,
+            'write_errors': 0,
+            'retrying': 0,
+            'last_error': None,
+            'last_write_at': None
+        }
+
+    def attach_spool(self, spool):
+        """Activa el spool después de crear la cola (p. ej. en cada worker tras el fork)."""
+        self._spool = spool
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(
+                    target=self._run,
+                    name=f'ingest-{len(self._threads)}',
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, rows):
+        """
+        Encola las filas de un evento o lote completo; False si no caben
+        (todas o ninguna, para que el cliente reintente el lote entero).
+        """
+        rows = list(rows)
+        if not rows:
+            return True
+        self._ensure_workers()
+        spool = self._spool
+        segment = None
+        if spool is not None:
+            segment = spool.journal(rows)
+            if segment is None:
+                with self._lock:
+                    self._stats['rejected'] += len(rows)
+                return False
+        with self._lock:
+            full = self._pending + len(rows) > self._maxsize
+        if full:
+            if segment is not None:
+                # Ya están en disco: las escribe el replayer del spool
+                spool.release(segment, len(rows), written=False)
+                with self._lock:
+                    self._stats['accepted'] += len(rows)
+                    self._stats['spooled'] += len(rows)
+                return True
+            with self._lock:
+                self._stats['rejected'] += len(rows)
+            return False
+        with self._lock:
+            for row in rows:
+                self._queue.put_nowait((segment, row))
+            self._pending += len(rows)
+            self._stats['accepted'] += len(rows)
+        return True
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _release(self, batch, written):
+        """Avisa al spool de que las filas del lote (de su journal) ya no están en memoria."""
+        if self._spool is None:
+            return
+        for segment, count in Counter(segment for segment, _ in batch if segment is not None).items():
+            self._spool.release(segment, count, written)
+
+    def _hand_over(self, batch):
+        """Entrega un lote fallido al replayer del spool; False si no se pudo guardar."""
+        loose = [row for segment, row in batch if segment is None]
+        if loose and not self._spool.append(loose):
+            return False
+        self._release(batch, written=False)
+        return True
+
+    def _write(self, batch):
+        rows = [row for _, row in batch]
+        attempt = 0
+        while True:
+            try:
+                self._writer(rows)
+                break
+            except Exception as e:
+                attempt += 1
+                with self._lock:
+                    self._stats['write_errors'] += 1
+                    self._stats['last_error'] = str(e)
+                # El replayer del spool lo escribirá cuando la base de datos responda
+                if self._spool is not None and self._hand_over(batch):
+                    with self._lock:
+                        self._pending -= len(batch)
+                        self._stats['spooled'] += len(batch)
+                        if attempt > 1:
+                            self._stats['retrying'] -= 1
+                    return
+                with self._lock:
+                    if attempt == 1:
+                        self._stats['retrying'] += 1
+                delay = min(self._max_backoff, 0.5 * 2 ** attempt)
+                logger.error("Error al escribir lote de %s logs (intento %s), reintento en %.1fs: %s", len(batch), attempt, delay, e)
+                time.sleep(delay / 2 + random.random() * delay / 2)
+        with self._lock:
+            self._pending -= len(batch)
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_write_at'] = time.time()
+            if attempt:
+                self._stats['retrying'] -= 1
+        self._release(batch, written=True)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=10):
+        """Vacía la cola antes de terminar el proceso (como mucho timeout segundos)."""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(max(0, deadline - time.monotonic()))
+        if not self._queue.empty():
+            if self._spool is not None:
+                logger.warning("%s logs pendientes al cerrar la cola de ingesta quedan en el spool", self._queue.qsize())
+            else:
+                logger.warning("Se descartan %s logs pendientes al cerrar la cola de ingesta", self._queue.qsize())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'queued': self._queue.qsize(),
+            'pending': self._pending,
+            'capacity': self._maxsize,
+            'workers': sum(1 for t in self._threads if t.is_alive())
+        })
+        return stats
@@ -0,0 +1,167 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Atributos propios de LogRecord; el resto (extra=...) se emite como campos
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Claves que nunca se escriben en los logs aunque formen parte de un dict registrado
+_SECRET_KEYS = frozenset({'supabase_token'})
+
+# Librerías que registran cada petición HTTP a nivel INFO (httpx: una línea por consulta a Supabase)
+_NOISY_LOGGERS = ('httpx', 'httpcore', 'hpack', 'urllib3')
+
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, msg, campos extra y exc."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar una fracción rate de los registros por debajo de WARNING; WARNING y superiores siempre."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {key: '[redactado]' if key in _SECRET_KEYS else _redact(item) for key, item in value.items()}
+    return value
+
+
+class RedactingFilter(logging.Filter):
+    """
+    Oculta el valor de _SECRET_KEYS en los dicts pasados como argumentos del mensaje o como
+    campos extra (p. ej. los claims del JWT, que llevan el token de Supabase).
+    """
+
+    def filter(self, record):
+        if isinstance(record.args, dict):
+            record.args = _redact(record.args)
+        elif record.args:
+            record.args = tuple(_redact(arg) for arg in record.args)
+        for key, value in list(record.__dict__.items()):
+            if key not in _RECORD_ATTRS and isinstance(value, dict):
+                setattr(record, key, _redact(value))
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler con cola acotada: si el hilo de salida no da abasto, el
+    registro se descarta (y se cuenta) en lugar de bloquear la petición.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # El mensaje y la traza se resuelven aquí (los argumentos pueden
+        # cambiar después); el formato final lo aplica el hilo de salida
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _start_listener(handlers):
+    global _listener
+    _queue_handler.queue = queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def configure_logging():
+    """
+    Configura el logging del proceso (una sola vez):
+    - LOG_LEVEL (INFO por defecto): con INFO, los logger.debug() de los
+      endpoints no formatean nada.
+    - LOG_FORMAT: json (por defecto) o text.
+    - LOG_SAMPLE_RATE (1.0): fracción de registros DEBUG/INFO que se emiten.
+    Los dicts registrados pierden las claves secretas (RedactingFilter).
+    La escritura en stdout la hace un hilo (QueueHandler + QueueListener), así
+    que una petición no espera a la salida; tras un fork (workers de gunicorn
+    con preload) el hilo se vuelve a arrancar en el hijo.
+    """
+    global _queue_handler
+    with _lock:
+        if _queue_handler is not None:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        if os.getenv('LOG_FORMAT', 'json').lower() == 'text':
+            output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        else:
+            output.setFormatter(JsonFormatter())
+
+        _queue_handler = _DroppingQueueHandler(None)
+        _queue_handler.addFilter(SamplingFilter(float(os.getenv('LOG_SAMPLE_RATE', 1))))
+        _queue_handler.addFilter(RedactingFilter())
+        _start_listener([output])
+
+        root = logging.getLogger()
+        root.handlers = [_queue_handler]
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        for name in _NOISY_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: _start_listener([output]))
+        # Registrado antes que el resto de atexit: se ejecuta el último
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Vacía la cola de registros pendientes (al terminar el proceso)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats():
+    return {
+        'dropped': _queue_handler.dropped if _queue_handler is not None else 0,
+        'queued': _queue_handler.queue.qsize() if _queue_handler is not None else 0
+    }
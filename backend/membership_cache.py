@@ -0,0 +1,65 @@
+import threading
+
+from cachetools import TTLCache
+
+
+class MembershipCache:
+    """
+    Grupos a los que pertenece cada usuario (user_id -> tupla de group_id).
+
+    Los endpoints calientes solo necesitan la membresía del usuario actual;
+    con la caché dejan de consultar group_users en cada petición. Las
+    escrituras de grupos del propio proceso invalidan las entradas afectadas;
+    las de otros procesos se ven al caducar el TTL.
+
+    Una lectura que empezó antes de una invalidación no guarda su resultado
+    (podría ser anterior al cambio): cada invalidación incrementa la
+    generación y put() descarta los valores de una generación anterior.
+    """
+
+    def __init__(self, ttl=60, maxsize=10000):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id):
+        """(grupos o None si no está en caché, generación para put())"""
+        with self._lock:
+            return self._entries.get(str(user_id)), self._generation
+
+    def put(self, user_id, group_ids, generation):
+        group_ids = tuple(str(gid) for gid in group_ids)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[str(user_id)] = group_ids
+        return group_ids
+
+    def get(self, user_id, loader):
+        """Grupos del usuario; loader() lee los group_id de la base de datos si no están en caché."""
+        group_ids, generation = self.lookup(user_id)
+        if group_ids is not None:
+            return group_ids
+        return self.put(user_id, loader(), generation)
+
+    def invalidate_users(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(str(user_id), None)
+
+    def invalidate_group(self, group_id):
+        """Olvida a todos los usuarios en caché que pertenecen al grupo."""
+        group_id = str(group_id)
+        with self._lock:
+            self._generation += 1
+            for user_id in [uid for uid, gids in self._entries.items() if group_id in gids]:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
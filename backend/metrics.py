@@ -0,0 +1,311 @@
+import contextvars
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+# Límites superiores de los buckets de cada histograma
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_ARCHIVE = 'archive.json'
+
+# Contadores de la petición en curso (los hilos de QueryBatch copian el contexto)
+_current_request = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    """Consultas a Supabase hechas durante una petición y el tiempo que llevaron."""
+
+    __slots__ = ('started', 'queries', 'query_seconds', '_lock')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _merge(target, values):
+    """Suma values ({(nombre, etiquetas): valor}) sobre target."""
+    for key, value in values.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            target[key] = [a + b for a, b in zip(current, value)]
+        else:
+            target[key] = current + value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas en formato de exposición de Prometheus.
+
+    Cada proceso acumula sus valores en memoria. Con directory (METRICS_DIR)
+    un hilo los vuelca cada flush_interval segundos a metrics-<pid>.json y
+    render() suma los archivos de todos los workers, así /metrics devuelve
+    lo mismo lo atienda el worker que lo atienda. Los archivos de workers
+    ya terminados (reciclados por max_requests) se acumulan en archive.json
+    para que los contadores no retrocedan. Sin directory, render() devuelve
+    solo los valores del proceso.
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self._directory = directory
+        self._flush_interval = flush_interval
+        self._families = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # El worker empieza de cero: lo heredado del master ya está en su archivo
+        self._lock = threading.Lock()
+        self._values = {}
+        self._flusher = None
+
+    def counter(self, name, documentation):
+        self._families[name] = ('counter', documentation, None)
+
+    def histogram(self, name, documentation, buckets):
+        self._families[name] = ('histogram', documentation, tuple(buckets))
+
+    def _ensure_flusher(self):
+        if self._directory and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self._ensure_flusher()
+
+    def observe(self, name, labels, value):
+        buckets = self._families[name][2]
+        key = (name, tuple(labels))
+        index = len(buckets)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Un contador por bucket, el de +Inf y la suma
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+        self._ensure_flusher()
+
+    def _snapshot(self):
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    @staticmethod
+    def _dump(values, path):
+        rows = [[name, [list(pair) for pair in labels], value] for (name, labels), value in values.items()]
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(rows, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in rows}
+
+    def flush(self):
+        """Vuelca los valores de este proceso a su archivo (si hay directorio)."""
+        if self._directory:
+            self._dump(self._snapshot(), os.path.join(self._directory, f'metrics-{os.getpid()}.json'))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _collect(self):
+        if not self._directory:
+            return self._snapshot()
+        self.flush()
+        archive_path = os.path.join(self._directory, _ARCHIVE)
+        with open(os.path.join(self._directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = self._load(archive_path)
+            dead = []
+            merged = {}
+            for path in glob.glob(os.path.join(self._directory, 'metrics-*.json')):
+                pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+                values = self._load(path)
+                if _pid_alive(pid):
+                    _merge(merged, values)
+                else:
+                    _merge(archive, values)
+                    dead.append(path)
+            if dead:
+                self._dump(archive, archive_path)
+                for path in dead:
+                    os.unlink(path)
+        _merge(merged, archive)
+        return merged
+
+    def clear(self):
+        """Borra los archivos de una ejecución anterior (al arrancar el master)."""
+        if self._directory:
+            for path in glob.glob(os.path.join(self._directory, '*.json')):
+                os.unlink(path)
+
+    def render(self):
+        values = self._collect()
+        by_family = {}
+        for (name, labels), value in values.items():
+            by_family.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, documentation, buckets) in self._families.items():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_family.get(name, ())):
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_number(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels, ("le", le))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(value[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """
+    Métricas por endpoint: latencia, consultas a Supabase por petición (número
+    y tiempo), tamaño de la petición y de la respuesta, y duración de cada
+    consulta por tabla.
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.registry = MetricsRegistry(directory, flush_interval)
+        self.registry.counter('athos_http_requests_total', 'Peticiones atendidas por endpoint, método y estado')
+        self.registry.histogram('athos_http_request_duration_seconds', 'Latencia de cada petición', LATENCY_BUCKETS)
+        self.registry.histogram('athos_http_request_queries', 'Consultas a Supabase por petición', QUERY_COUNT_BUCKETS)
+        self.registry.histogram('athos_http_request_query_seconds', 'Tiempo en consultas a Supabase por petición', LATENCY_BUCKETS)
+        self.registry.histogram('athos_http_request_size_bytes', 'Tamaño del cuerpo de la petición', SIZE_BUCKETS)
+        self.registry.histogram('athos_http_response_size_bytes', 'Tamaño del cuerpo de la respuesta', SIZE_BUCKETS)
+        self.registry.histogram('athos_db_query_duration_seconds', 'Duración de cada consulta PostgREST por tabla y método', LATENCY_BUCKETS)
+
+    def begin_request(self):
+        stats = RequestStats()
+        _current_request.set(stats)
+        return stats
+
+    def observe_request(self, stats, endpoint, method, status, request_bytes=None, response_bytes=None):
+        labels = (('endpoint', endpoint), ('method', method))
+        registry = self.registry
+        registry.inc('athos_http_requests_total', labels + (('status', str(status)),))
+        registry.observe('athos_http_request_duration_seconds', labels, time.perf_counter() - stats.started)
+        registry.observe('athos_http_request_queries', labels, stats.queries)
+        registry.observe('athos_http_request_query_seconds', labels, stats.query_seconds)
+        if request_bytes is not None:
+            registry.observe('athos_http_request_size_bytes', labels, request_bytes)
+        if response_bytes is not None:
+            registry.observe('athos_http_response_size_bytes', labels, response_bytes)
+
+    def observe_query(self, table, method, seconds):
+        self.registry.observe('athos_db_query_duration_seconds', (('table', table), ('method', method)), seconds)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.add_query(seconds)
+
+    def render(self):
+        return self.registry.render()
+
+    def flush(self):
+        self.registry.flush()
+
+    def clear(self):
+        self.registry.clear()
+
+
+def instrument_postgrest(metrics):
+    """
+    Envuelve execute() de los request builders de PostgREST (síncronos y
+    asíncronos) para medir cada consulta. Las variantes maybe_single llaman
+    al execute() de single, así que no se envuelven aparte.
+    """
+    from postgrest import AsyncQueryRequestBuilder, SyncQueryRequestBuilder
+    from postgrest._async.request_builder import AsyncSingleRequestBuilder
+    from postgrest._sync.request_builder import SyncSingleRequestBuilder
+
+    def wrap_sync(execute):
+        def timed_execute(self):
+            started = time.perf_counter()
+            try:
+                return execute(self)
+            finally:
+                metrics.observe_query(self.path.lstrip('/'), str(self.http_method), time.perf_counter() - started)
+        timed_execute.instrumented = True
+        return timed_execute
+
+    def wrap_async(execute):
+        async def timed_execute(self):
+            started = time.perf_counter()
+            try:
+                return await execute(self)
+            finally:
+                metrics.observe_query(self.path.lstrip('/'), str(self.http_method), time.perf_counter() - started)
+        timed_execute.instrumented = True
+        return timed_execute
+
+    for cls, wrap in ((SyncQueryRequestBuilder, wrap_sync), (SyncSingleRequestBuilder, wrap_sync),
+                      (AsyncQueryRequestBuilder, wrap_async), (AsyncSingleRequestBuilder, wrap_async)):
+        if not getattr(cls.execute, 'instrumented', False):
+            cls.execute = wrap(cls.execute)
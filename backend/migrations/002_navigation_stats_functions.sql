@@ -0,0 +1,107 @@
+-- Estadísticas de navegación calculadas en la base de datos
+-- Sustituye el procesamiento en Python de /api/navigation_logs/stats: el endpoint
+-- solo recibe una fila con los agregados en lugar de todos los logs del rango.
+
+-- Índice para filtrar por tenant y rango de fechas y recorrer los logs por usuario
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_tenant_timestamp
+    ON navigation_logs (tenant_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_user_timestamp
+    ON navigation_logs (user_id, timestamp);
+
+CREATE OR REPLACE FUNCTION navigation_stats(
+    p_tenant_id UUID DEFAULT NULL,
+    p_date_from TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_date_to TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_session_timeout INTEGER DEFAULT 1800
+)
+RETURNS TABLE (
+    total_sites BIGINT,
+    active_users BIGINT,
+    most_frequent_category TEXT,
+    avg_session_seconds DOUBLE PRECISION,
+    category_distribution JSONB,
+    user_distribution JSONB,
+    hourly_distribution JSONB
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    WITH logs AS (
+        SELECT
+            l.user_id,
+            l.timestamp,
+            CASE
+                WHEN jsonb_typeof(l.policy_info) = 'object'
+                    THEN COALESCE(l.policy_info->>'category', 'sin categoría')
+                ELSE 'sin categoría'
+            END AS category
+        FROM navigation_logs l
+        WHERE (p_tenant_id IS NULL OR l.tenant_id = p_tenant_id)
+          AND (p_date_from IS NULL OR l.timestamp >= p_date_from)
+          AND (p_date_to IS NULL OR l.timestamp <= p_date_to)
+    ),
+    categories AS (
+        SELECT category, COUNT(*) AS count
+        FROM logs
+        GROUP BY category
+    ),
+    users AS (
+        SELECT user_id, COUNT(*) AS count
+        FROM logs
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ),
+    hours AS (
+        SELECT EXTRACT(HOUR FROM timestamp AT TIME ZONE 'UTC')::INTEGER AS hour, COUNT(*) AS count
+        FROM logs
+        GROUP BY 1
+    ),
+    -- Una sesión termina cuando pasan más de p_session_timeout segundos sin actividad
+    gaps AS (
+        SELECT
+            user_id,
+            timestamp,
+            CASE
+                WHEN timestamp - LAG(timestamp) OVER w > make_interval(secs => p_session_timeout)
+                    THEN 1
+                ELSE 0
+            END AS new_session
+        FROM logs
+        WHERE user_id IS NOT NULL
+        WINDOW w AS (PARTITION BY user_id ORDER BY timestamp)
+    ),
+    numbered AS (
+        SELECT
+            user_id,
+            timestamp,
+            SUM(new_session) OVER (PARTITION BY user_id ORDER BY timestamp ROWS UNBOUNDED PRECEDING) AS session_no
+        FROM gaps
+    ),
+    sessions AS (
+        SELECT EXTRACT(EPOCH FROM MAX(timestamp) - MIN(timestamp)) AS duration
+        FROM numbered
+        GROUP BY user_id, session_no
+    )
+    SELECT
+        (SELECT COUNT(*) FROM logs),
+        (SELECT COUNT(*) FROM users),
+        (SELECT category FROM categories ORDER BY count DESC, category LIMIT 1),
+        (SELECT AVG(duration)::DOUBLE PRECISION FROM sessions WHERE duration > 0),
+        COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('category', category, 'count', count) ORDER BY count DESC) FROM categories),
+            '[]'::jsonb
+        ),
+        COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('user_id', user_id, 'count', count) ORDER BY count DESC) FROM users),
+            '[]'::jsonb
+        ),
+        (
+            SELECT jsonb_agg(jsonb_build_object('hour', lpad(h::TEXT, 2, '0'), 'count', COALESCE(hours.count, 0)) ORDER BY h)
+            FROM generate_series(0, 23) AS h
+            LEFT JOIN hours ON hours.hour = h
+        );
+$$;
+
+GRANT EXECUTE ON FUNCTION navigation_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, INTEGER)
+    TO authenticated, service_role;
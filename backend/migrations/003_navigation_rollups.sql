@@ -0,0 +1,471 @@
+-- Rollups incrementales de navigation_logs para los dashboards
+-- Un trigger por sentencia mantiene los agregados por hora (tenant, usuario,
+-- categoría) y las sesiones de navegación a medida que se insertan logs, de
+-- modo que /api/navigation_logs/stats y /api/alerts/stats no recorren los logs
+-- en crudo. Solo las horas incompletas en los extremos del rango consultado se
+-- leen de navigation_logs.
+
+BEGIN;
+
+-- Categoría de un log tal como la muestran los dashboards
+CREATE OR REPLACE FUNCTION navigation_log_category(p_policy_info JSONB)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(p_policy_info) = 'object'
+            THEN COALESCE(p_policy_info->>'category', 'sin categoría')
+        ELSE 'sin categoría'
+    END;
+$$;
+
+-- Agregados por hora (UTC)
+CREATE TABLE IF NOT EXISTS navigation_rollup_hourly (
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    total BIGINT NOT NULL DEFAULT 0,
+    high BIGINT NOT NULL DEFAULT 0,      -- risk_score > 80
+    medium BIGINT NOT NULL DEFAULT 0,    -- risk_score > 50
+    low BIGINT NOT NULL DEFAULT 0,
+    CONSTRAINT navigation_rollup_hourly_key UNIQUE NULLS NOT DISTINCT (tenant_id, user_id, category, bucket)
+);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_rollup_hourly_tenant_bucket
+    ON navigation_rollup_hourly (tenant_id, bucket);
+CREATE INDEX IF NOT EXISTS idx_navigation_rollup_hourly_user_bucket
+    ON navigation_rollup_hourly (user_id, bucket);
+
+-- Agregados por día derivados de los horarios (incluye usuarios distintos)
+CREATE OR REPLACE VIEW navigation_rollup_daily AS
+    SELECT
+        tenant_id,
+        category,
+        (bucket AT TIME ZONE 'UTC')::DATE AS day,
+        SUM(total)::BIGINT AS total,
+        SUM(high)::BIGINT AS high,
+        SUM(medium)::BIGINT AS medium,
+        SUM(low)::BIGINT AS low,
+        COUNT(DISTINCT user_id) AS distinct_users
+    FROM navigation_rollup_hourly
+    GROUP BY tenant_id, category, (bucket AT TIME ZONE 'UTC')::DATE;
+
+-- Sesiones de navegación: actividad de un usuario sin pausas de más de 30 minutos
+CREATE TABLE IF NOT EXISTS navigation_sessions (
+    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE NOT NULL,
+    started_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    events BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_sessions_user_last_seen
+    ON navigation_sessions (user_id, last_seen);
+CREATE INDEX IF NOT EXISTS idx_navigation_sessions_tenant_started
+    ON navigation_sessions (tenant_id, started_at);
+
+ALTER TABLE navigation_rollup_hourly ENABLE ROW LEVEL SECURITY;
+ALTER TABLE navigation_sessions ENABLE ROW LEVEL SECURITY;
+
+-- Lectura por tenant (navigation_stats, navigation_rollup_slice y alerts_stats
+-- son SECURITY INVOKER y se llaman con el JWT del usuario); las escrituras las
+-- hace solo el trigger de rollup (SECURITY DEFINER)
+DROP POLICY IF EXISTS "Usuarios ven rollups de su tenant" ON navigation_rollup_hourly;
+CREATE POLICY "Usuarios ven rollups de su tenant"
+ON navigation_rollup_hourly
+FOR SELECT
+USING (
+    tenant_id = (auth.jwt() ->> 'tenant_id')::uuid
+);
+
+DROP POLICY IF EXISTS "Administradores ven todos los rollups" ON navigation_rollup_hourly;
+CREATE POLICY "Administradores ven todos los rollups"
+ON navigation_rollup_hourly
+FOR SELECT
+USING (
+    (auth.jwt() ->> 'role')::text = 'admin'
+);
+
+DROP POLICY IF EXISTS "Usuarios ven sesiones de su tenant" ON navigation_sessions;
+CREATE POLICY "Usuarios ven sesiones de su tenant"
+ON navigation_sessions
+FOR SELECT
+USING (
+    tenant_id = (auth.jwt() ->> 'tenant_id')::uuid
+);
+
+DROP POLICY IF EXISTS "Administradores ven todas las sesiones" ON navigation_sessions;
+CREATE POLICY "Administradores ven todas las sesiones"
+ON navigation_sessions
+FOR SELECT
+USING (
+    (auth.jwt() ->> 'role')::text = 'admin'
+);
+
+-- Añade un tramo de actividad [p_start, p_end] a las sesiones del usuario,
+-- fusionando las sesiones que queden a menos de p_session_timeout segundos
+CREATE OR REPLACE FUNCTION navigation_sessions_touch(
+    p_tenant_id UUID,
+    p_user_id UUID,
+    p_start TIMESTAMP WITH TIME ZONE,
+    p_end TIMESTAMP WITH TIME ZONE,
+    p_events BIGINT,
+    p_session_timeout INTEGER DEFAULT 1800
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_timeout INTERVAL := make_interval(secs => p_session_timeout);
+BEGIN
+    -- Serializa las actualizaciones concurrentes de un mismo usuario
+    PERFORM pg_advisory_xact_lock(hashtextextended(p_user_id::TEXT, 0));
+
+    WITH merged AS (
+        DELETE FROM navigation_sessions s
+        WHERE s.user_id = p_user_id
+          AND s.tenant_id IS NOT DISTINCT FROM p_tenant_id
+          AND s.started_at <= p_end + v_timeout
+          AND s.last_seen >= p_start - v_timeout
+        RETURNING s.started_at, s.last_seen, s.events
+    )
+    INSERT INTO navigation_sessions (tenant_id, user_id, started_at, last_seen, events)
+    SELECT
+        p_tenant_id,
+        p_user_id,
+        LEAST(p_start, MIN(merged.started_at)),
+        GREATEST(p_end, MAX(merged.last_seen)),
+        p_events + COALESCE(SUM(merged.events), 0)
+    FROM merged;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION navigation_logs_rollup()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    INSERT INTO navigation_rollup_hourly AS h (tenant_id, user_id, category, bucket, total, high, medium, low)
+    SELECT
+        tenant_id,
+        user_id,
+        navigation_log_category(policy_info),
+        date_trunc('hour', timestamp, 'UTC'),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE COALESCE(risk_score, 0) > 80),
+        COUNT(*) FILTER (WHERE COALESCE(risk_score, 0) > 50 AND COALESCE(risk_score, 0) <= 80),
+        COUNT(*) FILTER (WHERE COALESCE(risk_score, 0) <= 50)
+    FROM new_rows
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT ON CONSTRAINT navigation_rollup_hourly_key DO UPDATE SET
+        total = h.total + EXCLUDED.total,
+        high = h.high + EXCLUDED.high,
+        medium = h.medium + EXCLUDED.medium,
+        low = h.low + EXCLUDED.low;
+
+    -- Los eventos del lote se agrupan en tramos continuos antes de tocar las sesiones
+    FOR r IN
+        WITH gaps AS (
+            SELECT
+                tenant_id,
+                user_id,
+                timestamp,
+                CASE
+                    WHEN timestamp - LAG(timestamp) OVER w > INTERVAL '30 minutes' THEN 1
+                    ELSE 0
+                END AS new_session
+            FROM new_rows
+            WHERE user_id IS NOT NULL
+            WINDOW w AS (PARTITION BY tenant_id, user_id ORDER BY timestamp)
+        ),
+        numbered AS (
+            SELECT
+                *,
+                SUM(new_session) OVER (
+                    PARTITION BY tenant_id, user_id ORDER BY timestamp ROWS UNBOUNDED PRECEDING
+                ) AS session_no
+            FROM gaps
+        )
+        SELECT tenant_id, user_id, MIN(timestamp) AS started_at, MAX(timestamp) AS last_seen, COUNT(*) AS events
+        FROM numbered
+        GROUP BY tenant_id, user_id, session_no
+        ORDER BY user_id, started_at
+    LOOP
+        PERFORM navigation_sessions_touch(r.tenant_id, r.user_id, r.started_at, r.last_seen, r.events);
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$;
+
+-- Bloquear inserciones mientras se crea el trigger y se rellenan los rollups
+LOCK TABLE navigation_logs IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS navigation_logs_rollup_trigger ON navigation_logs;
+CREATE TRIGGER navigation_logs_rollup_trigger
+    AFTER INSERT ON navigation_logs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION navigation_logs_rollup();
+
+-- Relleno inicial a partir del histórico
+TRUNCATE navigation_rollup_hourly, navigation_sessions;
+
+INSERT INTO navigation_rollup_hourly (tenant_id, user_id, category, bucket, total, high, medium, low)
+SELECT
+    tenant_id,
+    user_id,
+    navigation_log_category(policy_info),
+    date_trunc('hour', timestamp, 'UTC'),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE COALESCE(risk_score, 0) > 80),
+    COUNT(*) FILTER (WHERE COALESCE(risk_score, 0) > 50 AND COALESCE(risk_score, 0) <= 80),
+    COUNT(*) FILTER (WHERE COALESCE(risk_score, 0) <= 50)
+FROM navigation_logs
+GROUP BY 1, 2, 3, 4;
+
+INSERT INTO navigation_sessions (tenant_id, user_id, started_at, last_seen, events)
+WITH gaps AS (
+    SELECT
+        tenant_id,
+        user_id,
+        timestamp,
+        CASE
+            WHEN timestamp - LAG(timestamp) OVER w > INTERVAL '30 minutes' THEN 1
+            ELSE 0
+        END AS new_session
+    FROM navigation_logs
+    WHERE user_id IS NOT NULL
+    WINDOW w AS (PARTITION BY tenant_id, user_id ORDER BY timestamp)
+),
+numbered AS (
+    SELECT
+        *,
+        SUM(new_session) OVER (
+            PARTITION BY tenant_id, user_id ORDER BY timestamp ROWS UNBOUNDED PRECEDING
+        ) AS session_no
+    FROM gaps
+)
+SELECT tenant_id, user_id, MIN(timestamp), MAX(timestamp), COUNT(*)
+FROM numbered
+GROUP BY tenant_id, user_id, session_no;
+
+-- Agregados por hora de un rango arbitrario: las horas completas salen del
+-- rollup y las horas incompletas de los extremos se calculan desde los logs
+CREATE OR REPLACE FUNCTION navigation_rollup_slice(
+    p_tenant_id UUID DEFAULT NULL,
+    p_date_from TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_date_to TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_category TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    user_id UUID,
+    category TEXT,
+    bucket TIMESTAMP WITH TIME ZONE,
+    total BIGINT,
+    high BIGINT,
+    medium BIGINT,
+    low BIGINT
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    WITH bounds AS (
+        SELECT
+            CASE
+                WHEN p_date_from IS NULL THEN '-infinity'::TIMESTAMPTZ
+                WHEN date_trunc('hour', p_date_from, 'UTC') = p_date_from THEN p_date_from
+                ELSE date_trunc('hour', p_date_from, 'UTC') + INTERVAL '1 hour'
+            END AS lo,
+            CASE
+                WHEN p_date_to IS NULL THEN 'infinity'::TIMESTAMPTZ
+                ELSE date_trunc('hour', p_date_to, 'UTC')
+            END AS hi
+    ),
+    edges AS (
+        -- Inicio del rango hasta la primera hora completa
+        SELECT l.*
+        FROM navigation_logs l, bounds b
+        WHERE p_date_from IS NOT NULL
+          AND l.timestamp >= p_date_from
+          AND l.timestamp < b.lo
+          AND (p_date_to IS NULL OR l.timestamp <= p_date_to)
+          AND (p_tenant_id IS NULL OR l.tenant_id = p_tenant_id)
+          AND (p_user_id IS NULL OR l.user_id = p_user_id)
+        UNION ALL
+        -- Última hora incompleta hasta el final del rango
+        SELECT l.*
+        FROM navigation_logs l, bounds b
+        WHERE p_date_to IS NOT NULL
+          AND l.timestamp >= GREATEST(b.lo, b.hi)
+          AND l.timestamp <= p_date_to
+          AND (p_tenant_id IS NULL OR l.tenant_id = p_tenant_id)
+          AND (p_user_id IS NULL OR l.user_id = p_user_id)
+    )
+    SELECT h.user_id, h.category, h.bucket, h.total, h.high, h.medium, h.low
+    FROM navigation_rollup_hourly h, bounds b
+    WHERE h.bucket >= b.lo
+      AND h.bucket < b.hi
+      AND (p_tenant_id IS NULL OR h.tenant_id = p_tenant_id)
+      AND (p_user_id IS NULL OR h.user_id = p_user_id)
+      AND (p_category IS NULL OR h.category = p_category)
+    UNION ALL
+    SELECT
+        e.user_id,
+        navigation_log_category(e.policy_info),
+        date_trunc('hour', e.timestamp, 'UTC'),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE COALESCE(e.risk_score, 0) > 80),
+        COUNT(*) FILTER (WHERE COALESCE(e.risk_score, 0) > 50 AND COALESCE(e.risk_score, 0) <= 80),
+        COUNT(*) FILTER (WHERE COALESCE(e.risk_score, 0) <= 50)
+    FROM edges e
+    WHERE p_category IS NULL OR navigation_log_category(e.policy_info) = p_category
+    GROUP BY 1, 2, 3;
+$$;
+
+-- navigation_stats lee ahora los rollups (mismo formato que en 002). Las
+-- sesiones se cortan al escribir, tras 30 minutos sin actividad
+-- (navigation_sessions_touch), así que p_session_timeout desaparece de la firma
+DROP FUNCTION IF EXISTS navigation_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, INTEGER);
+CREATE OR REPLACE FUNCTION navigation_stats(
+    p_tenant_id UUID DEFAULT NULL,
+    p_date_from TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_date_to TIMESTAMP WITH TIME ZONE DEFAULT NULL
+)
+RETURNS TABLE (
+    total_sites BIGINT,
+    active_users BIGINT,
+    most_frequent_category TEXT,
+    avg_session_seconds DOUBLE PRECISION,
+    category_distribution JSONB,
+    user_distribution JSONB,
+    hourly_distribution JSONB
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    WITH slice AS (
+        SELECT * FROM navigation_rollup_slice(p_tenant_id, p_date_from, p_date_to)
+    ),
+    categories AS (
+        SELECT category, SUM(total)::BIGINT AS count
+        FROM slice
+        GROUP BY category
+    ),
+    users AS (
+        SELECT user_id, SUM(total)::BIGINT AS count
+        FROM slice
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ),
+    hours AS (
+        SELECT EXTRACT(HOUR FROM bucket AT TIME ZONE 'UTC')::INTEGER AS hour, SUM(total)::BIGINT AS count
+        FROM slice
+        GROUP BY 1
+    ),
+    -- Las sesiones se atribuyen al rango por su inicio
+    sessions AS (
+        SELECT EXTRACT(EPOCH FROM s.last_seen - s.started_at) AS duration
+        FROM navigation_sessions s
+        WHERE (p_tenant_id IS NULL OR s.tenant_id = p_tenant_id)
+          AND (p_date_from IS NULL OR s.started_at >= p_date_from)
+          AND (p_date_to IS NULL OR s.started_at <= p_date_to)
+    )
+    SELECT
+        COALESCE((SELECT SUM(count) FROM categories), 0)::BIGINT,
+        (SELECT COUNT(*) FROM users),
+        (SELECT category FROM categories ORDER BY count DESC, category LIMIT 1),
+        (SELECT AVG(duration)::DOUBLE PRECISION FROM sessions WHERE duration > 0),
+        COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('category', category, 'count', count) ORDER BY count DESC) FROM categories),
+            '[]'::jsonb
+        ),
+        COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('user_id', user_id, 'count', count) ORDER BY count DESC) FROM users),
+            '[]'::jsonb
+        ),
+        (
+            SELECT jsonb_agg(jsonb_build_object('hour', lpad(h::TEXT, 2, '0'), 'count', COALESCE(hours.count, 0)) ORDER BY h)
+            FROM generate_series(0, 23) AS h
+            LEFT JOIN hours ON hours.hour = h
+        );
+$$;
+
+CREATE OR REPLACE FUNCTION alerts_stats(
+    p_tenant_id UUID DEFAULT NULL,
+    p_date_from TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_date_to TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_category TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    total_alerts BIGINT,
+    alerts_by_category JSONB,
+    alerts_by_user JSONB,
+    alerts_by_hour JSONB,
+    alerts_by_severity JSONB,
+    alerts_trend JSONB
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    WITH slice AS (
+        SELECT * FROM navigation_rollup_slice(p_tenant_id, p_date_from, p_date_to, p_user_id, p_category)
+    ),
+    hours AS (
+        SELECT EXTRACT(HOUR FROM bucket AT TIME ZONE 'UTC')::INTEGER AS hour, SUM(total)::BIGINT AS count
+        FROM slice
+        GROUP BY 1
+    ),
+    days AS (
+        SELECT (bucket AT TIME ZONE 'UTC')::DATE AS day, SUM(total)::BIGINT AS count
+        FROM slice
+        GROUP BY 1
+    )
+    SELECT
+        COALESCE((SELECT SUM(total) FROM slice), 0)::BIGINT,
+        COALESCE(
+            (SELECT jsonb_object_agg(category, count)
+             FROM (SELECT category, SUM(total)::BIGINT AS count FROM slice GROUP BY category) c),
+            '{}'::jsonb
+        ),
+        COALESCE(
+            (SELECT jsonb_object_agg(user_id, count)
+             FROM (SELECT user_id, SUM(total)::BIGINT AS count FROM slice WHERE user_id IS NOT NULL GROUP BY user_id) u),
+            '{}'::jsonb
+        ),
+        (
+            SELECT jsonb_object_agg(lpad(h::TEXT, 2, '0'), COALESCE(hours.count, 0))
+            FROM generate_series(0, 23) AS h
+            LEFT JOIN hours ON hours.hour = h
+        ),
+        jsonb_build_object(
+            'high', COALESCE((SELECT SUM(high) FROM slice), 0),
+            'medium', COALESCE((SELECT SUM(medium) FROM slice), 0),
+            'low', COALESCE((SELECT SUM(low) FROM slice), 0)
+        ),
+        COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('date', day, 'count', count) ORDER BY day) FROM days),
+            '[]'::jsonb
+        );
+$$;
+
+GRANT EXECUTE ON FUNCTION navigation_rollup_slice(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, UUID, TEXT)
+    TO authenticated, service_role;
+GRANT EXECUTE ON FUNCTION navigation_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE)
+    TO authenticated, service_role;
+GRANT EXECUTE ON FUNCTION alerts_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, UUID, TEXT)
+    TO authenticated, service_role;
+
+COMMIT;
@@ -0,0 +1,210 @@
+-- Comportamientos anómalos detectados al ingerir logs (ver anomaly_detector.py)
+-- /api/navigation_logs/comport lee de behavior_anomalies en lugar de recalcular
+-- las anomalías sobre los últimos 1000 logs en cada petición.
+
+BEGIN;
+
+-- Dominios visitados por cada usuario (dominio normalizado como normalize_domain)
+CREATE TABLE IF NOT EXISTS user_known_domains (
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE NOT NULL,
+    domain TEXT NOT NULL,
+    first_seen TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    PRIMARY KEY (user_id, domain)
+);
+
+CREATE TABLE IF NOT EXISTS behavior_anomalies (
+    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    tipo TEXT CHECK (tipo IN ('Cambio de horario', 'Sitio inusual', 'Patrón irregular')) NOT NULL,
+    detalle TEXT NOT NULL,
+    hora TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    -- Varios workers pueden detectar la misma anomalía: se guarda una sola vez
+    CONSTRAINT behavior_anomalies_key UNIQUE NULLS NOT DISTINCT (user_id, tipo, hora, detalle)
+);
+
+CREATE INDEX IF NOT EXISTS idx_behavior_anomalies_tenant_hora
+    ON behavior_anomalies (tenant_id, hora DESC);
+CREATE INDEX IF NOT EXISTS idx_behavior_anomalies_user_hora
+    ON behavior_anomalies (user_id, hora DESC);
+
+ALTER TABLE user_known_domains ENABLE ROW LEVEL SECURITY;
+ALTER TABLE behavior_anomalies ENABLE ROW LEVEL SECURITY;
+
+-- /api/navigation_logs/comport lee behavior_anomalies con el JWT del usuario;
+-- las escrituras las hace solo el detector (cliente de servicio).
+-- user_known_domains no se lee desde la API y queda sin políticas
+DROP POLICY IF EXISTS "Usuarios ven anomalías de su tenant" ON behavior_anomalies;
+CREATE POLICY "Usuarios ven anomalías de su tenant"
+ON behavior_anomalies
+FOR SELECT
+USING (
+    tenant_id = (auth.jwt() ->> 'tenant_id')::uuid
+);
+
+DROP POLICY IF EXISTS "Administradores ven todas las anomalías" ON behavior_anomalies;
+CREATE POLICY "Administradores ven todas las anomalías"
+ON behavior_anomalies
+FOR SELECT
+USING (
+    (auth.jwt() ->> 'role')::text = 'admin'
+);
+
+-- Detección sobre un lote de logs ya escrito en navigation_logs (lo llama
+-- AnomalyDetector.observe con el cliente de servicio). Todo el estado está en
+-- la base de datos: los dominios conocidos en user_known_domains y la ventana
+-- de accesos se cuenta sobre navigation_logs por el timestamp de cada evento.
+-- Así el resultado no depende del worker que procese el lote ni de cuándo
+-- llegue (reintentos, spool): un evento reenviado cuenta en su ventana real y
+-- las anomalías ya registradas no se duplican (behavior_anomalies_key).
+CREATE OR REPLACE FUNCTION behavior_anomalies_detect(
+    p_events JSONB,                   -- [{tenant_id, user_id, domain (normalizado), label, ts}]
+    p_window_seconds INTEGER DEFAULT 600,
+    p_threshold INTEGER DEFAULT 5,
+    p_work_start INTEGER DEFAULT 8,
+    p_work_end INTEGER DEFAULT 19
+)
+RETURNS SETOF behavior_anomalies
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_window INTERVAL := make_interval(secs => p_window_seconds);
+BEGIN
+    RETURN QUERY
+    WITH events AS (
+        SELECT e.tenant_id, e.user_id, e.domain, e.label, e.ts
+        FROM jsonb_to_recordset(p_events) AS e(tenant_id UUID, user_id UUID, domain TEXT, label TEXT, ts TIMESTAMPTZ)
+        WHERE e.ts IS NOT NULL
+    ),
+    -- Solo las filas realmente insertadas son dominios nuevos para el usuario
+    new_domains AS (
+        INSERT INTO user_known_domains (user_id, domain, first_seen)
+        SELECT DISTINCT ON (user_id, domain) user_id, domain, ts
+        FROM events
+        WHERE user_id IS NOT NULL AND domain <> ''
+        ORDER BY user_id, domain, ts
+        ON CONFLICT DO NOTHING
+        RETURNING user_id, domain, first_seen
+    ),
+    ranges AS (
+        SELECT user_id, MIN(ts) AS lo, MAX(ts) AS hi
+        FROM events
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ),
+    -- Los eventos del lote cambian el recuento de las ventanas que terminan
+    -- hasta v_window después del último; para saber si una de ellas cruza el
+    -- umbral hace falta también la anterior (hasta 2 * v_window antes)
+    windows AS (
+        SELECT
+            l.tenant_id,
+            l.user_id,
+            l.timestamp,
+            r.lo,
+            COUNT(*) OVER w AS accesses,
+            MIN(l.timestamp) OVER w AS window_start
+        FROM ranges r
+        JOIN navigation_logs l
+          ON l.user_id = r.user_id
+         AND l.timestamp >= r.lo - 2 * v_window
+         AND l.timestamp <= r.hi + v_window
+        WINDOW w AS (PARTITION BY l.user_id ORDER BY l.timestamp RANGE BETWEEN v_window PRECEDING AND CURRENT ROW)
+    ),
+    transitions AS (
+        SELECT
+            *,
+            LAG(accesses) OVER (PARTITION BY user_id ORDER BY timestamp) AS previous_accesses
+        FROM windows
+    ),
+    found AS (
+        SELECT e.tenant_id, e.user_id, 'Cambio de horario' AS tipo,
+               'Acceso fuera de horario laboral a ' || e.label AS detalle, e.ts AS hora
+        FROM events e
+        WHERE EXTRACT(HOUR FROM e.ts AT TIME ZONE 'UTC') < p_work_start
+           OR EXTRACT(HOUR FROM e.ts AT TIME ZONE 'UTC') > p_work_end
+        UNION ALL
+        SELECT e.tenant_id, n.user_id, 'Sitio inusual',
+               'Primer acceso a dominio desconocido: ' || n.domain, n.first_seen
+        FROM new_domains n
+        JOIN events e ON e.user_id = n.user_id AND e.domain = n.domain AND e.ts = n.first_seen
+        UNION ALL
+        SELECT t.tenant_id, t.user_id, 'Patrón irregular',
+               t.accesses || ' accesos en menos de ' || (p_window_seconds / 60) || ' minutos', t.window_start
+        FROM transitions t
+        WHERE t.timestamp >= t.lo
+          AND t.accesses > p_threshold
+          AND COALESCE(t.previous_accesses, 0) <= p_threshold
+    )
+    INSERT INTO behavior_anomalies AS b (tenant_id, user_id, tipo, detalle, hora)
+    SELECT found.tenant_id, found.user_id, found.tipo, found.detalle, found.hora
+    FROM found
+    ON CONFLICT DO NOTHING
+    RETURNING b.*;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION behavior_anomalies_detect(JSONB, INTEGER, INTEGER, INTEGER, INTEGER) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION behavior_anomalies_detect(JSONB, INTEGER, INTEGER, INTEGER, INTEGER) TO service_role;
+
+-- Relleno inicial a partir del histórico con las mismas reglas que el detector
+WITH logs AS (
+    SELECT
+        tenant_id,
+        user_id,
+        timestamp,
+        split_part(split_part(
+            regexp_replace(regexp_replace(lower(trim(domain)), '^[^/]*://', ''), '^www\.', ''),
+        '/', 1), ':', 1) AS domain
+    FROM navigation_logs
+)
+INSERT INTO user_known_domains (user_id, domain, first_seen)
+SELECT user_id, domain, MIN(timestamp)
+FROM logs
+WHERE user_id IS NOT NULL AND domain <> ''
+GROUP BY user_id, domain
+ON CONFLICT DO NOTHING;
+
+-- 1. Cambio de horario: accesos antes de las 8:00 o después de las 19:59 (UTC)
+INSERT INTO behavior_anomalies (tenant_id, user_id, tipo, detalle, hora)
+SELECT tenant_id, user_id, 'Cambio de horario', 'Acceso fuera de horario laboral a ' || domain, timestamp
+FROM navigation_logs
+WHERE EXTRACT(HOUR FROM timestamp AT TIME ZONE 'UTC') < 8
+   OR EXTRACT(HOUR FROM timestamp AT TIME ZONE 'UTC') > 19
+ON CONFLICT DO NOTHING;
+
+-- 2. Sitio inusual: primer acceso de cada usuario a cada dominio
+INSERT INTO behavior_anomalies (tenant_id, user_id, tipo, detalle, hora)
+SELECT DISTINCT ON (k.user_id, k.domain)
+    l.tenant_id, k.user_id, 'Sitio inusual', 'Primer acceso a dominio desconocido: ' || k.domain, k.first_seen
+FROM user_known_domains k
+JOIN navigation_logs l ON l.user_id = k.user_id AND l.timestamp = k.first_seen
+ON CONFLICT DO NOTHING;
+
+-- 3. Patrón irregular: se supera el umbral de 5 accesos en una ventana de 10 minutos
+WITH windows AS (
+    SELECT
+        tenant_id,
+        user_id,
+        timestamp,
+        COUNT(*) OVER w AS accesses,
+        MIN(timestamp) OVER w AS window_start
+    FROM navigation_logs
+    WHERE user_id IS NOT NULL
+    WINDOW w AS (PARTITION BY user_id ORDER BY timestamp RANGE BETWEEN INTERVAL '10 minutes' PRECEDING AND CURRENT ROW)
+),
+transitions AS (
+    SELECT
+        *,
+        LAG(accesses) OVER (PARTITION BY user_id ORDER BY timestamp) AS previous_accesses
+    FROM windows
+)
+INSERT INTO behavior_anomalies (tenant_id, user_id, tipo, detalle, hora)
+SELECT tenant_id, user_id, 'Patrón irregular', accesses || ' accesos en menos de 10 minutos', window_start
+FROM transitions
+WHERE accesses > 5 AND COALESCE(previous_accesses, 0) <= 5
+ON CONFLICT DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,137 @@
+-- Particionado mensual de navigation_logs por timestamp
+-- Las consultas por rango de fechas solo recorren las particiones del rango y
+-- los meses antiguos pueden archivarse o eliminarse con DETACH/DROP PARTITION.
+--
+-- La tabla particionada se crea al lado, se copian los datos y se intercambian
+-- los nombres; la tabla original queda como navigation_logs_legacy hasta
+-- comprobar la migración. En tablas muy grandes conviene copiar por meses
+-- (INSERT ... WHERE timestamp >= ... AND timestamp < ...) antes del intercambio.
+
+BEGIN;
+
+LOCK TABLE navigation_logs IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE navigation_logs_partitioned (
+    LIKE navigation_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS,
+    -- La clave primaria de una tabla particionada debe incluir la clave de partición
+    PRIMARY KEY (id, timestamp),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (tenant_id) REFERENCES tenants(id) ON DELETE CASCADE
+) PARTITION BY RANGE (timestamp);
+
+-- Crea las particiones mensuales que falten entre p_from y p_to (ambos incluidos).
+-- Si la partición por defecto ya recibió filas de ese mes, se trasladan antes
+-- de adjuntar la nueva partición.
+CREATE OR REPLACE FUNCTION navigation_logs_create_partitions(
+    p_from DATE DEFAULT CURRENT_DATE,
+    p_to DATE DEFAULT (CURRENT_DATE + INTERVAL '3 months')::DATE,
+    p_table TEXT DEFAULT 'navigation_logs'
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::DATE;
+    v_default REGCLASS := to_regclass(p_table || '_default');
+    v_name TEXT;
+    v_lower TIMESTAMPTZ;
+    v_upper TIMESTAMPTZ;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_name := format('navigation_logs_%s', to_char(v_month, '"y"YYYY"m"MM'));
+        v_lower := v_month::TIMESTAMP AT TIME ZONE 'UTC';
+        v_upper := (v_month + INTERVAL '1 month')::TIMESTAMP AT TIME ZONE 'UTC';
+        IF to_regclass(v_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                v_name, p_table
+            );
+            IF v_default IS NOT NULL THEN
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM %s WHERE timestamp >= %L AND timestamp < %L RETURNING *)
+                     INSERT INTO %I SELECT * FROM moved',
+                    v_default, v_lower, v_upper, v_name
+                );
+            END IF;
+            EXECUTE format(
+                'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                p_table, v_name, v_lower, v_upper
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Particiones para el histórico existente y los próximos meses
+SELECT navigation_logs_create_partitions(
+    COALESCE((SELECT MIN(timestamp) FROM navigation_logs)::DATE, CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '3 months')::DATE,
+    'navigation_logs_partitioned'
+);
+
+-- Recoge eventos fuera de las particiones creadas (p. ej. relojes desajustados)
+CREATE TABLE navigation_logs_default PARTITION OF navigation_logs_partitioned DEFAULT;
+
+INSERT INTO navigation_logs_partitioned SELECT * FROM navigation_logs;
+
+-- Índices de las combinaciones de filtro y orden de app.py. Se crean aquí,
+-- sobre la tabla nueva antes del intercambio: todavía no recibe escrituras y
+-- cada partición se indexa de una vez tras la copia. Crearlos después en la
+-- tabla ya en uso bloquearía las escrituras durante toda la construcción
+-- (CREATE INDEX CONCURRENTLY no admite tablas particionadas). Las
+-- particiones que se adjunten después heredan los índices al adjuntarse.
+--
+-- Listados (get_navigation_logs, get_geo_navigation_logs): filtro por tenant o
+-- usuario, rango de fechas y orden/cursor (timestamp DESC, id DESC).
+-- Riesgo (get_risk_logs): orden/cursor (risk_score DESC, timestamp DESC, id DESC).
+-- Búsquedas ilike '%...%' sobre domain y url: índices de trigramas (pg_trgm).
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_tenant_ts_id
+    ON navigation_logs_partitioned (tenant_id, timestamp DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_user_ts_id
+    ON navigation_logs_partitioned (user_id, timestamp DESC, id DESC);
+
+-- Vista de administrador (sin filtro de tenant)
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_ts_id
+    ON navigation_logs_partitioned (timestamp DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_tenant_action_ts
+    ON navigation_logs_partitioned (tenant_id, action, timestamp DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_tenant_risk
+    ON navigation_logs_partitioned (tenant_id, risk_score DESC NULLS FIRST, timestamp DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_user_risk
+    ON navigation_logs_partitioned (user_id, risk_score DESC NULLS FIRST, timestamp DESC, id DESC);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_domain_trgm
+    ON navigation_logs_partitioned USING gin (domain gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_navigation_logs_url_trgm
+    ON navigation_logs_partitioned USING gin (url gin_trgm_ops);
+
+ALTER TABLE navigation_logs RENAME TO navigation_logs_legacy;
+ALTER TABLE navigation_logs_partitioned RENAME TO navigation_logs;
+
+-- Los rollups (003) ya incluyen el histórico: el trigger se crea tras la copia
+DROP TRIGGER IF EXISTS navigation_logs_rollup_trigger ON navigation_logs_legacy;
+CREATE TRIGGER navigation_logs_rollup_trigger
+    AFTER INSERT ON navigation_logs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION navigation_logs_rollup();
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON navigation_logs TO authenticated, service_role;
+
+COMMIT;
+
+-- Mantenimiento: crear con antelación las particiones de los próximos meses,
+-- p. ej. con pg_cron una vez al mes:
+--   SELECT cron.schedule('navigation_logs_partitions', '0 3 1 * *',
+--       $$SELECT navigation_logs_create_partitions()$$);
@@ -0,0 +1,13 @@
+-- Limpieza tras el particionado de navigation_logs (005)
+-- Los índices compuestos y de trigramas se construyen en 005 sobre la tabla
+-- particionada antes de ponerla en uso. Los índices simples que sustituyen se
+-- quedaron en navigation_logs_legacy y ya no hacen falta.
+
+BEGIN;
+
+DROP INDEX IF EXISTS idx_navigation_logs_tenant_timestamp;
+DROP INDEX IF EXISTS idx_navigation_logs_user_timestamp;
+
+COMMIT;
+
+ANALYZE navigation_logs;
@@ -0,0 +1,130 @@
+-- Diccionario de sugerencias para el autocompletado de dominios y URLs
+-- Un trigger por sentencia mantiene por tenant los valores distintos de domain
+-- y url con su número de apariciones, de modo que el autocompletado de
+-- /api/navigation_logs consulta un diccionario deduplicado en lugar de
+-- navigation_logs. Requiere pg_trgm (005).
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Término de búsqueda: valor en minúsculas sin esquema ni "www."
+CREATE OR REPLACE FUNCTION navigation_suggestion_term(p_value TEXT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT regexp_replace(regexp_replace(lower(trim(COALESCE(p_value, ''))), '^[a-z][a-z0-9+.-]*://', ''), '^www\.', '');
+$$;
+
+CREATE TABLE IF NOT EXISTS navigation_suggestions (
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    kind TEXT CHECK (kind IN ('domain', 'url')) NOT NULL,
+    value TEXT NOT NULL,
+    term TEXT NOT NULL,
+    hits BIGINT NOT NULL DEFAULT 0,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT navigation_suggestions_key UNIQUE NULLS NOT DISTINCT (tenant_id, kind, value)
+);
+
+-- Búsqueda por prefijo, por subcadena/similitud (trigramas) y lista por frecuencia
+CREATE INDEX IF NOT EXISTS idx_navigation_suggestions_prefix
+    ON navigation_suggestions (tenant_id, kind, term text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_navigation_suggestions_term_trgm
+    ON navigation_suggestions USING gin (term gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_navigation_suggestions_hits
+    ON navigation_suggestions (tenant_id, kind, hits DESC);
+
+ALTER TABLE navigation_suggestions ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION navigation_logs_suggestions()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    -- Orden fijo de las filas para que lotes concurrentes bloqueen en el mismo orden.
+    -- Los valores de más de 2 KB no caben en el índice único y no se sugieren.
+    INSERT INTO navigation_suggestions AS s (tenant_id, kind, value, term, hits, last_seen)
+    SELECT l.tenant_id, k.kind, k.value, navigation_suggestion_term(k.value), COUNT(*), MAX(l.timestamp)
+    FROM new_rows l
+    CROSS JOIN LATERAL (VALUES ('domain', l.domain), ('url', l.url)) AS k(kind, value)
+    WHERE k.value <> '' AND octet_length(k.value) <= 2048
+    GROUP BY l.tenant_id, k.kind, k.value
+    ORDER BY l.tenant_id, k.kind, k.value
+    ON CONFLICT ON CONSTRAINT navigation_suggestions_key DO UPDATE SET
+        hits = s.hits + EXCLUDED.hits,
+        last_seen = GREATEST(s.last_seen, EXCLUDED.last_seen);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS navigation_logs_suggestions_trigger ON navigation_logs;
+CREATE TRIGGER navigation_logs_suggestions_trigger
+    AFTER INSERT ON navigation_logs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION navigation_logs_suggestions();
+
+-- Relleno inicial a partir del histórico
+INSERT INTO navigation_suggestions AS s (tenant_id, kind, value, term, hits, last_seen)
+SELECT l.tenant_id, k.kind, k.value, navigation_suggestion_term(k.value), COUNT(*), MAX(l.timestamp)
+FROM navigation_logs l
+CROSS JOIN LATERAL (VALUES ('domain', l.domain), ('url', l.url)) AS k(kind, value)
+WHERE k.value <> '' AND octet_length(k.value) <= 2048
+GROUP BY l.tenant_id, k.kind, k.value
+ON CONFLICT ON CONSTRAINT navigation_suggestions_key DO UPDATE SET
+    hits = EXCLUDED.hits,
+    last_seen = EXCLUDED.last_seen;
+
+-- Sugerencias de un tenant (o de todos si p_tenant_id es NULL) ordenadas por:
+-- coincidencia de prefijo, coincidencia de subcadena, frecuencia y similitud
+-- de trigramas (esta última solo para consultas de 3 o más caracteres)
+CREATE OR REPLACE FUNCTION navigation_suggestions_search(
+    p_kind TEXT,
+    p_query TEXT DEFAULT '',
+    p_tenant_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    suggestion TEXT,
+    hits BIGINT
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    WITH q AS (
+        SELECT
+            t.term,
+            replace(replace(replace(t.term, '\', '\\'), '%', '\%'), '_', '\_') AS pattern
+        FROM (SELECT navigation_suggestion_term(p_query) AS term) t
+    ),
+    candidates AS (
+        SELECT s.value, s.term, SUM(s.hits)::BIGINT AS hits
+        FROM navigation_suggestions s, q
+        WHERE s.kind = p_kind
+          AND (p_tenant_id IS NULL OR s.tenant_id = p_tenant_id)
+          AND (
+              q.term = ''
+              OR s.term LIKE '%' || q.pattern || '%'
+              OR (length(q.term) >= 3 AND s.term % q.term)
+          )
+        GROUP BY s.value, s.term
+    )
+    SELECT c.value, c.hits
+    FROM candidates c, q
+    ORDER BY
+        c.term LIKE q.pattern || '%' DESC,
+        c.term LIKE '%' || q.pattern || '%' DESC,
+        c.hits DESC,
+        similarity(c.term, q.term) DESC,
+        c.value
+    LIMIT GREATEST(p_limit, 0);
+$$;
+
+GRANT EXECUTE ON FUNCTION navigation_suggestions_search(TEXT, TEXT, UUID, INTEGER)
+    TO authenticated, service_role;
+
+COMMIT;
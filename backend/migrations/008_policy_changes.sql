@@ -0,0 +1,118 @@
+-- Versiones de políticas para la sincronización incremental de la extensión
+-- Cada cambio en una política de acceso (o en el nombre de un grupo) se
+-- registra en policy_changes con un número de versión creciente. La versión
+-- de un snapshot (tenant, conjunto de grupos) es la mayor versión de los
+-- cambios que le afectan; /api/policies/snapshot responde 304 si el cliente
+-- ya la tiene o solo los cambios posteriores a su versión.
+--
+-- La tabla crece con las ediciones de políticas (acciones de administración),
+-- no con el tráfico de la extensión.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS policy_changes (
+    version BIGSERIAL PRIMARY KEY,
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    group_id UUID,          -- NULL: política de todo el tenant
+    policy_id UUID,         -- NULL en los cambios de grupo
+    op TEXT CHECK (op IN ('upsert', 'delete', 'group')) NOT NULL,
+    changed_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_policy_changes_tenant_group_version
+    ON policy_changes (tenant_id, group_id, version);
+
+ALTER TABLE policy_changes ENABLE ROW LEVEL SECURITY;
+
+-- Las versiones de un tenant se confirman en orden: el bloqueo se mantiene
+-- hasta el final de la transacción, así ningún cliente recibe la versión N
+-- antes de que la N-1 sea visible
+CREATE OR REPLACE FUNCTION policy_changes_log(p_tenant_id UUID, p_group_id UUID, p_policy_id UUID, p_op TEXT)
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('policy_changes'), hashtext(COALESCE(p_tenant_id::TEXT, '')));
+    INSERT INTO policy_changes (tenant_id, group_id, policy_id, op)
+    VALUES (p_tenant_id, p_group_id, p_policy_id, p_op);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION policies_log_change()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    -- Baja en el ámbito anterior: borrado, cambio de tipo, de tenant o de grupo
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.type = 'access' THEN
+        IF TG_OP = 'DELETE'
+            OR NEW.type <> 'access'
+            OR NEW.tenant_id IS DISTINCT FROM OLD.tenant_id
+            OR NEW.group_id IS DISTINCT FROM OLD.group_id
+        THEN
+            PERFORM policy_changes_log(OLD.tenant_id, OLD.group_id, OLD.id, 'delete');
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.type = 'access' THEN
+        PERFORM policy_changes_log(NEW.tenant_id, NEW.group_id, NEW.id, 'upsert');
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS policies_log_change_trigger ON policies;
+CREATE TRIGGER policies_log_change_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON policies
+    FOR EACH ROW
+    EXECUTE FUNCTION policies_log_change();
+
+-- Las políticas de grupo incluyen el nombre del grupo
+CREATE OR REPLACE FUNCTION groups_log_change()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM policy_changes_log(NEW.tenant_id, NEW.id, NULL, 'group');
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS groups_log_change_trigger ON groups;
+CREATE TRIGGER groups_log_change_trigger
+    AFTER UPDATE OF name ON groups
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION groups_log_change();
+
+-- Versión inicial de los snapshots existentes
+INSERT INTO policy_changes (tenant_id, group_id, policy_id, op)
+SELECT tenant_id, group_id, id, 'upsert'
+FROM policies
+WHERE type = 'access'
+ORDER BY created_at;
+
+-- Mayor versión por grupo de un tenant (NULL: políticas sin grupo)
+CREATE OR REPLACE FUNCTION policy_versions(p_tenant_id UUID)
+RETURNS TABLE (
+    group_id UUID,
+    version BIGINT
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    SELECT c.group_id, MAX(c.version)
+    FROM policy_changes c
+    WHERE c.tenant_id = p_tenant_id
+    GROUP BY c.group_id;
+$$;
+
+GRANT EXECUTE ON FUNCTION policy_versions(UUID) TO authenticated, service_role;
+
+COMMIT;
@@ -0,0 +1,86 @@
+import base64
+import json
+
+# Modos de conteo aceptados por PostgREST (Prefer: count=...); 'none' omite el conteo
+COUNT_MODES = ('exact', 'planned', 'estimated', 'none')
+
+
+def encode_cursor(row, keys):
+    """Cursor opaco con los valores de las columnas de orden de la última fila."""
+    payload = json.dumps([row.get(key) for key in keys], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Valores del cursor en el orden de keys; ValueError si el cursor no es válido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError('Cursor inválido')
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError('Cursor inválido')
+    return values
+
+
+def _quote(value):
+    # Los valores entre comillas admiten ',', '(' y ':' dentro de un filtro or=
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def keyset_filter(keys, values):
+    """
+    Filtro or=(...) de PostgREST para las filas posteriores al cursor en un
+    orden descendente por keys (NULLS FIRST, el orden por defecto de DESC):
+    - (a, b) < (x, y)  ->  a < x  OR  (a = x AND b < y)
+    """
+    branches = []
+    equal = []
+    for key, value in zip(keys, values):
+        if value is None:
+            after = f'{key}.not.is.null'
+            same = f'{key}.is.null'
+        else:
+            after = f'{key}.lt.{_quote(value)}'
+            same = f'{key}.eq.{_quote(value)}'
+        branches.append(f"and({','.join(equal + [after])})" if equal else after)
+        equal.append(same)
+    return f"({','.join(branches)})"
+
+
+def apply_keyset(query, keys, cursor):
+    """Ordena la consulta por keys (descendente) y la posiciona tras el cursor si lo hay."""
+    # Un único parámetro order=a.desc,b.desc: postgrest-py repite el parámetro
+    # por cada .order() y PostgREST no combina las repeticiones
+    query.params = query.params.set('order', ','.join(f'{key}.desc' for key in keys))
+    if cursor:
+        query.params = query.params.add('or', keyset_filter(keys, decode_cursor(cursor, keys)))
+    return query
+
+
+def count_mode(value, default='exact'):
+    mode = (value or default).lower()
+    if mode not in COUNT_MODES:
+        raise ValueError(f"Modo de conteo inválido: {value}")
+    return None if mode == 'none' else mode
+
+
+def paginate(query, keys, cursor=None, page=1, page_size=20):
+    """
+    Ejecuta una consulta paginada. Con cursor usa paginación por clave
+    (keyset) sobre keys; sin cursor mantiene la paginación por página.
+    Devuelve (filas, next_cursor, total); el total viene en la misma respuesta
+    si la consulta se construyó con select(..., count=modo). Con cursor el
+    total cuenta solo las filas posteriores al cursor, por lo que los clientes
+    suelen pedirlo en la primera página y conservarlo.
+    """
+    query = apply_keyset(query, keys, cursor)
+    if cursor:
+        result = query.limit(page_size).execute()
+    else:
+        from_idx = (page - 1) * page_size
+        result = query.range(from_idx, from_idx + page_size - 1).execute()
+
+    rows = result.data or []
+    next_cursor = encode_cursor(rows[-1], keys) if len(rows) == page_size else None
+    return rows, next_cursor, result.count
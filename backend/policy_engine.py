@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+
+from domain_matcher import DomainMatcher
+
+logger = logging.getLogger(__name__)
+
+
+class _TenantSnapshot:
+    """Políticas de acceso y membresías de grupo compiladas para un tenant."""
+
+    def __init__(self, global_index, group_index, memberships):
+        self.global_index = global_index
+        self.group_index = group_index
+        self.memberships = memberships
+        self.loaded_at = time.monotonic()
+
+
+def policy_decision(policy):
+    return {
+        'action': policy['action'],
+        'info': {
+            'category': policy.get('category', 'sin categoría'),
+            'block_reason': policy.get('block_reason', 'Bloqueado por política personalizada')
+        }
+    }
+
+
+class PolicyEngine:
+    """
+    Motor de decisión de políticas en memoria.
+
+    Compila por tenant las políticas de acceso, las membresías de grupo y el
+    catálogo de sitios prohibidos en tries de sufijos (DomainMatcher), de modo que
+    verify_policies() no hace consultas a Supabase salvo al recompilar.
+    Los snapshots se recompilan al expirar el TTL o al invalidarse tras una
+    escritura de políticas o grupos. Una recompilación que empezó antes de una
+    invalidación no guarda su resultado (generación, como en MembershipCache).
+    """
+
+    def __init__(self, client, prohibited_matcher, normalize, ttl=60):
+        self._client = client
+        self._normalize = normalize
+        self._ttl = ttl
+        self._snapshots = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._prohibited = prohibited_matcher
+        self._listeners = []
+
+    def on_invalidate(self, callback):
+        """Registra un callback(tenant_id) que se llama en cada invalidate()."""
+        self._listeners.append(callback)
+
+    def reload_prohibited(self, prohibited_matcher):
+        self._prohibited = prohibited_matcher
+
+    def invalidate(self, tenant_id=None):
+        """Descarta el snapshot de un tenant (o de todos si tenant_id es None)."""
+        with self._lock:
+            self._generation += 1
+            if tenant_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(str(tenant_id), None)
+        for callback in self._listeners:
+            callback(tenant_id)
+
+    def _tenant_lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _load_snapshot(self, tenant_id):
+        policies = self._client.table('policies').select('*')\
+            .eq('tenant_id', tenant_id)\
+            .eq('type', 'access')\
+            .execute().data or []
+
+        global_index = DomainMatcher()
+        group_index = DomainMatcher()
+        group_policies = {}
+        for policy in policies:
+            key = self._normalize(policy.get('domain') or '')
+            if not key:
+                continue
+            group_id = policy.get('group_id')
+            if group_id:
+                group_policies.setdefault(key, {}).setdefault(str(group_id), policy)
+            else:
+                global_index.add(key, policy)
+        for key, by_group in group_policies.items():
+            group_index.add(key, by_group)
+
+        # Solo importan las membresías de grupos que tienen políticas
+        memberships = {}
+        group_ids = sorted({str(p['group_id']) for p in policies if p.get('group_id')})
+        if group_ids:
+            rows = self._client.table('group_users').select('group_id, user_id')\
+                .in_('group_id', group_ids)\
+                .execute().data or []
+            for row in rows:
+                memberships.setdefault(str(row['user_id']), set()).add(str(row['group_id']))
+
+        return _TenantSnapshot(
+            global_index,
+            group_index,
+            {uid: frozenset(gids) for uid, gids in memberships.items()}
+        )
+
+    def _is_fresh(self, snapshot, since):
+        if snapshot is None or time.monotonic() - snapshot.loaded_at >= self._ttl:
+            return False
+        return since is None or snapshot.loaded_at >= since
+
+    def snapshot(self, tenant_id, since=None):
+        """
+        Snapshot compilado del tenant. Con since (time.monotonic()) se recompila
+        si el vigente se cargó antes de ese instante.
+        """
+        key = str(tenant_id)
+        with self._lock:
+            current = self._snapshots.get(key)
+        if self._is_fresh(current, since):
+            return current
+        with self._tenant_lock(key):
+            # Otro hilo pudo recompilar mientras esperábamos el lock
+            with self._lock:
+                current = self._snapshots.get(key)
+                generation = self._generation
+            if self._is_fresh(current, since):
+                return current
+            try:
+                fresh = self._load_snapshot(tenant_id)
+            except Exception as e:
+                if current is None:
+                    raise
+                # Mantener el snapshot anterior si Supabase no responde
+                logger.error("Error al recompilar políticas del tenant %s, se usa el snapshot anterior: %s", tenant_id, e)
+                return current
+            with self._lock:
+                if generation == self._generation:
+                    self._snapshots[key] = fresh
+            return fresh
+
+    def verify_policies(self, domain, tenant_id, role, user_id=None):
+        """
+        Devuelve la decisión para un dominio normalizado con el mismo formato
+        que verify_policies(): {'action': ..., 'info': {...} | None}.
+        """
+        domain = domain.lower()
+        category = self._prohibited.match(domain)
+        if category is not None:
+            return {
+                'action': 'bloqueado',
+                'info': {
+                    'category': category,
+                    'block_reason': f'Sitio bloqueado por {category}'
+                }
+            }
+
+        snapshot = self.snapshot(tenant_id)
+        policy = snapshot.global_index.match(domain)
+        if policy is not None:
+            return policy_decision(policy)
+
+        if user_id:
+            user_groups = snapshot.memberships.get(str(user_id))
+            if user_groups:
+                for by_group in snapshot.group_index.matches(domain):
+                    for group_id, group_policy in by_group.items():
+                        if group_id in user_groups:
+                            return policy_decision(group_policy)
+
+        return {'action': 'permitido', 'info': None}
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _TenantChannel:
+    __slots__ = ('version', 'subscribers', 'lock', 'waiters')
+
+    def __init__(self, version):
+        self.version = version
+        self.subscribers = 0
+        self.lock = threading.Lock()
+        # (bucle, asyncio.Event) de los streams asíncronos (asgi.py)
+        self.waiters = set()
+
+
+class PolicyEventBroker:
+    """
+    Canal de invalidación de políticas por tenant (server-sent events).
+
+    Cada conexión de /api/policies/stream (astream, servidor ASGI) espera en
+    el canal de su tenant y recibe un evento policy_version cuando cambia la
+    versión de sus políticas; la extensión solo sincroniza
+    (/api/policies/snapshot) al recibirlo. El servidor WSGI no mantiene
+    conexiones abiertas: poll() responde con la versión actual y un retry.
+
+    Un único hilo comprueba la versión de los tenants con suscriptores:
+    - enseguida tras notify() (escrituras de políticas en este proceso)
+    - cada poll_interval segundos, para los cambios hechos en otros procesos
+    Así el coste en base de datos es una consulta por tenant y no por conexión.
+    """
+
+    def __init__(self, version_source, poll_interval=5, heartbeat=20, max_stream_seconds=600):
+        self._version_source = version_source
+        self._poll_interval = poll_interval
+        self._heartbeat = heartbeat
+        self._max_stream_seconds = max_stream_seconds
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._wake = threading.Event()
+        self._poller = None
+
+    def notify(self, tenant_id=None):
+        """Pide comprobar la versión de un tenant (o de todos) sin esperar al siguiente sondeo."""
+        with self._lock:
+            self._pending.add(str(tenant_id) if tenant_id else None)
+        self._wake.set()
+
+    def _ensure_poller(self):
+        # Se arranca con la primera suscripción: cada worker tiene su propio hilo
+        with self._lock:
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_loop, name='policy-events', daemon=True)
+                self._poller.start()
+
+    def _poll_loop(self):
+        last_sweep = time.monotonic()
+        while True:
+            self._wake.wait(max(0, last_sweep + self._poll_interval - time.monotonic()))
+            self._wake.clear()
+            with self._lock:
+                pending, self._pending = self._pending, set()
+                subscribed = list(self._channels)
+            # El barrido completo (cambios de otros procesos) no se pospone
+            # aunque lleguen notify() más a menudo que poll_interval
+            now = time.monotonic()
+            if None in pending or now - last_sweep >= self._poll_interval:
+                tenants = subscribed
+                last_sweep = now
+            else:
+                tenants = [t for t in subscribed if t in pending]
+            for tenant_id in tenants:
+                try:
+                    self._publish(tenant_id, self._version_source(tenant_id, refresh=True))
+                except Exception as e:
+                    logger.error("Error al comprobar la versión de políticas del tenant %s: %s", tenant_id, e)
+
+    def _publish(self, tenant_id, version):
+        channel = self._channels.get(tenant_id)
+        if channel is None:
+            return
+        with channel.lock:
+            if channel.version is None or version > channel.version:
+                channel.version = version
+                for loop, event in list(channel.waiters):
+                    loop.call_soon_threadsafe(event.set)
+
+    def _subscribe(self, tenant_id):
+        with self._lock:
+            channel = self._channels.get(tenant_id)
+            if channel is None:
+                channel = _TenantChannel(None)
+                self._channels[tenant_id] = channel
+            channel.subscribers += 1
+        return channel
+
+    def _unsubscribe(self, tenant_id, channel):
+        with self._lock:
+            channel.subscribers -= 1
+            if channel.subscribers <= 0 and self._channels.get(tenant_id) is channel:
+                del self._channels[tenant_id]
+
+    @staticmethod
+    def _event(version):
+        return f"event: policy_version\ndata: {json.dumps({'version': version})}\n\n"
+
+    def _initial_version(self, tenant_id, channel):
+        if channel.version is None:
+            initial = self._version_source(tenant_id)
+            with channel.lock:
+                if channel.version is None or initial > channel.version:
+                    channel.version = initial
+        self._ensure_poller()
+        return channel.version
+
+    def poll(self, tenant_id, retry=30):
+        """
+        Respuesta SSE de un solo evento (servidor WSGI): la versión actual y
+        retry para que el cliente vuelva a conectar a los retry segundos, sin
+        ocupar un hilo mientras espera un cambio.
+        """
+        return f'retry: {int(retry * 1000)}\n' + self._event(self._version_source(str(tenant_id)))
+
+    async def astream(self, tenant_id):
+        """
+        Stream SSE para un tenant: la versión actual al conectar, un evento por
+        cada cambio posterior y comentarios de keep-alive cada heartbeat
+        segundos. Espera en el bucle de eventos, sin ocupar un hilo. La conexión
+        se cierra tras max_stream_seconds para que el cliente se reconecte (y se
+        vuelva a validar su token).
+        """
+        tenant_id = str(tenant_id)
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        waiter = (loop, changed)
+        channel = self._subscribe(tenant_id)
+        with channel.lock:
+            channel.waiters.add(waiter)
+        try:
+            version = await loop.run_in_executor(None, self._initial_version, tenant_id, channel)
+            yield 'retry: 5000\n' + self._event(version)
+            deadline = time.monotonic() + self._max_stream_seconds
+            while time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self._heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                changed.clear()
+                current = channel.version
+                if current != version:
+                    version = current
+                    yield self._event(version)
+        finally:
+            with channel.lock:
+                channel.waiters.discard(waiter)
+            self._unsubscribe(tenant_id, channel)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import threading
+import time
+
+from cachetools import TTLCache
+
+from policy_engine import policy_decision
+
+# Versión del formato que interpreta la extensión (chrome-extension/src/ruleSet.ts)
+RULESET_FORMAT = 1
+
+
+class _RuleSet:
+    __slots__ = ('snapshot', 'catalog', 'etag', 'body')
+
+    def __init__(self, snapshot, catalog, etag, body):
+        self.snapshot = snapshot
+        self.catalog = catalog
+        self.etag = etag
+        self.body = body
+
+
+class PolicyRuleSets:
+    """
+    Conjunto de reglas de bloqueo que la extensión evalúa en local.
+
+    Compila, a partir del snapshot de PolicyEngine y del catálogo de sitios
+    prohibidos, tres capas de sufijos de dominio que se consultan en el mismo
+    orden que verify_policies():
+    - prohibited: {categoría: [dominios]}
+    - policies: políticas de todo el tenant {dominio: decisión}
+    - group_policies: políticas de los grupos del usuario {dominio: decisión}
+    En cada capa gana el sufijo más específico. El ETag es un hash del
+    contenido, así que solo cambia cuando cambia alguna decisión.
+
+    Los conjuntos se guardan por (tenant, grupos del usuario) y se reutilizan
+    mientras no cambien el snapshot ni la versión del catálogo.
+    """
+
+    def __init__(self, policy_engine, catalog, version_source, maxsize=10000):
+        self._policy_engine = policy_engine
+        self._catalog = catalog
+        self._version_source = version_source
+        self._rulesets = TTLCache(maxsize=maxsize, ttl=3600)
+        self._seen_versions = TTLCache(maxsize=maxsize, ttl=3600)
+        self._lock = threading.Lock()
+
+    def _tenant_snapshot(self, tenant_id):
+        """
+        Snapshot del motor; si la versión de políticas del tenant cambió desde
+        la última compilación y el motor sigue con el mismo snapshot (cambio
+        hecho desde otro proceso), se recompila antes de que expire su TTL.
+        """
+        version = self._version_source(tenant_id)
+        snapshot = self._policy_engine.snapshot(tenant_id)
+        with self._lock:
+            seen = self._seen_versions.get(tenant_id)
+        if seen is not None and seen[0] is snapshot and seen[1] != version:
+            snapshot = self._policy_engine.snapshot(tenant_id, since=time.monotonic())
+        with self._lock:
+            self._seen_versions[tenant_id] = (snapshot, version)
+        return snapshot
+
+    @staticmethod
+    def _rule(policy):
+        decision = policy_decision(policy)
+        return {'action': decision['action'], **decision['info']}
+
+    def _compile(self, snapshot, catalog, groups):
+        prohibited = {}
+        for domain, category in catalog.matcher.items():
+            prohibited.setdefault(category, []).append(domain)
+
+        policies = {domain: self._rule(policy) for domain, policy in snapshot.global_index.items()}
+
+        # Misma prioridad que verify_policies(): el primer grupo del usuario con política
+        group_policies = {}
+        for domain, by_group in snapshot.group_index.items():
+            for group_id, policy in by_group.items():
+                if group_id in groups:
+                    group_policies[domain] = self._rule(policy)
+                    break
+
+        body = json.dumps({
+            'success': True,
+            'format': RULESET_FORMAT,
+            'prohibited': prohibited,
+            'policies': policies,
+            'group_policies': group_policies
+        }, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha256(body).hexdigest()[:32], body
+
+    def get(self, tenant_id, user_id=None):
+        """(etag, cuerpo JSON serializado) del conjunto de reglas del usuario."""
+        tenant_id = str(tenant_id)
+        snapshot = self._tenant_snapshot(tenant_id)
+        catalog = self._catalog.current()
+        groups = snapshot.memberships.get(str(user_id), frozenset()) if user_id else frozenset()
+
+        key = (tenant_id, groups)
+        with self._lock:
+            cached = self._rulesets.get(key)
+        if cached is not None and cached.snapshot is snapshot and cached.catalog is catalog:
+            return cached.etag, cached.body
+
+        etag, body = self._compile(snapshot, catalog, groups)
+        with self._lock:
+            self._rulesets[key] = _RuleSet(snapshot, catalog, etag, body)
+        return etag, body
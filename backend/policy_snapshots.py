@@ -0,0 +1,193 @@
+import hashlib
+import threading
+
+from cachetools import TTLCache
+
+
+def policy_payload(policy, group_info=None):
+    """Política tal como la recibe la extensión en /api/policies."""
+    return {
+        'id': policy['id'],
+        'domain': policy.get('domain'),
+        'action': policy['action'],
+        'category': policy.get('category'),
+        'block_reason': policy.get('block_reason'),
+        'group_id': policy.get('group_id'),
+        'group': (group_info or {}).get(policy.get('group_id')),
+        'user_id': policy.get('user_id'),
+        'type': policy.get('type', 'access')
+    }
+
+
+class PolicySnapshots:
+    """
+    Snapshots versionados de las políticas de acceso por (tenant, grupos).
+
+    Cada cambio de política queda registrado en policy_changes (migración 008)
+    con una versión creciente. El ETag de un snapshot combina la mayor versión
+    de los cambios de su ámbito con un hash del tenant y sus grupos, de modo
+    que sync() puede responder:
+    - 304 si el cliente ya tiene la versión vigente
+    - solo altas/bajas posteriores a su versión (delta)
+    - el snapshot completo en la primera sincronización, si cambió su
+      conjunto de grupos o si el delta supera max_delta cambios
+
+    Las versiones por grupo de cada tenant se guardan en memoria durante ttl
+    segundos (o hasta invalidate()), así un cliente sin cambios no genera
+    consultas.
+    """
+
+    def __init__(self, client, policy_engine, ttl=15, max_delta=500):
+        self._client = client
+        self._policy_engine = policy_engine
+        self._max_delta = max_delta
+        self._versions = TTLCache(maxsize=10000, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def invalidate(self, tenant_id=None):
+        with self._lock:
+            if tenant_id is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(str(tenant_id), None)
+
+    def _tenant_versions(self, tenant_id, refresh=False):
+        key = str(tenant_id)
+        with self._lock:
+            versions = None if refresh else self._versions.get(key)
+        if versions is None:
+            rows = self._client.rpc('policy_versions', {'p_tenant_id': key}).execute().data or []
+            versions = {row['group_id']: row['version'] for row in rows}
+            with self._lock:
+                self._versions[key] = versions
+        return versions
+
+    def tenant_version(self, tenant_id, refresh=False):
+        """Mayor versión de cualquier política del tenant (0 si no tiene cambios)."""
+        return max(self._tenant_versions(tenant_id, refresh).values(), default=0)
+
+    def scope(self, tenant_id, role, user_id):
+        """Grupos cuyas políticas recibe el usuario; None para client/admin (todos)."""
+        if role != 'user':
+            return None
+        memberships = self._policy_engine.snapshot(tenant_id).memberships
+        return memberships.get(str(user_id), frozenset())
+
+    @staticmethod
+    def _scope_tag(tenant_id, scope):
+        groups = '*' if scope is None else ','.join(sorted(scope))
+        return hashlib.sha1(f'{tenant_id}:{groups}'.encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _in_scope(group_id, scope):
+        return scope is None or group_id is None or str(group_id) in scope
+
+    def _version(self, versions, scope):
+        return max((v for g, v in versions.items() if self._in_scope(g, scope)), default=0)
+
+    @staticmethod
+    def parse_etag(etag):
+        """(versión, etiqueta de ámbito) de un ETag emitido por sync(), o (None, None)."""
+        try:
+            version, tag = (etag or '').split('.', 1)
+            return int(version), tag
+        except ValueError:
+            return None, None
+
+    def sync(self, tenant_id, role, user_id, etag=None):
+        """
+        Devuelve (etag, payload); payload es None si el cliente ya tiene la
+        versión vigente (304).
+        """
+        scope = self.scope(tenant_id, role, user_id)
+        tag = self._scope_tag(tenant_id, scope)
+        since, client_tag = self.parse_etag(etag)
+
+        version = self._version(self._tenant_versions(tenant_id), scope)
+        if since is not None and since > version:
+            # La caché de este proceso es más antigua que la versión del cliente
+            version = self._version(self._tenant_versions(tenant_id, refresh=True), scope)
+
+        current_etag = f'{version}.{tag}'
+        if client_tag == tag and since == version:
+            return current_etag, None
+
+        if client_tag == tag and since is not None and since < version:
+            delta = self._delta(tenant_id, scope, since, version)
+            if delta is not None:
+                upserted, removed = delta
+                return current_etag, {
+                    'version': version,
+                    'full': False,
+                    'upserted': upserted,
+                    'removed': removed
+                }
+
+        return current_etag, {
+            'version': version,
+            'full': True,
+            'data': self._full(tenant_id, scope)
+        }
+
+    def _scoped(self, query, scope):
+        if scope is not None:
+            groups = ','.join(sorted(scope))
+            branches = f'group_id.is.null,group_id.in.({groups})' if groups else 'group_id.is.null'
+            query.params = query.params.add('or', f'({branches})')
+        return query
+
+    def _with_groups(self, policies):
+        group_ids = sorted({p['group_id'] for p in policies if p.get('group_id')})
+        group_info = {}
+        if group_ids:
+            groups = self._client.table('groups').select('id, name').in_('id', group_ids).execute().data or []
+            group_info = {g['id']: g for g in groups}
+        return [policy_payload(p, group_info) for p in policies]
+
+    def _full(self, tenant_id, scope):
+        query = self._client.table('policies').select('*')\
+            .eq('tenant_id', tenant_id)\
+            .eq('type', 'access')
+        return self._with_groups(self._scoped(query, scope).execute().data or [])
+
+    def _delta(self, tenant_id, scope, since, version):
+        """(altas/modificaciones, ids eliminados) entre since y version; None si es muy grande."""
+        query = self._client.table('policy_changes').select('version, group_id, policy_id, op')\
+            .eq('tenant_id', tenant_id)\
+            .gt('version', since)\
+            .lte('version', version)\
+            .order('version')\
+            .limit(self._max_delta + 1)
+        changes = self._scoped(query, scope).execute().data or []
+        if len(changes) > self._max_delta:
+            return None
+
+        touched = {}
+        refreshed_groups = set()
+        for change in changes:
+            if change['op'] == 'group':
+                refreshed_groups.add(change['group_id'])
+            else:
+                touched[change['policy_id']] = change['op']
+
+        current = {}
+        upsert_ids = [pid for pid, op in touched.items() if op == 'upsert']
+        if upsert_ids:
+            rows = self._client.table('policies').select('*').in_('id', upsert_ids).execute().data or []
+            current.update({row['id']: row for row in rows})
+        if refreshed_groups:
+            rows = self._client.table('policies').select('*')\
+                .eq('type', 'access')\
+                .in_('group_id', sorted(refreshed_groups))\
+                .execute().data or []
+            current.update({row['id']: row for row in rows})
+
+        # Una política que ya no existe o salió del ámbito se trata como baja
+        visible = {
+            pid: row for pid, row in current.items()
+            if str(row.get('tenant_id')) == str(tenant_id)
+            and row.get('type', 'access') == 'access'
+            and self._in_scope(row.get('group_id'), scope)
+        }
+        removed = sorted(str(pid) for pid in touched if pid not in visible)
+        return self._with_groups(list(visible.values())), removed
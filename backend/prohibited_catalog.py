@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from domain_matcher import DomainMatcher
+
+logger = logging.getLogger(__name__)
+
+# Categorías del archivo que no se publican en /api/prohibited_sites
+HIDDEN_CATEGORIES = ('recomendaciones',)
+
+
+class CatalogVersion:
+    """
+    Versión inmutable del catálogo de sitios prohibidos: categorías, trie de
+    sufijos, ETag (hash del archivo) y la respuesta de /api/prohibited_sites
+    ya serializada.
+    """
+
+    __slots__ = ('categories', 'matcher', 'etag', 'body', 'mtime')
+
+    def __init__(self, categories, matcher, etag, mtime):
+        self.categories = MappingProxyType({k: tuple(v) for k, v in categories.items()})
+        self.matcher = matcher
+        self.etag = etag
+        self.mtime = mtime
+        public = {k: list(v) for k, v in categories.items() if k not in HIDDEN_CATEGORIES}
+        self.body = json.dumps({'success': True, 'data': public}, ensure_ascii=False).encode('utf-8')
+
+
+class ProhibitedCatalog:
+    """
+    Catálogo de sitios prohibidos (prohibidos.json) cargado una sola vez.
+
+    current() devuelve la versión vigente sin tocar el disco; como mucho una
+    vez cada check_interval segundos se compara el mtime del archivo y, si
+    cambió, se carga una versión nueva y se sustituye de forma atómica. Si el
+    archivo nuevo no es válido se conserva la versión anterior. Los callbacks
+    registrados con on_reload() reciben cada versión nueva.
+    """
+
+    def __init__(self, path, normalize, check_interval=2.0):
+        self._path = path
+        self._normalize = normalize
+        self._check_interval = check_interval
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        # mtime del último intento de carga (correcto o no): no se reintenta sin cambios
+        self._seen_mtime = None
+        self._version = self._load() or CatalogVersion({}, DomainMatcher(), 'empty', None)
+
+    def _load(self):
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+            if mtime == self._seen_mtime:
+                return None
+            self._seen_mtime = mtime
+            with open(self._path, 'rb') as f:
+                raw = f.read()
+            categories = json.loads(raw.decode('utf-8'))
+            if not isinstance(categories, dict):
+                raise ValueError('se esperaba un objeto {categoría: [dominios]}')
+        except FileNotFoundError:
+            if self._seen_mtime != -1:
+                logger.warning("Archivo no encontrado: %s", self._path)
+                self._seen_mtime = -1
+            return None
+        except (OSError, ValueError) as e:
+            logger.error("Error al cargar sitios prohibidos (%s): %s", self._path, e)
+            return None
+
+        matcher = DomainMatcher.from_categories(categories, self._normalize)
+        etag = hashlib.sha256(raw).hexdigest()[:32]
+        logger.info("Se cargaron %s categorías de sitios prohibidos (%s dominios)", len(categories), len(matcher))
+        return CatalogVersion(categories, matcher, etag, mtime)
+
+    def on_reload(self, callback):
+        self._callbacks.append(callback)
+
+    def reload(self, blocking=True):
+        """Recarga el archivo si cambió su mtime; devuelve True si hubo versión nueva."""
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            version = self._load()
+            if version is not None:
+                self._version = version
+        finally:
+            self._lock.release()
+        if version is None:
+            return False
+        for callback in self._callbacks:
+            callback(version)
+        return True
+
+    def current(self):
+        if time.monotonic() - self._checked_at >= self._check_interval:
+            # Solo un hilo comprueba el archivo; el resto sigue con la versión vigente
+            self.reload(blocking=False)
+        return self._version
+
+    def match(self, domain):
+        """Categoría prohibida del dominio (sufijo más específico) o None."""
+        return self.current().matcher.match(domain)
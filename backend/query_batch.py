@@ -0,0 +1,69 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _query_key(query):
+    """Identidad de una consulta PostgREST ya construida (cliente, método, ruta, parámetros y cuerpo)."""
+    return (
+        id(query.session),
+        str(query.http_method),
+        query.path,
+        str(query.params),
+        tuple(sorted((k.lower(), v) for k, v in query.headers.items())),
+        repr(query.json)
+    )
+
+
+class QueryBatch:
+    """
+    Lanza en paralelo las lecturas independientes de una petición.
+
+    submit() devuelve un Future con el resultado de execute(); una consulta
+    idéntica a otra ya enviada en el mismo lote reutiliza su Future, así una
+    misma lectura no se repite dentro de una petición. gather() espera a
+    varias y devuelve sus resultados en orden (o propaga la primera excepción).
+
+    El pool de hilos se comparte entre peticiones; cada lote es de una sola
+    petición y no debe reutilizarse después, porque los datos pueden cambiar.
+    Las consultas se ejecutan con una copia del contexto de la petición
+    (contextvars), así las métricas las cuentan en la petición que las lanzó.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, query):
+        key = _query_key(query)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._executor.submit(contextvars.copy_context().run, query.execute)
+                self._futures[key] = future
+        return future
+
+    def call(self, fn, *args):
+        """Ejecuta fn(*args) en el pool junto a las consultas del lote (sin deduplicar)."""
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def gather(self, *queries):
+        futures = [self.submit(query) for query in queries]
+        return [future.result() for future in futures]
+
+    def __len__(self):
+        return len(self._futures)
+
+
+class QueryBatchExecutor:
+    """Pool de hilos compartido que crea los QueryBatch de cada petición."""
+
+    def __init__(self, max_workers=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query-batch')
+
+    def batch(self):
+        return QueryBatch(self._executor)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
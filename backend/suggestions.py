@@ -0,0 +1,50 @@
+import threading
+
+from cachetools import TTLCache
+
+SUGGESTION_KINDS = ('domain', 'url')
+
+
+class SuggestionService:
+    """
+    Autocompletado de dominios y URLs sobre navigation_suggestions.
+
+    El diccionario (un valor distinto por tenant con su número de apariciones)
+    se mantiene en la base de datos al ingerir logs; aquí solo se consulta la
+    función navigation_suggestions_search y se guardan los resultados en una
+    caché en memoria por (tenant, tipo, consulta), así las pulsaciones
+    repetidas no salen del proceso.
+    """
+
+    def __init__(self, client, ttl=30, maxsize=4096, limit=10):
+        self._client = client
+        self._limit = limit
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def suggest(self, kind, query='', tenant_id=None):
+        """Sugerencias de un tenant (de todos si tenant_id es None), de más a menos relevante."""
+        if kind not in SUGGESTION_KINDS:
+            raise ValueError(f"Tipo de autocompletado inválido: {kind}")
+        key = (str(tenant_id) if tenant_id else None, kind, (query or '').strip().lower())
+
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = self._client.rpc('navigation_suggestions_search', {
+            'p_kind': kind,
+            'p_query': key[2],
+            'p_tenant_id': key[0],
+            'p_limit': self._limit
+        }).execute()
+        suggestions = [row['suggestion'] for row in result.data or []]
+
+        with self._lock:
+            self._cache[key] = suggestions
+        return suggestions
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,81 @@
+import threading
+
+import httpx
+from cachetools import TTLCache
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
+from supabase import Client
+from supabase.client import DEFAULT_POSTGREST_CLIENT_TIMEOUT
+from supabase.lib.client_options import ClientOptions
+
+
+class _SharedTransportPostgrestClient(SyncPostgrestClient):
+    """Cliente PostgREST cuya sesión httpx usa un transporte (pool de conexiones) compartido."""
+
+    def __init__(self, transport, *args, **kwargs):
+        self._transport = transport
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, base_url, headers, timeout):
+        return SyncClient(base_url=base_url, headers=headers, timeout=timeout, transport=self._transport)
+
+
+class _PooledClient(Client):
+    """Cliente Supabase del pool: mismas cabeceras por cliente, conexiones compartidas."""
+
+    def __init__(self, url, key, options, transport):
+        self._transport = transport
+        super().__init__(url, key, options)
+
+    def _init_postgrest_client(self, rest_url, headers, schema, timeout=DEFAULT_POSTGREST_CLIENT_TIMEOUT):
+        return _SharedTransportPostgrestClient(
+            self._transport, rest_url, headers=headers, schema=schema, timeout=timeout
+        )
+
+
+class SupabaseClientPool:
+    """
+    Pool de clientes Supabase indexado por JWT.
+
+    Cada token tiene su cliente (sus cabeceras), pero las sesiones PostgREST
+    de todos ellos comparten un único transporte httpx, es decir, un único
+    pool de conexiones keep-alive con Supabase. Así un cliente es solo un
+    objeto ligero: expulsarlo de la caché (por tamaño o TTL) no deja
+    conexiones abiertas que cerrar, y crear uno para un token nuevo no abre
+    una conexión TLS. El TTL garantiza que un cliente no sobreviva mucho
+    tiempo a su token.
+    """
+
+    def __init__(self, url, key, maxsize=256, ttl=300, max_connections=100):
+        self._url = url
+        self._key = key
+        self._transport = httpx.HTTPTransport(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._clients = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _create(self, jwt_token):
+        options = ClientOptions()
+        options.headers["Authorization"] = f"Bearer {jwt_token}"
+        return _PooledClient(self._url, self._key, options, self._transport)
+
+    def get(self, jwt_token):
+        with self._lock:
+            client = self._clients.get(jwt_token)
+        if client is not None:
+            return client
+
+        # La creación se hace fuera del lock para no serializar peticiones de otros usuarios
+        client = self._create(jwt_token)
+        with self._lock:
+            # Si otro hilo creó un cliente para el mismo token, se usa ese
+            return self._clients.setdefault(jwt_token, client)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
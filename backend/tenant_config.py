@@ -0,0 +1,78 @@
+import threading
+import time
+
+from domain_matcher import domain_suffixes
+
+
+class TenantConfig:
+    """Fila de tenant_configs con sus listas de dominios como conjuntos de sufijos."""
+
+    __slots__ = ('row', 'blocked_domains', 'allowed_domains', 'loaded_at')
+
+    def __init__(self, row, normalize):
+        self.row = row
+        self.blocked_domains = self._domain_set((row or {}).get('blocked_domains'), normalize)
+        self.allowed_domains = self._domain_set((row or {}).get('allowed_domains'), normalize)
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def _domain_set(domains, normalize):
+        return frozenset(d for d in (normalize(domain) for domain in domains or [] if domain) if d)
+
+    @staticmethod
+    def _matches(domains, domain):
+        # El dominio o cualquiera de sus dominios padre (sub.example.com -> example.com)
+        return bool(domains) and any(suffix in domains for suffix in domain_suffixes(domain))
+
+    def is_blocked(self, domain):
+        return self._matches(self.blocked_domains, domain)
+
+    def is_allowed(self, domain):
+        return self._matches(self.allowed_domains, domain)
+
+
+class TenantConfigCache:
+    """
+    Configuración de cada tenant (tenant_configs) en memoria.
+
+    get_config, check_url_with_webrisk y check_url_with_policies la leían en
+    cada petición y recorrían blocked_domains/allowed_domains linealmente. La
+    caché guarda la fila (o su ausencia) con las listas convertidas en
+    conjuntos de dominios normalizados, así comprobar un dominio son tantas
+    búsquedas en un hash como niveles tiene. Las entradas caducan a los ttl
+    segundos; invalidate() las descarta tras una escritura de configuración
+    (una lectura en curso durante la invalidación no se guarda).
+    """
+
+    def __init__(self, client, normalize, ttl=30):
+        self._client = client
+        self._normalize = normalize
+        self._ttl = ttl
+        self._configs = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self, tenant_id):
+        res = self._client.table('tenant_configs').select('*').eq('tenant_id', tenant_id).limit(1).execute()
+        return TenantConfig(res.data[0] if res.data else None, self._normalize)
+
+    def get(self, tenant_id):
+        key = str(tenant_id)
+        config = self._configs.get(key)
+        if config is not None and time.monotonic() - config.loaded_at < self._ttl:
+            return config
+        generation = self._generation
+        config = self._load(tenant_id)
+        with self._lock:
+            # Una invalidación durante la lectura puede haber dejado obsoleta la fila leída
+            if generation == self._generation:
+                self._configs[key] = config
+        return config
+
+    def invalidate(self, tenant_id=None):
+        with self._lock:
+            self._generation += 1
+            if tenant_id is None:
+                self._configs.clear()
+            else:
+                self._configs.pop(str(tenant_id), None)
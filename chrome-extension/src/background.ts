@@ -1,3 +1,7 @@
+import { enqueueEvent, flushEvents, clearEvents, initEventBuffer } from './eventBuffer';
+import { startPolicyStream, restartPolicyStream, stopPolicyStream } from './policyStream';
+import { evaluateHostname, syncRuleSet, clearRuleSet } from './ruleSet';
+
 // Configuración de la URL base según el entorno
 export const API_URL = (() => {
   const manifest = chrome.runtime.getManifest();
@@ -11,6 +15,7 @@ export const API_URL = (() => {
 })();
 
 interface Policy {
+  id?: string;
   domain: string;
   action: PolicyAction;
   category?: string;
@@ -51,6 +56,29 @@ interface UserInteractionEvent {
 let policies: Policy[] = [];
 let tabTimers: Map<number, { startTime: number, timer: number }> = new Map();
 
+// La IP pública y la ubicación cambian poco: se consultan como mucho cada 30 minutos
+const LOCATION_TTL_MS = 30 * 60 * 1000;
+let cachedLocation: { value: {ip: string, city?: string, country?: string}, fetchedAt: number } | null = null;
+let locationRequest: Promise<{ip: string, city?: string, country?: string}> | null = null;
+
+async function getCachedLocation(): Promise<{ip: string, city?: string, country?: string}> {
+  if (cachedLocation && Date.now() - cachedLocation.fetchedAt < LOCATION_TTL_MS) {
+    return cachedLocation.value;
+  }
+  if (!locationRequest) {
+    locationRequest = getPublicIPAndLocation()
+      .then(value => {
+        // No se cachean los fallos para reintentar en el siguiente evento
+        if (value.ip) {
+          cachedLocation = { value, fetchedAt: Date.now() };
+        }
+        return value;
+      })
+      .finally(() => { locationRequest = null; });
+  }
+  return locationRequest;
+}
+
 // Obtener IP pública y ubicación
 async function getPublicIPAndLocation(): Promise<{ip: string, city?: string, country?: string}> {
   try {
@@ -99,29 +127,39 @@ async function fetchPolicies(): Promise<void> {
     return;
   }
 
+  // Las reglas de bloqueo locales se revalidan en paralelo (304 si no cambiaron)
+  syncRuleSet(API_URL, jwt_token)
+    .catch(error => console.error('[Athos] Error al sincronizar reglas de bloqueo:', error));
+
   try {
-    console.log('[Athos] Iniciando verificación de políticas...');
-    
-    // Verificar si el servidor está disponible
-    const serverCheck = await fetch(`${API_URL}/health`, {
-      method: 'HEAD',
-      headers: {
-        'Authorization': `Bearer ${jwt_token}`
-      }
-    }).catch(() => null);
+    console.log('[Athos] Sincronizando políticas...');
 
-    if (!serverCheck) {
+    // Tras reiniciar el service worker se parte del último snapshot guardado
+    const { policy_etag } = await chrome.storage.local.get('policy_etag');
+    if (policy_etag && policies.length === 0) {
+      const stored = await chrome.storage.local.get('policies');
+      policies = stored.policies || [];
+    }
+
+    const headers: Record<string, string> = {
+      'Authorization': `Bearer ${jwt_token}`
+    };
+    if (policy_etag) {
+      headers['If-None-Match'] = policy_etag;
+    }
+
+    // no-store: el ETag lo gestiona la extensión, no la caché HTTP del navegador
+    const res = await fetch(`${API_URL}/api/policies/snapshot`, { headers, cache: 'no-store' })
+      .catch(() => null);
+    if (!res) {
       throw new Error(`No se puede conectar al servidor en ${API_URL}. Verifica que el servidor esté corriendo.`);
     }
 
-    console.log('[Athos] Servidor disponible, obteniendo políticas...');
-    const res = await fetch(`${API_URL}/api/policies`, {
-      headers: {
-        'Authorization': `Bearer ${jwt_token}`,
-        'Content-Type': 'application/json'
-      }
-    });
-    
+    if (res.status === 304) {
+      console.log('[Athos] Políticas sin cambios (versión', policy_etag, ')');
+      return;
+    }
+
     if (!res.ok) {
       if (res.status === 401) {
         console.log('[Athos] Token expirado o inválido');
@@ -147,9 +185,17 @@ async function fetchPolicies(): Promise<void> {
     
     const data = await res.json();
     if (data.success) {
-      policies = data.data;
-      await chrome.storage.local.set({ policies });
+      if (data.full) {
+        policies = data.data;
+      } else {
+        // Delta: se quitan las bajas y se reemplazan las políticas modificadas
+        const changed = new Set<string>([...data.removed, ...data.upserted.map((p: Policy) => p.id)]);
+        policies = policies.filter(p => !p.id || !changed.has(p.id)).concat(data.upserted);
+      }
+      await chrome.storage.local.set({ policies, policy_etag: res.headers.get('ETag') });
       console.log('[Athos] Políticas actualizadas exitosamente:', {
+        version: data.version,
+        full: data.full,
         total_policies: policies.length,
         blocked_policies: policies.filter(p => p.action === 'block').length,
         allowed_policies: policies.filter(p => p.action === 'allow').length
@@ -183,7 +229,7 @@ async function fetchPolicies(): Promise<void> {
     console.error('[Athos] Error al obtener políticas:', {
       message: errorMessage,
       stack: e?.stack,
-      url: `${API_URL}/api/policies`,
+      url: `${API_URL}/api/policies/snapshot`,
       timestamp: new Date().toISOString()
     });
 
@@ -213,36 +259,47 @@ async function getCurrentTabId(): Promise<number> {
   return tabs[0]?.id || 0;
 }
 
-// Verificar si una URL debe ser bloqueada
-async function isBlocked(url: string): Promise<boolean> {
+interface NavigationDecision {
+  blocked: boolean;
+  reason?: string;
+  // El backend ya registró la visita (consulta remota)
+  logged: boolean;
+}
+
+// Decidir si una URL debe ser bloqueada. Con las reglas descargadas la
+// decisión es local y no añade latencia a la navegación.
+async function decideNavigation(url: string): Promise<NavigationDecision> {
   try {
     const hostname = new URL(url).hostname;
     console.log(`[Athos] Verificando URL: ${url} (hostname: ${hostname})`);
-    
-    // Primero verificamos las políticas locales
+
+    const decision = await evaluateHostname(hostname);
+    if (decision) {
+      if (decision.action === 'block') {
+        console.log(`[Athos] URL bloqueada por regla local:`, decision);
+        return { blocked: true, reason: decision.block_reason || decision.category || undefined, logged: false };
+      }
+      return { blocked: false, logged: false };
+    }
+
+    // Sin reglas descargadas todavía: políticas locales y, si no bloquean, el backend
     const blockedPolicy = policies.find(policy => {
       const policyDomain = policy.domain.toLowerCase();
       const currentHostname = hostname.toLowerCase();
       const matches = currentHostname === policyDomain || 
                      currentHostname.endsWith('.' + policyDomain);
-      
-      if (matches && policy.action === PolicyAction.Block) {
-        console.log(`[Athos] URL bloqueada por política local: ${policyDomain}`);
-        return true;
-      }
-      return false;
+      return matches && policy.action === PolicyAction.Block;
     });
 
     if (blockedPolicy) {
       console.log(`[Athos] URL bloqueada por política: ${blockedPolicy.domain}`);
-      return true;
+      return { blocked: true, reason: blockedPolicy.block_reason, logged: false };
     }
 
-    // Si no hay políticas locales que bloqueen, consultamos al backend
     const { jwt_token } = await chrome.storage.local.get('jwt_token');
     if (!jwt_token) {
       console.log(`[Athos] No hay token JWT, no se puede consultar al backend`);
-      return false;
+      return { blocked: false, logged: false };
     }
 
     console.log(`[Athos] Enviando consulta al backend para verificar URL...`);
@@ -261,27 +318,21 @@ async function isBlocked(url: string): Promise<boolean> {
     });
 
     const data = await response.json();
-    console.log(`[Athos] Respuesta completa del backend:`, JSON.stringify(data, null, 2));
-
     if (!data.success) {
       console.error(`[Athos] Error en la respuesta del backend:`, data.error);
-      return true; // Por seguridad, bloqueamos si hay error
+      return { blocked: true, logged: false }; // Por seguridad, bloqueamos si hay error
     }
 
-    // Verificar si la URL está bloqueada por el backend
     if (data.data[0]?.action === 'bloqueado') {
-      console.log(`[Athos] URL bloqueada por el backend:`, {
-        reason: data.data[0].policy_info,
-        details: data.data[0]
-      });
-      return true;
+      console.log(`[Athos] URL bloqueada por el backend:`, data.data[0].policy_info);
+      return { blocked: true, logged: true };
     }
 
     console.log(`[Athos] URL permitida por el backend`);
-    return false;
+    return { blocked: false, logged: true };
   } catch (e) {
     console.error('[Athos] Error checking if URL is blocked:', e);
-    return true; // Por seguridad, bloqueamos si hay error
+    return { blocked: true, logged: false }; // Por seguridad, bloqueamos si hay error
   }
 }
 
@@ -300,28 +351,40 @@ chrome.webNavigation.onBeforeNavigate.addListener(async (details) => {
 
   try {
     console.log(`[Athos] Verificando navegación a: ${url}`);
-    const isUrlBlocked = await isBlocked(url);
-    console.log(`[Athos] Resultado de verificación: ${isUrlBlocked ? 'BLOQUEADA' : 'PERMITIDA'}`);
+    const decision = await decideNavigation(url);
+    console.log(`[Athos] Resultado de verificación: ${decision.blocked ? 'BLOQUEADA' : 'PERMITIDA'}`);
 
-    if (isUrlBlocked) {
-      // Registrar el intento de acceso bloqueado
-      await registerNavigation({
-        url: url,
-        action: 'bloqueado',
-        eventType: 'navegacion',
-        eventDetails: { motivo: 'Bloqueado por política' },
-        hasToken: true
-      });
-      console.log(`[Athos] Redirigiendo a página de bloqueo...`);
-      redirectToBlocked(details.tabId, url);
-      chrome.notifications.create({
-        type: 'basic',
-        iconUrl: 'icon128.png',
-        title: 'Sitio Bloqueado',
-        message: `El acceso a ${new URL(url).hostname} ha sido bloqueado por políticas de la organización.`,
-        priority: 2
-      });
+    if (!decision.blocked) {
+      // El registro de la visita va al buffer de eventos y no retrasa la navegación
+      if (!decision.logged) {
+        registerNavigation({
+          url: url,
+          action: 'visitado',
+          eventType: 'navegacion',
+          eventDetails: {},
+          hasToken: true
+        });
+      }
+      return;
     }
+
+    console.log(`[Athos] Redirigiendo a página de bloqueo...`);
+    redirectToBlocked(details.tabId, url);
+    // Registrar el intento de acceso bloqueado
+    registerNavigation({
+      url: url,
+      action: 'bloqueado',
+      eventType: 'navegacion',
+      eventDetails: { motivo: decision.reason || 'Bloqueado por política' },
+      hasToken: true
+    });
+    chrome.notifications.create({
+      type: 'basic',
+      iconUrl: 'icon128.png',
+      title: 'Sitio Bloqueado',
+      message: `El acceso a ${new URL(url).hostname} ha sido bloqueado por políticas de la organización.`,
+      priority: 2
+    });
   } catch (error) {
     console.error('[Athos] Error en el listener de navegación:', error);
   }
@@ -465,12 +528,18 @@ chrome.tabs.onRemoved.addListener((tabId) => {
 // Actualizar políticas al iniciar sesión o cuando cambie el token
 chrome.storage.onChanged.addListener((changes, area) => {
   if (area === 'local' && changes.jwt_token) {
+    // El snapshot guardado pertenece a la sesión anterior
+    policies = [];
+    lastPolicyVersion = null;
     if (changes.jwt_token.newValue) {
       console.log('[Athos] Token JWT actualizado, iniciando fetch de políticas');
-      fetchPolicies();
+      Promise.all([chrome.storage.local.remove('policy_etag'), clearRuleSet()]).then(() => fetchPolicies());
+      restartPolicyStream();
     } else {
       console.log('[Athos] Token JWT eliminado, limpiando políticas');
-      policies = [];
+      chrome.storage.local.remove('policy_etag');
+      clearRuleSet();
+      stopPolicyStream(false);
     }
   }
 });
@@ -499,12 +568,31 @@ chrome.runtime.onStartup.addListener(async () => {
     }
 });
 
-// Refrescar políticas cada 5 minutos
-setInterval(fetchPolicies, 5 * 60 * 1000);
+// Los cambios de políticas llegan por /api/policies/stream; el sondeo queda
+// como respaldo por si el stream no está disponible
+setInterval(fetchPolicies, 30 * 60 * 1000);
 
 // Inicializar políticas al cargar background
 fetchPolicies();
 
+// Sincronizar solo cuando el servidor anuncia una versión nueva
+let lastPolicyVersion: number | null = null;
+startPolicyStream({
+  apiUrl: API_URL,
+  getToken,
+  onVersion: (version) => {
+    // El primer evento de cada conexión trae la versión actual
+    if (version !== lastPolicyVersion) {
+      console.log('[Athos] Nueva versión de políticas anunciada:', version);
+      lastPolicyVersion = version;
+      fetchPolicies();
+    }
+  }
+});
+
+// Los eventos se acumulan en un buffer persistente y se envían en lote
+initEventBuffer({ apiUrl: API_URL, getToken });
+
 // Manejar mensajes del content script
 chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
     console.log('[Athos] Mensaje recibido del content script:', message);
@@ -517,39 +605,47 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
                 return;
             }
 
+            // El content script envía { type, data }; se admite también el formato plano
+            const interaction = message.data || message;
             const eventDetails = {
-                texto: message.texto,
-                tipo_evento: message.tipo_evento,
-                nombre_archivo: message.nombre_archivo,
-                elemento_target: message.elemento_target
+                texto: interaction.texto,
+                tipo_evento: interaction.tipo_evento,
+                nombre_archivo: interaction.nombre_archivo,
+                elemento_target: interaction.elemento_target
             };
             
             console.log('[Athos] Detalles del evento procesados:', eventDetails);
             
             await registerNavigation({
-                url: message.url_origen,
+                url: interaction.url_origen,
                 action: 'visitado',
                 eventType: 'navegacion',
                 eventDetails: eventDetails,
-                timestamp: message.timestamp,
+                timestamp: interaction.timestamp,
                 hasToken: true
             });
         });
     } else if (message.type === 'user_logout') {
         console.log('[Athos] Usuario ha cerrado sesión');
-        // Limpiar datos de sesión
-        chrome.storage.local.remove(['jwt_token', 'policies'], () => {
-            console.log('[Athos] Datos de sesión limpiados');
-            // Notificar a todas las pestañas que se cerró sesión
-            chrome.tabs.query({}, (tabs) => {
-                tabs.forEach(tab => {
-                    if (tab.id) {
-                        chrome.tabs.sendMessage(tab.id, { type: 'session_ended' })
-                            .catch(() => console.log('[Athos] No se pudo notificar a la pestaña:', tab.id));
-                    }
+        // Enviar los eventos pendientes con el token actual antes de descartarlo
+        flushEvents()
+            .catch(error => console.error('[Athos] Error al vaciar el buffer de eventos:', error))
+            .then(() => clearEvents())
+            .then(() => {
+                // Limpiar datos de sesión
+                chrome.storage.local.remove(['jwt_token', 'policies', 'policy_etag', 'policy_rules', 'policy_rules_etag'], () => {
+                    console.log('[Athos] Datos de sesión limpiados');
+                    // Notificar a todas las pestañas que se cerró sesión
+                    chrome.tabs.query({}, (tabs) => {
+                        tabs.forEach(tab => {
+                            if (tab.id) {
+                                chrome.tabs.sendMessage(tab.id, { type: 'session_ended' })
+                                    .catch(() => console.log('[Athos] No se pudo notificar a la pestaña:', tab.id));
+                            }
+                        });
+                    });
                 });
             });
-        });
     }
 });
 
@@ -587,7 +683,7 @@ async function registerNavigation(data: {
         }
 
         // Obtener IP y ubicación
-        const { ip, city, country } = await getPublicIPAndLocation();
+        const { ip, city, country } = await getCachedLocation();
 
         // Mapear eventType a los valores aceptados por la base de datos
         const eventTypeMap: Record<string, string> = {
@@ -622,49 +718,19 @@ async function registerNavigation(data: {
             risk_score: calculateRiskScore(safeEventType, data.eventDetails)
         };
 
-        console.log('[Athos] Enviando evento a la API:', {
-            endpoint: `${API_URL}/api/navigation_logs`,
+        console.log('[Athos] Encolando evento:', {
             eventType: data.eventType,
             eventDetails: data.eventDetails,
             timestamp: eventData.timestamp,
             location: { city, country }
         });
 
-        console.log('[Athos] Objeto REAL enviado a la API:', eventData);
-
         if (!eventData.domain) {
             console.error('[Athos] Dominio vacío, no se enviará el registro:', eventData);
             return;
         }
 
-        const response = await fetch(`${API_URL}/api/navigation_logs`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'Authorization': `Bearer ${token}`
-            },
-            body: JSON.stringify(eventData)
-        });
-
-        console.log('[Athos] Respuesta de la API:', {
-            status: response.status,
-            ok: response.ok,
-            statusText: response.statusText
-        });
-
-        if (!response.ok) {
-            const errorText = await response.text();
-            console.error('[Athos] Error detallado:', {
-                status: response.status,
-                statusText: response.statusText,
-                errorText: errorText
-            });
-            throw new Error(`Error al registrar navegación: ${response.status} - ${response.statusText}`);
-        }
-
-        const responseData = await response.json();
-        console.log('[Athos] Datos de respuesta:', responseData);
-
+        await enqueueEvent(eventData);
     } catch (error) {
         console.error('[Athos] Error al registrar navegación:', error);
     }
@@ -345,6 +345,74 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
     }
 });
 
+interface DownloadCandidate {
+  url: string;
+  filename: string;
+  filesize: number;
+  mimetype: string;
+}
+
+interface DownloadDecision {
+  allowed: boolean;
+  reason: string;
+}
+
+// Los tres interceptores pueden consultar el mismo archivo en un solo clic:
+// las consultas de una misma ventana de tiempo viajan juntas a
+// /api/check-download/batch y las repetidas comparten resultado unos segundos
+const DOWNLOAD_BATCH_WINDOW_MS = 25;
+const DOWNLOAD_DECISION_TTL_MS = 5000;
+const downloadDecisions = new Map<string, { promise: Promise<DownloadDecision>; expires: number }>();
+let pendingDownloads: { candidate: DownloadCandidate; resolve: (d: DownloadDecision) => void }[] = [];
+let downloadBatchTimer: number | null = null;
+
+async function flushDownloadChecks() {
+  const batch = pendingDownloads;
+  pendingDownloads = [];
+  downloadBatchTimer = null;
+  // Ante cualquier error se permite la descarga, como hace el backend
+  const fallback: DownloadDecision = { allowed: true, reason: 'Error al verificar políticas' };
+  try {
+    const { jwt_token } = await chrome.storage.local.get('jwt_token');
+    if (!jwt_token) {
+      batch.forEach(item => item.resolve({ allowed: true, reason: 'Sin sesión' }));
+      return;
+    }
+    const res = await fetch('http://localhost:5001/api/check-download/batch', {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${jwt_token}`,
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({ files: batch.map(item => item.candidate) })
+    });
+    const data = await res.json();
+    batch.forEach((item, i) => item.resolve(data.results?.[i] ?? fallback));
+  } catch (error) {
+    console.warn('[Athos] Error al verificar descargas:', error);
+    batch.forEach(item => item.resolve(fallback));
+  }
+}
+
+function checkDownload(candidate: DownloadCandidate): Promise<DownloadDecision> {
+  const key = `${candidate.url}\n${candidate.filename}`;
+  const now = Date.now();
+  const cached = downloadDecisions.get(key);
+  if (cached && cached.expires > now) return cached.promise;
+
+  const promise = new Promise<DownloadDecision>(resolve => {
+    pendingDownloads.push({ candidate, resolve });
+    if (downloadBatchTimer === null) {
+      downloadBatchTimer = window.setTimeout(flushDownloadChecks, DOWNLOAD_BATCH_WINDOW_MS);
+    }
+  });
+  downloadDecisions.set(key, { promise, expires: now + DOWNLOAD_DECISION_TTL_MS });
+  for (const [k, entry] of downloadDecisions) {
+    if (entry.expires <= now) downloadDecisions.delete(k);
+  }
+  return promise;
+}
+
 // Interceptar descargas en enlaces y blobs
 document.addEventListener('click', async function(e) {
   if (!isActive || !isAuthenticated) return;
@@ -366,22 +434,12 @@ document.addEventListener('click', async function(e) {
       fileName = fileName.split('?')[0];
     }
     // Consultar al backend antes de permitir la descarga
-    const { jwt_token } = await chrome.storage.local.get('jwt_token');
-    if (!jwt_token) return;
-    const res = await fetch('http://localhost:5001/api/check-download', {
-      method: 'POST',
-      headers: {
-        'Authorization': `Bearer ${jwt_token}`,
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify({
-        url: link.href,
-        filename: fileName,
-        filesize: 0,
-        mimetype: ''
-      })
+    const data = await checkDownload({
+      url: link.href,
+      filename: fileName,
+      filesize: 0,
+      mimetype: ''
     });
-    const data = await res.json();
     if (!data.allowed) {
       e.preventDefault();
       e.stopPropagation();
@@ -406,26 +464,15 @@ document.addEventListener('click', async function(e) {
       fileName = (blob as any).name;
     }
     // Consultar al backend antes de permitir la descarga
-    chrome.storage.local.get('jwt_token', async ({ jwt_token }) => {
-      if (!jwt_token) return;
-      const res = await fetch('http://localhost:5001/api/check-download', {
-        method: 'POST',
-        headers: {
-          'Authorization': `Bearer ${jwt_token}`,
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          url: window.location.href,
-          filename: fileName,
-          filesize: blob.size,
-          mimetype: blob.type
-        })
-      });
-      const data = await res.json();
+    checkDownload({
+      url: window.location.href,
+      filename: fileName,
+      filesize: blob.size,
+      mimetype: blob.type
+    }).then(data => {
       if (!data.allowed) {
         // Redirigir a la pantalla de bloqueo personalizada
         window.location.href = chrome.runtime.getURL('blocked.html?url=' + encodeURIComponent(window.location.href));
-        return '';
       }
     });
     return originalCreateObjectURL.apply(this, arguments as any);
@@ -435,25 +482,14 @@ document.addEventListener('click', async function(e) {
   window.open = function(...args) {
     const url = args[0];
     if (typeof url === 'string' && /\.(pdf|docx?|xlsx?|zip|rar|jpg|jpeg|png|gif|mp4|mp3|txt|csv)$/i.test(url)) {
-      chrome.storage.local.get('jwt_token', async ({ jwt_token }) => {
-        if (!jwt_token) return;
-        const res = await fetch('http://localhost:5001/api/check-download', {
-          method: 'POST',
-          headers: {
-            'Authorization': `Bearer ${jwt_token}`,
-            'Content-Type': 'application/json'
-          },
-          body: JSON.stringify({
-            url: url,
-            filename: url.split('/').pop() || 'archivo_desconocido',
-            filesize: 0,
-            mimetype: ''
-          })
-        });
-        const data = await res.json();
+      checkDownload({
+        url: url,
+        filename: url.split('/').pop() || 'archivo_desconocido',
+        filesize: 0,
+        mimetype: ''
+      }).then(data => {
         if (!data.allowed) {
           window.location.href = chrome.runtime.getURL('blocked.html?url=' + encodeURIComponent(url));
-          return null;
         }
       });
     }
@@ -0,0 +1,239 @@
+// Buffer persistente de eventos de navegación e interacción.
+// Los eventos se guardan en chrome.storage.local (sobreviven a reinicios del
+// service worker) y se envían en lote a /api/navigation_logs/batch cuando se
+// cumple alguno de los disparadores: tamaño, antigüedad o inactividad.
+
+export interface BufferedEvent {
+  url: string;
+  domain: string;
+  action: string;
+  event_type: string;
+  event_details: Record<string, any>;
+  timestamp: string;
+  ip_address?: string;
+  city?: string;
+  country?: string;
+  user_agent: string;
+  tab_title: string | null;
+  time_on_page: number;
+  open_tabs_count: number;
+  tab_focused: boolean;
+  risk_score: number;
+}
+
+interface BufferState {
+  events: BufferedEvent[];
+  retryAttempt: number;
+  nextRetryAt: number;
+}
+
+interface BufferConfig {
+  apiUrl: string;
+  getToken: () => Promise<string | null>;
+}
+
+const STORAGE_KEY = 'event_buffer';
+const FLUSH_ALARM = 'athos_event_buffer_flush';
+const MAX_EVENTS = 2000;          // Capacidad del ring buffer (se descartan los más antiguos)
+const FLUSH_SIZE = 50;            // Enviar en cuanto haya este número de eventos...
+const FLUSH_MAX_AGE_MS = 30_000;  // ...o cuando el evento más antiguo tenga esta edad...
+const FLUSH_IDLE_MS = 5_000;      // ...o tras este tiempo sin eventos nuevos
+const MAX_BATCH = 200;
+const CLICK_DEDUPE_MS = 2_000;    // Clicks repetidos sobre el mismo elemento se agrupan
+const BASE_BACKOFF_MS = 2_000;
+const MAX_BACKOFF_MS = 5 * 60_000;
+// Rechazos del servidor que no se resuelven reintentando el mismo lote
+const PERMANENT_STATUSES = new Set([400, 413, 422]);
+
+let config: BufferConfig | null = null;
+let state: BufferState | null = null;
+let pending: Promise<unknown> = Promise.resolve();
+let flushTimer: ReturnType<typeof setTimeout> | null = null;
+let flushing = false;
+let batchSize = MAX_BATCH;
+
+// Serializa las operaciones sobre el estado para evitar escrituras concurrentes
+function serialize<T>(task: () => Promise<T>): Promise<T> {
+  const run = pending.then(task, task);
+  pending = run.catch(() => undefined);
+  return run;
+}
+
+async function loadState(): Promise<BufferState> {
+  if (!state) {
+    const stored = await chrome.storage.local.get(STORAGE_KEY);
+    state = stored[STORAGE_KEY] || { events: [], retryAttempt: 0, nextRetryAt: 0 };
+  }
+  return state as BufferState;
+}
+
+async function saveState(): Promise<void> {
+  if (state) {
+    await chrome.storage.local.set({ [STORAGE_KEY]: state });
+  }
+}
+
+function clickKey(event: BufferedEvent): string | null {
+  const details = event.event_details || {};
+  if (details.tipo_evento !== 'click') return null;
+  const target = details.elemento_target || {};
+  return [event.url, target.tag, target.id, target.class, target.text].join('|');
+}
+
+function backoffDelay(attempt: number): number {
+  const delay = Math.min(MAX_BACKOFF_MS, BASE_BACKOFF_MS * 2 ** (attempt - 1));
+  return delay / 2 + Math.random() * delay / 2;
+}
+
+function scheduleFlush(): void {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+  }
+  if (!state || state.events.length === 0) return;
+
+  const now = Date.now();
+  let delay = 0;
+  if (state.events.length < FLUSH_SIZE) {
+    const oldest = Date.parse(state.events[0].timestamp) || now;
+    delay = Math.min(FLUSH_IDLE_MS, Math.max(0, oldest + FLUSH_MAX_AGE_MS - now));
+  }
+  delay = Math.max(delay, state.nextRetryAt - now);
+  flushTimer = setTimeout(() => {
+    flushTimer = null;
+    void flushEvents();
+  }, delay);
+}
+
+export async function enqueueEvent(event: BufferedEvent): Promise<void> {
+  await serialize(async () => {
+    const current = await loadState();
+    const key = clickKey(event);
+    if (key) {
+      const eventTime = Date.parse(event.timestamp) || Date.now();
+      for (let i = current.events.length - 1; i >= 0; i--) {
+        const previous = current.events[i];
+        if (eventTime - (Date.parse(previous.timestamp) || 0) > CLICK_DEDUPE_MS) break;
+        if (clickKey(previous) === key) {
+          previous.event_details.repeticiones = (previous.event_details.repeticiones || 1) + 1;
+          await saveState();
+          return;
+        }
+      }
+    }
+    current.events.push(event);
+    if (current.events.length > MAX_EVENTS) {
+      current.events.splice(0, current.events.length - MAX_EVENTS);
+    }
+    await saveState();
+  });
+  scheduleFlush();
+}
+
+export async function flushEvents(): Promise<void> {
+  if (!config || flushing) return;
+  flushing = true;
+  try {
+    while (true) {
+      const current = await loadState();
+      if (current.events.length === 0 || Date.now() < current.nextRetryAt) break;
+
+      // Sin sesión se conservan los eventos hasta el próximo inicio de sesión
+      const token = await config.getToken();
+      if (!token) break;
+
+      const batch = current.events.slice(0, batchSize);
+      let response: Response | null = null;
+      try {
+        response = await fetch(`${config.apiUrl}/api/navigation_logs/batch`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${token}`
+          },
+          body: JSON.stringify({ events: batch })
+        });
+      } catch (e) {
+        console.warn('[Athos] No se pudo enviar el lote de eventos:', e);
+      }
+
+      if (response && PERMANENT_STATUSES.has(response.status)) {
+        // Se divide el lote hasta aislar el evento rechazado, que se descarta:
+        // reintentarlo bloquearía la cabeza del buffer y el ring buffer acabaría
+        // sobrescribiendo los eventos nuevos
+        if (batch.length > 1) {
+          batchSize = Math.ceil(batch.length / 2);
+          continue;
+        }
+        let detail: unknown = null;
+        try {
+          detail = await response.json();
+        } catch (e) {
+          // Respuesta sin cuerpo JSON
+        }
+        console.error('[Athos] Evento rechazado por el servidor, se descarta:', {
+          status: response.status,
+          detail,
+          event: batch[0]
+        });
+        await serialize(async () => {
+          current.events = current.events.filter(event => event !== batch[0]);
+          await saveState();
+        });
+        batchSize = MAX_BATCH;
+        continue;
+      }
+
+      if (!response || !response.ok) {
+        await serialize(async () => {
+          current.retryAttempt += 1;
+          current.nextRetryAt = Date.now() + backoffDelay(current.retryAttempt);
+          await saveState();
+        });
+        console.warn('[Athos] Error al enviar lote de eventos, reintento programado:', {
+          status: response?.status,
+          attempt: current.retryAttempt,
+          pending: current.events.length
+        });
+        break;
+      }
+
+      await serialize(async () => {
+        // Pueden haberse añadido eventos mientras se enviaba el lote
+        const sent = new Set(batch);
+        current.events = current.events.filter(event => !sent.has(event));
+        current.retryAttempt = 0;
+        current.nextRetryAt = 0;
+        await saveState();
+      });
+      console.log(`[Athos] Lote de ${batch.length} eventos registrado`);
+    }
+  } finally {
+    flushing = false;
+    scheduleFlush();
+  }
+}
+
+// Descarta los eventos pendientes (p. ej. al cerrar sesión, tras un último envío)
+export async function clearEvents(): Promise<void> {
+  await serialize(async () => {
+    const current = await loadState();
+    current.events = [];
+    current.retryAttempt = 0;
+    current.nextRetryAt = 0;
+    await saveState();
+  });
+  scheduleFlush();
+}
+
+export function initEventBuffer(options: BufferConfig): void {
+  config = options;
+  // La alarma despierta al service worker para vaciar el buffer aunque se haya detenido
+  chrome.alarms.create(FLUSH_ALARM, { periodInMinutes: 1 });
+  chrome.alarms.onAlarm.addListener((alarm) => {
+    if (alarm.name === FLUSH_ALARM) {
+      void flushEvents();
+    }
+  });
+  void loadState().then(scheduleFlush);
+}
@@ -0,0 +1,131 @@
+// Suscripción a /api/policies/stream (server-sent events).
+// EventSource no permite enviar el header Authorization, así que el stream se
+// lee con fetch y se interpreta el formato SSE a mano. Ante cualquier corte se
+// reconecta con backoff exponencial; tras un 401 espera a que cambie el token.
+// Cuando el servidor cierra la respuesta limpiamente se vuelve a conectar tras
+// el retry que haya indicado (el servidor WSGI responde con un solo evento).
+
+interface StreamConfig {
+  apiUrl: string;
+  getToken: () => Promise<string | null>;
+  onVersion: (version: number) => void;
+}
+
+const BASE_BACKOFF_MS = 1_000;
+const MAX_BACKOFF_MS = 60_000;
+
+let config: StreamConfig | null = null;
+let controller: AbortController | null = null;
+let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+let attempt = 0;
+// Último retry: enviado por el servidor (ms)
+let serverRetryMs = BASE_BACKOFF_MS;
+
+function backoffDelay(): number {
+  const base = Math.min(MAX_BACKOFF_MS, BASE_BACKOFF_MS * 2 ** attempt);
+  attempt += 1;
+  // Jitter para que las extensiones no se reconecten todas a la vez
+  return base / 2 + Math.random() * base / 2;
+}
+
+function scheduleReconnect(delay = backoffDelay()): void {
+  if (!config || reconnectTimer) return;
+  reconnectTimer = setTimeout(() => {
+    reconnectTimer = null;
+    connect();
+  }, delay);
+}
+
+function dispatch(frame: string): void {
+  let event = 'message';
+  const data: string[] = [];
+  for (const line of frame.split('\n')) {
+    if (line.startsWith(':')) continue;  // keep-alive
+    const sep = line.indexOf(':');
+    const field = sep === -1 ? line : line.slice(0, sep);
+    const value = sep === -1 ? '' : line.slice(sep + 1).replace(/^ /, '');
+    if (field === 'event') event = value;
+    else if (field === 'data') data.push(value);
+    else if (field === 'retry' && /^\d+$/.test(value)) serverRetryMs = Number(value);
+  }
+  if (event !== 'policy_version' || data.length === 0) return;
+  try {
+    const { version } = JSON.parse(data.join('\n'));
+    config?.onVersion(version);
+  } catch (error) {
+    console.error('[Athos] Evento de políticas inválido:', error);
+  }
+}
+
+async function connect(): Promise<void> {
+  if (!config || controller) return;
+  const token = await config.getToken();
+  if (!token || controller) return;
+
+  const current = new AbortController();
+  controller = current;
+  let closedCleanly = false;
+  try {
+    const res = await fetch(`${config.apiUrl}/api/policies/stream`, {
+      headers: {
+        'Authorization': `Bearer ${token}`,
+        'Accept': 'text/event-stream'
+      },
+      cache: 'no-store',
+      signal: current.signal
+    });
+    if (res.status === 401) {
+      console.log('[Athos] Stream de políticas rechazado, se espera un nuevo token');
+      return;
+    }
+    if (!res.ok || !res.body) {
+      throw new Error(`HTTP ${res.status}`);
+    }
+
+    attempt = 0;
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true }).replace(/\r\n?/g, '\n');
+      let end: number;
+      while ((end = buffer.indexOf('\n\n')) !== -1) {
+        dispatch(buffer.slice(0, end));
+        buffer = buffer.slice(end + 2);
+      }
+    }
+    // El servidor cierra el stream periódicamente: se reconecta tras su retry
+    closedCleanly = true;
+  } catch (error) {
+    if (current.signal.aborted) return;
+    console.warn('[Athos] Stream de políticas interrumpido:', error);
+  } finally {
+    if (controller === current) controller = null;
+  }
+  // Jitter para que las extensiones no vuelvan a preguntar todas a la vez
+  scheduleReconnect(closedCleanly ? serverRetryMs * (1 + Math.random() * 0.2) : undefined);
+}
+
+export function startPolicyStream(options: StreamConfig): void {
+  config = options;
+  connect();
+}
+
+// Cierra la conexión actual y vuelve a conectar (p. ej. con un token nuevo)
+export function restartPolicyStream(): void {
+  stopPolicyStream(false);
+  attempt = 0;
+  connect();
+}
+
+export function stopPolicyStream(forget = true): void {
+  if (reconnectTimer) {
+    clearTimeout(reconnectTimer);
+    reconnectTimer = null;
+  }
+  controller?.abort();
+  controller = null;
+  if (forget) config = null;
+}
@@ -0,0 +1,125 @@
+// Reglas de bloqueo compiladas por el backend (/api/policies/rules).
+// La decisión de cada navegación se toma en local, en el mismo orden que
+// verify_policies() del backend: catálogo de prohibidos, políticas del tenant
+// y políticas de los grupos del usuario; en cada capa gana el sufijo de
+// dominio más específico.
+
+export interface RuleDecision {
+  action: 'block' | 'allow';
+  category?: string | null;
+  block_reason?: string | null;
+}
+
+interface RuleSetPayload {
+  format: number;
+  prohibited: Record<string, string[]>;
+  policies: Record<string, RuleDecision>;
+  group_policies: Record<string, RuleDecision>;
+}
+
+interface CompiledRuleSet {
+  prohibited: Map<string, string>;
+  policies: Map<string, RuleDecision>;
+  groupPolicies: Map<string, RuleDecision>;
+}
+
+const STORAGE_KEY = 'policy_rules';
+const ETAG_KEY = 'policy_rules_etag';
+const SUPPORTED_FORMAT = 1;
+
+let compiled: CompiledRuleSet | null = null;
+let loading: Promise<CompiledRuleSet | null> | null = null;
+
+function compile(payload: RuleSetPayload): CompiledRuleSet | null {
+  if (payload.format !== SUPPORTED_FORMAT) {
+    console.warn('[Athos] Formato de reglas no soportado:', payload.format);
+    return null;
+  }
+  const prohibited = new Map<string, string>();
+  for (const [category, domains] of Object.entries(payload.prohibited || {})) {
+    for (const domain of domains) {
+      if (!prohibited.has(domain)) prohibited.set(domain, category);
+    }
+  }
+  return {
+    prohibited,
+    policies: new Map(Object.entries(payload.policies || {})),
+    groupPolicies: new Map(Object.entries(payload.group_policies || {}))
+  };
+}
+
+// Mismo criterio que normalize_domain() del backend
+function normalizeHostname(hostname: string): string {
+  const host = hostname.toLowerCase().replace(/\.+$/, '');
+  return host.startsWith('www.') ? host.slice(4) : host;
+}
+
+function lookup<T>(index: Map<string, T>, hostname: string): T | undefined {
+  const labels = hostname.split('.');
+  for (let i = 0; i < labels.length; i++) {
+    const value = index.get(labels.slice(i).join('.'));
+    if (value !== undefined) return value;
+  }
+  return undefined;
+}
+
+// Reglas en memoria o, tras reiniciar el service worker, las guardadas
+async function current(): Promise<CompiledRuleSet | null> {
+  if (compiled) return compiled;
+  if (!loading) {
+    loading = chrome.storage.local.get(STORAGE_KEY)
+      .then(stored => {
+        if (!compiled && stored[STORAGE_KEY]) compiled = compile(stored[STORAGE_KEY]);
+        return compiled;
+      })
+      .finally(() => { loading = null; });
+  }
+  return loading;
+}
+
+// Decisión para un hostname; null si todavía no se descargaron reglas
+export async function evaluateHostname(hostname: string): Promise<RuleDecision | null> {
+  const rules = await current();
+  if (!rules) return null;
+  const host = normalizeHostname(hostname);
+
+  const category = lookup(rules.prohibited, host);
+  if (category !== undefined) {
+    return { action: 'block', category, block_reason: `Sitio bloqueado por ${category}` };
+  }
+  return lookup(rules.policies, host)
+    ?? lookup(rules.groupPolicies, host)
+    ?? { action: 'allow' };
+}
+
+// Descarga las reglas si cambiaron (If-None-Match); devuelve el status HTTP
+export async function syncRuleSet(apiUrl: string, token: string): Promise<number> {
+  const { [ETAG_KEY]: etag } = await chrome.storage.local.get(ETAG_KEY);
+  const headers: Record<string, string> = { 'Authorization': `Bearer ${token}` };
+  // Sin reglas en memoria ni guardadas el ETag no sirve de nada
+  if (etag && await current()) {
+    headers['If-None-Match'] = etag;
+  }
+
+  const res = await fetch(`${apiUrl}/api/policies/rules`, { headers, cache: 'no-store' });
+  if (res.status === 304 || !res.ok) {
+    return res.status;
+  }
+  const payload: RuleSetPayload = await res.json();
+  const rules = compile(payload);
+  if (rules) {
+    compiled = rules;
+    await chrome.storage.local.set({ [STORAGE_KEY]: payload, [ETAG_KEY]: res.headers.get('ETag') });
+    console.log('[Athos] Reglas de bloqueo actualizadas:', {
+      prohibited: rules.prohibited.size,
+      policies: rules.policies.size,
+      group_policies: rules.groupPolicies.size
+    });
+  }
+  return res.status;
+}
+
+export async function clearRuleSet(): Promise<void> {
+  compiled = null;
+  await chrome.storage.local.remove([STORAGE_KEY, ETAG_KEY]);
+}